@@ -0,0 +1,199 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# Requests are sorted into classes, highest priority first. A class may run at
+# most its own limit concurrently, and all classes together at most
+# ADMISSION_MAX_CONCURRENT, which should stay a little under the database pool
+# size (5 + 10 overflow by default) so admitted requests rarely wait on it.
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", "12"))
+ADMISSION_LIMITS = {
+    "clinical": int(os.environ.get("ADMISSION_CLINICAL_LIMIT", "12")),
+    "standard": int(os.environ.get("ADMISSION_STANDARD_LIMIT", "8")),
+    "analytics": int(os.environ.get("ADMISSION_ANALYTICS_LIMIT", "3")),
+    # Long-running streams; kept few so they cannot crowd out dashboards
+    "exports": int(os.environ.get("ADMISSION_EXPORT_LIMIT", "2")),
+}
+# Waiting requests per class; past this, new arrivals are shed at once
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", "50"))
+# A queued request that is not admitted within this many seconds is shed
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", "5"))
+# Smoothing factor of the per-class latency average behind Retry-After
+LATENCY_ALPHA = 0.2
+
+# Never queued: liveness, the metrics and profiles used to watch this, and long-lived streams
+EXEMPT_PREFIXES = ("/health", "/metrics", "/admin/profile", "/statistics/stream", "/docs", "/redoc", "/openapi.json")
+CLINICAL_PREFIXES = ("/appointments", "/medications", "/reminders", "/auth", "/feedback", "/patients", "/doctor")
+ANALYTICS_PREFIXES = ("/statistics", "/analytics", "/archive", "/audit", "/sync", "/patients/duplicates")
+# Unpaginated listings that read whole tables
+FULL_LISTINGS = {"/patients", "/doctor", "/feedback", "/appointments", "/medications", "/reminders"}
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+def classify(method: str, path: str):
+    """Admission class of a request, or None if it bypasses admission control"""
+    if path.startswith(EXEMPT_PREFIXES) or method == "OPTIONS":
+        return None
+    if path.startswith("/exports"):
+        return "exports"
+    # Any method under the analytics prefixes; only reads of the full listings
+    if path.startswith(ANALYTICS_PREFIXES) or (method == "GET" and path.rstrip("/") in FULL_LISTINGS):
+        return "analytics"
+    if method in WRITE_METHODS and path.startswith(CLINICAL_PREFIXES):
+        return "clinical"
+    return "standard"
+
+class AdmissionController:
+    """Per-class concurrency limits with bounded, priority-ordered waiting.
+
+    Lives on the event loop, so no locking is needed around admission
+    itself; the lock only guards the counters read by ``snapshot`` from
+    other threads. When a slot frees up it goes to the oldest waiter of the
+    highest-priority class that is under its own limit.
+    """
+
+    def __init__(self, limits=ADMISSION_LIMITS, max_concurrent=ADMISSION_MAX_CONCURRENT,
+                 queue_size=ADMISSION_QUEUE_SIZE, max_wait=ADMISSION_MAX_WAIT_SECONDS):
+        self.limits = dict(limits)
+        self.priority = list(self.limits)
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = dict.fromkeys(self.limits, 0)
+        self.waiting = {name: deque() for name in self.limits}
+        self.latency = dict.fromkeys(self.limits, 0.0)
+        self.lock = threading.Lock()
+        self.stats = {
+            name: {"admitted": 0, "queued": 0, "shed": 0, "timedOut": 0, "waitSeconds": 0.0, "maxDepth": 0}
+            for name in self.limits
+        }
+
+    def has_room(self, name) -> bool:
+        return self.active[name] < self.limits[name] and sum(self.active.values()) < self.max_concurrent
+
+    def admit(self, name, waited=0.0):
+        self.active[name] += 1
+        with self.lock:
+            self.stats[name]["admitted"] += 1
+            self.stats[name]["waitSeconds"] += waited
+
+    def count(self, name, counter):
+        with self.lock:
+            self.stats[name][counter] += 1
+
+    async def acquire(self, name) -> bool:
+        """Wait for a slot; False means the request should be shed"""
+        if self.has_room(name) and not self.waiting[name]:
+            self.admit(name)
+            return True
+        queue = self.waiting[name]
+        if len(queue) >= self.queue_size:
+            self.count(name, "shed")
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        started = time.monotonic()
+        with self.lock:
+            self.stats[name]["queued"] += 1
+            self.stats[name]["maxDepth"] = max(self.stats[name]["maxDepth"], len(queue))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done():  # Granted just as the wait ran out
+                self.release(name)
+            else:
+                queue.remove(future)
+            self.count(name, "timedOut")
+            self.count(name, "shed")
+            return False
+        except asyncio.CancelledError:  # Client went away while queued
+            if future.done():
+                self.release(name)
+            elif future in queue:
+                queue.remove(future)
+            raise
+        with self.lock:
+            self.stats[name]["waitSeconds"] += time.monotonic() - started
+        return True
+
+    def release(self, name, elapsed=None):
+        self.active[name] -= 1
+        if elapsed is not None:
+            self.latency[name] += LATENCY_ALPHA * (elapsed - self.latency[name])
+        for candidate in self.priority:
+            queue = self.waiting[candidate]
+            while queue and self.has_room(candidate):
+                future = queue.popleft()
+                if not future.done():
+                    self.admit(candidate)
+                    future.set_result(True)
+
+    def retry_after(self, name) -> int:
+        """Seconds until the queue ahead of a new request should have drained"""
+        backlog = len(self.waiting[name]) + self.active[name]
+        return max(1, math.ceil(self.latency[name] * backlog / max(self.limits[name], 1)))
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "maxConcurrent": self.max_concurrent,
+                "active": sum(self.active.values()),
+                "classes": {
+                    name: {
+                        "limit": self.limits[name],
+                        "active": self.active[name],
+                        "depth": len(self.waiting[name]),
+                        "queueLimit": self.queue_size,
+                        "latencyMs": round(self.latency[name] * 1000, 1),
+                        **stats,
+                        "waitSeconds": round(stats["waitSeconds"], 3),
+                    }
+                    for name, stats in self.stats.items()
+                },
+            }
+
+admission = AdmissionController()
+
+class AdmissionMiddleware:
+    """Admit, queue or shed each HTTP request according to its class.
+
+    A request holds its slot until the response body has been sent, so
+    streamed responses count against their class for as long as they run.
+    Shed requests get an immediate 503 with a Retry-After estimate.
+    """
+
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        name = classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.controller.acquire(name):
+            await self.reject(send, self.controller.retry_after(name))
+            return
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(name, time.monotonic() - started)
+
+    async def reject(self, send, retry_after: int):
+        body = json.dumps({"detail": "Server is busy, please retry shortly"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,10 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header, Response
+from sqlalchemy import insert, select, update, values, column, cast, or_, Integer
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from typing import List, Optional
 from pydantic import BaseModel
-from db.database import get_db
-from db.models import Appointment, Doctor, Patient
+from db.database import get_db, get_read_db
+from db.models import Appointment, AppointmentCategory, Doctor, Patient
 from app.auth import get_current_user
+from app.events import broadcaster
+from app.batch import parse_ids, in_request_order
+from app.writes import raise_for_constraint, etag, parse_if_match, check_version
+from app.audit import record_statement_changes
+from app.archive import appointment_source, with_archive
+from app.lookups import canonical
 from datetime import datetime
 
 router = APIRouter()
@@ -25,24 +34,75 @@ class AppointmentCreate(AppointmentBase):
 class AppointmentResponse(AppointmentBase):
     id: int
     created_at: datetime
+    version: Optional[int] = None
     doctor_name: Optional[str] = None
     patient_name: Optional[str] = None
     
     class Config:
         orm_mode = True
 
+class AppointmentBatchResponse(BaseModel):
+    items: List[AppointmentResponse]
+    missing: List[int]
+
+class StatusTransitionItem(BaseModel):
+    id: int
+    version: Optional[int] = None  # Omit to skip the concurrency check for this row
+
+class StatusTransition(BaseModel):
+    status: str
+    items: List[StatusTransitionItem]
+
+# Target status -> statuses an appointment may move to it from
+STATUS_TRANSITIONS = {
+    "completed": ("scheduled",),
+    "cancelled": ("scheduled",),
+    "scheduled": ("cancelled",),
+}
+MAX_TRANSITION_BATCH = 1000
+
+def appointment_query(db: Session, source=Appointment):
+    """Appointments with doctor and patient names resolved in the same query"""
+    return (
+        db.query(source, Doctor.name, Patient.id, Patient.first_name, Patient.last_name)
+        .outerjoin(Doctor, Doctor.id == source.doctor_id)
+        .outerjoin(Patient, Patient.id == source.patient_id)
+    )
+
+def filter_appointments(db: Session, patient_id=None, doctor_id=None, date=None, date_from=None, date_to=None, status=None):
+    """Filtered appointment listing; reads the archive too unless date/date_from is recent"""
+    source = appointment_source(date or date_from)
+    query = appointment_query(db, source)
+    if patient_id:
+        query = query.filter(source.patient_id == patient_id)
+    if doctor_id:
+        query = query.filter(source.doctor_id == doctor_id)
+    if date:
+        query = query.filter(source.date == date)
+    if date_from:
+        query = query.filter(source.date >= date_from)
+    if date_to:
+        query = query.filter(source.date <= date_to)
+    if status:
+        query = query.filter(source.status == status)
+    return with_names(query.order_by(source.id).all())
+
+def with_names(rows):
+    appointments = []
+    for appointment, doctor_name, patient_id, first_name, last_name in rows:
+        appointment.doctor_name = doctor_name
+        if patient_id is not None:
+            appointment.patient_name = f"{first_name} {last_name}"
+        appointments.append(appointment)
+    return appointments
+
 @router.post("/", response_model=AppointmentResponse, status_code=status.HTTP_201_CREATED)
 def create_appointment(appointment: AppointmentCreate, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    """Create a new appointment"""
-    
-    # Verify patient and doctor exist
-    patient = db.query(Patient).filter(Patient.id == appointment.patient_id).first()
-    if not patient:
-        raise HTTPException(status_code=404, detail=f"Patient with ID {appointment.patient_id} not found")
-    
-    doctor = db.query(Doctor).filter(Doctor.id == appointment.doctor_id).first()
-    if not doctor:
-        raise HTTPException(status_code=404, detail=f"Doctor with ID {appointment.doctor_id} not found")
+    """Create a new appointment.
+
+    The patient and doctor are checked by their foreign keys rather than
+    looked up first, and the names come back from the same statement.
+    """
     
     # Validate appointment date is not in the past
     current_date = datetime.now().strftime("%Y-%m-%d")
@@ -52,172 +112,221 @@ def create_appointment(appointment: AppointmentCreate, db: Session = Depends(get
             detail="Cannot schedule appointments for past dates"
         )
     
-    # Create appointment
-    db_appointment = Appointment(
-        patient_id=appointment.patient_id,
-        doctor_id=appointment.doctor_id,
-        date=appointment.date,
-        time=appointment.time,
-        category=appointment.category,
-        description=appointment.description,
-        status=appointment.status
+    # Insert and read back the row with names in one round-trip
+    category_id, category = canonical(db, AppointmentCategory, appointment.category)
+    new_appointment = (
+        insert(Appointment)
+        .values(
+            patient_id=appointment.patient_id,
+            doctor_id=appointment.doctor_id,
+            date=appointment.date,
+            time=appointment.time,
+            category=category,
+            category_id=category_id,
+            description=appointment.description,
+            status=appointment.status
+        )
+        .returning(*Appointment.__table__.c)
+        .cte("new_appointment")
     )
-    
-    db.add(db_appointment)
-    db.commit()
-    db.refresh(db_appointment)
-    
-    # Add doctor and patient names for the response
-    db_appointment.doctor_name = doctor.name
-    db_appointment.patient_name = f"{patient.first_name} {patient.last_name}"
-    
-    return db_appointment
+    try:
+        row = db.execute(
+            select(new_appointment, Doctor.name.label("doctor_name"), Patient.first_name, Patient.last_name)
+            .select_from(new_appointment)
+            .join(Doctor, Doctor.id == new_appointment.c.doctor_id)
+            .join(Patient, Patient.id == new_appointment.c.patient_id)
+        ).one()
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise_for_constraint(e, {
+            "appointments_patient_id_fkey": (404, f"Patient with ID {appointment.patient_id} not found"),
+            "appointments_doctor_id_fkey": (404, f"Doctor with ID {appointment.doctor_id} not found"),
+        }, "Database error during appointment creation")
+    broadcaster.publish("appointment.created", id=row.id, doctor_id=row.doctor_id, status=row.status)
+    
+    return {**row._mapping, "patient_name": f"{row.first_name} {row.last_name}"}
 
 @router.get("/", response_model=List[AppointmentResponse])
 def get_appointments(
     patient_id: Optional[int] = None, 
     doctor_id: Optional[int] = None, 
     date: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
     status: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
     """Get appointments with optional filters"""
-    
-    query = db.query(Appointment)
-    
-    # Apply filters if provided
-    if patient_id:
-        query = query.filter(Appointment.patient_id == patient_id)
-    
-    if doctor_id:
-        query = query.filter(Appointment.doctor_id == doctor_id)
-        
-    if date:
-        query = query.filter(Appointment.date == date)
-        
-    if status:
-        query = query.filter(Appointment.status == status)
-    
-    # Get appointments
-    appointments = query.all()
-    
-    # Add doctor and patient names for the response
-    for appointment in appointments:
-        doctor = db.query(Doctor).filter(Doctor.id == appointment.doctor_id).first()
-        patient = db.query(Patient).filter(Patient.id == appointment.patient_id).first()
-        
-        if doctor:
-            appointment.doctor_name = doctor.name
-        
-        if patient:
-            appointment.patient_name = f"{patient.first_name} {patient.last_name}"
-    
-    return appointments
+    return filter_appointments(db, patient_id, doctor_id, date, date_from, date_to, status)
+
+@router.get("/batch", response_model=AppointmentBatchResponse)
+def get_appointments_batch(
+    ids: str,
+    db: Session = Depends(get_read_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get several appointments in one query, in the order requested (?ids=1,2,3)"""
+    appointment_ids = parse_ids(ids)
+    source = with_archive(Appointment)
+    rows = appointment_query(db, source).filter(source.id.in_(appointment_ids)).all()
+    items, missing = in_request_order(with_names(rows), appointment_ids)
+    return {"items": items, "missing": missing}
+
+@router.post("/status")
+def transition_appointments(
+    transition: StatusTransition,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Move many appointments to one status, e.g. close a clinic day.
+
+    One UPDATE ... FROM (VALUES ...) applies every allowed transition whose
+    version still matches; rows it skipped are looked up once and reported
+    in ``conflicts`` as not_found, invalid_transition or version_mismatch.
+    """
+    target = transition.status
+    if target not in STATUS_TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown status {target}")
+    if not 0 < len(transition.items) <= MAX_TRANSITION_BATCH:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {MAX_TRANSITION_BATCH} items")
+    expected = {item.id: item.version for item in transition.items}
+
+    requested = values(column("id", Integer), column("version", Integer), name="requested").data(list(expected.items()))
+    previous = select(Appointment.id, Appointment.status).where(Appointment.id.in_(expected)).subquery("previous")
+    changed = db.execute(
+        update(Appointment)
+        .where(
+            Appointment.id == requested.c.id,
+            Appointment.id == previous.c.id,
+            # A column of only NULLs in VALUES is typed text, hence the cast
+            or_(requested.c.version.is_(None), Appointment.version == cast(requested.c.version, Integer)),
+            Appointment.status.in_(STATUS_TRANSITIONS[target]),
+        )
+        .values(status=target, version=Appointment.version + 1, updated_at=datetime.utcnow())
+        .returning(Appointment.id, Appointment.version, previous.c.status.label("previous_status"))
+        .execution_options(synchronize_session=False)
+    ).all()
+    record_statement_changes(db, Appointment.__tablename__, {
+        row.id: {"status": (row.previous_status, target)} for row in changed
+    })
+
+    updated_ids = {row.id for row in changed}
+    skipped = [appointment_id for appointment_id in expected if appointment_id not in updated_ids]
+    current = {
+        row.id: row
+        for row in db.query(Appointment.id, Appointment.status, Appointment.version).filter(Appointment.id.in_(skipped))
+    } if skipped else {}
+    db.commit()
+    if changed:
+        previous = {}
+        for row in changed:
+            previous[row.previous_status] = previous.get(row.previous_status, 0) + 1
+        broadcaster.publish("appointment.status", status=target, previous=previous, moved=[
+            {"id": row.id, "previous": row.previous_status, "version": row.version} for row in changed
+        ])
+
+    conflicts = []
+    for appointment_id in skipped:
+        row = current.get(appointment_id)
+        if row is None:
+            conflicts.append({"id": appointment_id, "reason": "not_found"})
+        elif row.status not in STATUS_TRANSITIONS[target]:
+            conflicts.append({"id": appointment_id, "reason": "invalid_transition", "status": row.status, "version": row.version})
+        else:
+            conflicts.append({"id": appointment_id, "reason": "version_mismatch", "status": row.status, "version": row.version})
+    return {
+        "updated": [{"id": row.id, "version": row.version} for row in changed],
+        "conflicts": conflicts,
+    }
 
 @router.get("/{appointment_id}", response_model=AppointmentResponse)
 def get_appointment(
     appointment_id: int, 
+    response: Response,
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get a specific appointment by ID"""
-    
-    appointment = db.query(Appointment).filter(Appointment.id == appointment_id).first()
-    
-    if not appointment:
+    """Get a specific appointment by ID, archived or not.
+
+    The ETag is its version, for If-Match on update. Archived appointments
+    cannot be updated, so they are sent without one.
+    """
+    row = appointment_query(db).filter(Appointment.id == appointment_id).first()
+    if row:
+        response.headers["ETag"] = etag(row[0].version)
+        return with_names([row])[0]
+
+    source = with_archive(Appointment)
+    row = appointment_query(db, source).filter(source.id == appointment_id).first()
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Appointment with ID {appointment_id} not found"
         )
-    
-    # Add doctor and patient names for the response
-    doctor = db.query(Doctor).filter(Doctor.id == appointment.doctor_id).first()
-    patient = db.query(Patient).filter(Patient.id == appointment.patient_id).first()
-    
-    if doctor:
-        appointment.doctor_name = doctor.name
-    
-    if patient:
-        appointment.patient_name = f"{patient.first_name} {patient.last_name}"
-    
-    return appointment
+    return with_names([row])[0]
 
 @public_router.get("/", response_model=List[AppointmentResponse])
 def get_appointments_public(
     patient_id: Optional[int] = None,
     doctor_id: Optional[int] = None,
     date: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
     status: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get appointments with optional filters - public endpoint without authentication"""
-    
-    query = db.query(Appointment)
-    
-    # Apply filters if provided
-    if patient_id:
-        query = query.filter(Appointment.patient_id == patient_id)
-    
-    if doctor_id:
-        query = query.filter(Appointment.doctor_id == doctor_id)
-        
-    if date:
-        query = query.filter(Appointment.date == date)
-        
-    if status:
-        query = query.filter(Appointment.status == status)
-    
-    # Get appointments
-    appointments = query.all()
-    
-    # Add doctor and patient names for the response
-    for appointment in appointments:
-        doctor = db.query(Doctor).filter(Doctor.id == appointment.doctor_id).first()
-        patient = db.query(Patient).filter(Patient.id == appointment.patient_id).first()
-        
-        if doctor:
-            appointment.doctor_name = doctor.name
-        
-        if patient:
-            appointment.patient_name = f"{patient.first_name} {patient.last_name}"
-    
-    return appointments
+    return filter_appointments(db, patient_id, doctor_id, date, date_from, date_to, status)
 
 @router.put("/{appointment_id}", response_model=AppointmentResponse)
 def update_appointment(
     appointment_id: int, 
     appointment: AppointmentCreate, 
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Update an existing appointment"""
-    
-    db_appointment = db.query(Appointment).filter(Appointment.id == appointment_id).first()
-    
-    if not db_appointment:
+    """Update an existing appointment.
+
+    Send the version from GET as ``If-Match`` to fail with 409 instead of
+    overwriting someone else's change. Without it the update still cannot
+    clobber a write that lands between this request's read and its write.
+    """
+    expected = parse_if_match(if_match)
+    row = appointment_query(db).filter(Appointment.id == appointment_id).first()
+    
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Appointment with ID {appointment_id} not found"
         )
+    db_appointment = with_names([row])[0]
+    check_version(db_appointment.version, expected, "Appointment")
+    linked = (db_appointment.doctor_id, db_appointment.patient_id)
+    previous_status = db_appointment.status
     
     # Update appointment fields
     for key, value in appointment.dict().items():
         setattr(db_appointment, key, value)
-    
-    db.commit()
-    db.refresh(db_appointment)
-    
-    # Add doctor and patient names for the response
-    doctor = db.query(Doctor).filter(Doctor.id == db_appointment.doctor_id).first()
-    patient = db.query(Patient).filter(Patient.id == db_appointment.patient_id).first()
-    
-    if doctor:
-        db_appointment.doctor_name = doctor.name
-    
-    if patient:
-        db_appointment.patient_name = f"{patient.first_name} {patient.last_name}"
-    
+    db_appointment.category_id, db_appointment.category = canonical(db, AppointmentCategory, appointment.category)
+    
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Appointment was modified by someone else; reload and retry")
+    if db_appointment.status != previous_status:
+        broadcaster.publish("appointment.status", status=db_appointment.status, previous={previous_status: 1}, moved=[
+            {"id": db_appointment.id, "previous": previous_status, "version": db_appointment.version}
+        ])
+    
+    # Names come from the first query unless the update moved the appointment
+    if (appointment.doctor_id, appointment.patient_id) != linked:
+        db_appointment = with_names([appointment_query(db).filter(Appointment.id == appointment_id).one()])[0]
+    response.headers["ETag"] = etag(db_appointment.version)
     return db_appointment
 
 @router.delete("/{appointment_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -238,5 +347,8 @@ def delete_appointment(
     
     db.delete(db_appointment)
     db.commit()
+    broadcaster.publish(
+        "appointment.deleted", id=appointment_id, doctor_id=db_appointment.doctor_id, status=db_appointment.status
+    )
     
     return None
\ No newline at end of file
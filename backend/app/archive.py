@@ -0,0 +1,172 @@
+from fastapi import APIRouter, Depends, Query, status
+from sqlalchemy import select, insert, delete, union_all, and_, func, literal
+from sqlalchemy.orm import Session, aliased
+from datetime import datetime, date, timedelta
+from typing import Optional
+import os
+import sys
+from db.database import SessionLocal, get_db
+from db.models import Feedback, Appointment, MedicationReminder, Tombstone, ARCHIVE_TABLES
+from app.auth import require_admin
+from app.jobs import job, enqueue, job_response
+from app.dates import sql_date
+from app.sync import COLLECTION_BY_MODEL
+
+router = APIRouter(prefix="/archive", tags=["Archive"])
+
+ARCHIVE_BATCH_SIZE = 1000
+FEEDBACK_RETENTION_DAYS = int(os.environ.get("FEEDBACK_RETENTION_DAYS", "365"))
+APPOINTMENT_RETENTION_DAYS = int(os.environ.get("APPOINTMENT_RETENTION_DAYS", "365"))
+# Soft-deleted reminders leave the hot table this long after deactivation
+INACTIVE_REMINDER_RETENTION_DAYS = int(os.environ.get("INACTIVE_REMINDER_RETENTION_DAYS", "30"))
+
+def days_ago(days):
+    return datetime.utcnow() - timedelta(days=days)
+
+# Collection -> (model, condition for rows that belong in the archive)
+ARCHIVE_POLICIES = {
+    "feedback": (
+        Feedback,
+        lambda: Feedback.created_at < days_ago(FEEDBACK_RETENTION_DAYS),
+    ),
+    "appointments": (
+        Appointment,
+        # date is free text; rows whose date does not parse stay in the hot table
+        lambda: sql_date(Appointment.date) < days_ago(APPOINTMENT_RETENTION_DAYS).date(),
+    ),
+    "reminders": (
+        MedicationReminder,
+        lambda: and_(
+            MedicationReminder.is_active == False,
+            MedicationReminder.updated_at < days_ago(INACTIVE_REMINDER_RETENTION_DAYS),
+        ),
+    ),
+}
+
+def archive_batch(db: Session, collection: str, batch_size=ARCHIVE_BATCH_SIZE) -> int:
+    """Move up to ``batch_size`` eligible rows to the archive in one statement.
+
+    DELETE ... RETURNING feeds INSERT ... SELECT, so a row is never in both
+    tables or in neither, and a sync tombstone is written for each row in
+    the same statement. Rows locked by other transactions are skipped and
+    picked up by a later batch.
+    """
+    model, condition = ARCHIVE_POLICIES[collection]
+    source = model.__table__
+    archive = ARCHIVE_TABLES[model]
+    names = [column.name for column in source.columns]
+
+    batch = (
+        select(source.c.id)
+        .where(condition())
+        .order_by(source.c.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    moved = delete(source).where(source.c.id.in_(batch)).returning(*source.columns).cte("moved")
+    archived = (
+        insert(archive)
+        .from_select(names + ["archived_at"], select(*[moved.c[name] for name in names], func.now()))
+        .returning(archive.c.id)
+        .cte("archived")
+    )
+    statement = (
+        insert(Tombstone)
+        .from_select(
+            ["collection", "record_id", "deleted_at"],
+            select(literal(COLLECTION_BY_MODEL[model]), archived.c.id, func.timezone("utc", func.now())),
+        )
+        .add_cte(moved)
+        .add_cte(archived)
+    )
+    return db.execute(statement).rowcount
+
+def run_archival(collections=None, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None) -> dict:
+    """Archive every eligible row, one short transaction per batch"""
+    moved = {}
+    db = SessionLocal()
+    try:
+        for collection in collections or ARCHIVE_POLICIES:
+            moved[collection] = 0
+            batches = 0
+            while max_batches is None or batches < max_batches:
+                count = archive_batch(db, collection, batch_size)
+                db.commit()
+                moved[collection] += count
+                batches += 1
+                if count < batch_size:
+                    break
+        return moved
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def with_archive(model):
+    """``model`` over its hot rows UNION ALL its archived rows.
+
+    The result is an aliased entity usable anywhere the model is; rows load
+    as ordinary model instances. Filters on it are pushed into both halves
+    of the union, so the indexes on each table still apply.
+    """
+    source = model.__table__
+    archive = ARCHIVE_TABLES[model]
+    rows = union_all(
+        select(*source.columns),
+        select(*[archive.c[column.name] for column in source.columns]),
+    ).subquery(f"{source.name}_all")
+    return aliased(model, rows)
+
+def feedback_source(since: Optional[datetime]):
+    """Feedback entity to read from for rows created at or after ``since``.
+
+    Only a ``since`` inside the retention period can skip the archive; with
+    no lower bound archived rows may match whatever the other filters are.
+    """
+    if since is not None and since >= days_ago(FEEDBACK_RETENTION_DAYS):
+        return Feedback
+    return with_archive(Feedback)
+
+def appointment_source(earliest_date: Optional[str]):
+    """Appointment entity to read from for appointments on or after ``earliest_date``.
+
+    The archive is skipped only for a valid YYYY-MM-DD date inside the
+    retention period.
+    """
+    try:
+        earliest = date.fromisoformat(earliest_date) if earliest_date is not None else None
+    except ValueError:
+        earliest = None
+    if earliest is not None and earliest >= days_ago(APPOINTMENT_RETENTION_DAYS).date():
+        return Appointment
+    return with_archive(Appointment)
+
+@job("archive.run")
+def archive_job(context, payload):
+    """Archive each requested collection (default: all), reporting progress per collection"""
+    collections = payload.get("collections") or list(ARCHIVE_POLICIES)
+    moved = {}
+    for index, collection in enumerate(collections):
+        context.progress(index / len(collections), f"Archiving {collection}")
+        moved.update(run_archival([collection], max_batches=payload.get("max_batches")))
+    return {"moved": moved}
+
+@router.post("/run", status_code=status.HTTP_202_ACCEPTED)
+def run_archive(
+    collection: Optional[str] = Query(None, pattern=f"^({'|'.join(ARCHIVE_POLICIES)})$"),
+    max_batches: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Queue a job moving rows past their retention period into the archive tables.
+
+    Poll GET /jobs/{id} for progress and the number of rows moved.
+    """
+    queued = enqueue(db, "archive.run", {"collections": [collection] if collection else None, "max_batches": max_batches})
+    db.commit()
+    return job_response(queued)
+
+if __name__ == "__main__":
+    # Nightly cron entry point: python -m app.archive [collection ...]
+    print(run_archival(sys.argv[1:] or None))
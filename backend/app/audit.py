@@ -0,0 +1,272 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import event, inspect, insert
+from sqlalchemy.orm import Session
+from datetime import datetime, date
+from typing import Optional
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from db.database import SessionLocal, get_read_db
+from db.models import AuditLog, Doctor, Patient, Appointment, Medication, MedicationReminder
+from app.auth import current_actor, require_admin
+
+router = APIRouter(prefix="/audit", tags=["Audit"])
+
+AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_FLUSH_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL_SECONDS = 1.0
+AUDIT_FLUSH_RETRIES = 3
+# Batches the database would not take are appended here and written once it
+# accepts inserts again
+AUDIT_SPILL_PATH = os.environ.get("AUDIT_SPILL_PATH", "audit-spill.jsonl")
+AUDITED_MODELS = (Doctor, Patient, Appointment, Medication, MedicationReminder)
+AUDITED_TABLES = {model.__tablename__: model for model in AUDITED_MODELS}
+# Values never written to the log; a change shows up as ["***", "***"]
+REDACTED_COLUMNS = {"password"}
+# Bookkeeping that changes on every update and adds nothing to a diff
+IGNORED_COLUMNS = {"updated_at", "version"}
+PENDING_KEY = "audit_pending"
+
+def to_json(name, value):
+    if name in REDACTED_COLUMNS:
+        return "***"
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def capture(obj, action):
+    """One audit entry for a flushed object, with only the columns that matter.
+
+    Updates record [old, new] for changed columns; inserts and deletes record
+    the row as it was written or removed.
+    """
+    state = inspect(obj)
+    changes = {}
+    for attr in state.mapper.column_attrs:
+        name = attr.key
+        if name in IGNORED_COLUMNS:
+            continue
+        if action == "update":
+            history = state.attrs[name].history
+            if not history.has_changes():
+                continue
+            old = history.deleted[0] if history.deleted else None
+            new = history.added[0] if history.added else None
+            if old != new:
+                changes[name] = [to_json(name, old), to_json(name, new)]
+        elif name in state.dict:
+            changes[name] = to_json(name, state.dict[name])
+    return {
+        "table_name": state.mapper.local_table.name,
+        "record_id": state.identity[0] if state.identity else obj.id,
+        "action": action,
+        "changes": changes,
+        "actor": current_actor.get(),
+        "changed_at": datetime.utcnow(),
+    }
+
+@event.listens_for(Session, "after_flush")
+def collect_changes(session, flush_context):
+    """Diff audited objects while their attribute history is still available"""
+    pending = session.info.setdefault(PENDING_KEY, [])
+    for obj in session.new:
+        if isinstance(obj, AUDITED_MODELS):
+            pending.append(capture(obj, "insert"))
+    for obj in session.dirty:
+        if isinstance(obj, AUDITED_MODELS) and session.is_modified(obj, include_collections=False):
+            entry = capture(obj, "update")
+            if entry["changes"]:
+                pending.append(entry)
+    for obj in session.deleted:
+        if isinstance(obj, AUDITED_MODELS):
+            pending.append(capture(obj, "delete"))
+
+def record_statement_changes(session, table_name: str, changes_by_id: dict):
+    """Queue update entries for rows changed by a Core statement.
+
+    Set-based UPDATEs bypass the flush hooks; ``changes_by_id`` maps record
+    id -> {column: [old, new]}. Like flushed changes, the entries are only
+    written if the session commits.
+    """
+    pending = session.info.setdefault(PENDING_KEY, [])
+    actor = current_actor.get()
+    now = datetime.utcnow()
+    for record_id, changes in changes_by_id.items():
+        pending.append({
+            "table_name": table_name,
+            "record_id": record_id,
+            "action": "update",
+            "changes": {name: [to_json(name, old), to_json(name, new)] for name, (old, new) in changes.items()},
+            "actor": actor,
+            "changed_at": now,
+        })
+
+@event.listens_for(Session, "after_commit")
+def publish_changes(session):
+    """Hand committed changes to the writer; nothing is written on the request path"""
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending:
+        audit_writer.submit(pending)
+
+@event.listens_for(Session, "after_rollback")
+def discard_changes(session):
+    session.info.pop(PENDING_KEY, None)
+
+class AuditWriter:
+    """Buffers committed audit entries and appends them to audit_log in batches.
+
+    ``submit`` never blocks: if the buffer is full the entries are dropped and
+    counted in ``stats["dropped"]`` rather than slowing the request down.
+    A writer thread inserts up to AUDIT_FLUSH_BATCH_SIZE entries per
+    statement. A batch that still fails after AUDIT_FLUSH_RETRIES attempts
+    is spilled to a file and replayed after the next successful flush or
+    on the next start; ``stats["failed"]`` counts only entries that could
+    not be spilled either. Entries still buffered are written on graceful
+    shutdown and lost if the process is killed.
+    """
+
+    def __init__(self, max_size=AUDIT_QUEUE_SIZE, spill_path=AUDIT_SPILL_PATH):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.spill_path = spill_path
+        self.stopping = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {"queued": 0, "written": 0, "dropped": 0, "spilled": 0, "replayed": 0, "failed": 0, "flushes": 0}
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name="audit-writer", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=10):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def submit(self, entries):
+        queued = dropped = 0
+        for entry in entries:
+            try:
+                self.queue.put_nowait(entry)
+                queued += 1
+            except queue.Full:
+                dropped += 1
+        with self.lock:
+            self.stats["queued"] += queued
+            self.stats["dropped"] += dropped
+
+    def next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=AUDIT_FLUSH_INTERVAL_SECONDS)]
+        except queue.Empty:
+            return []
+        while len(batch) < AUDIT_FLUSH_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        self.replay()
+        while not (self.stopping.is_set() and self.queue.empty()):
+            batch = self.next_batch()
+            if batch:
+                self.flush(batch)
+
+    def write(self, batch):
+        db = SessionLocal()
+        try:
+            db.execute(insert(AuditLog), batch)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def flush(self, batch):
+        for attempt in range(1, AUDIT_FLUSH_RETRIES + 1):
+            try:
+                self.write(batch)
+            except Exception:
+                print(f"Audit flush attempt {attempt} failed:", traceback.format_exc())
+                time.sleep(0.2 * attempt)
+                continue
+            with self.lock:
+                self.stats["written"] += len(batch)
+                self.stats["flushes"] += 1
+            self.replay()
+            return
+        self.spill(batch)
+
+    def spill(self, batch):
+        try:
+            with open(self.spill_path, "a") as spill:
+                for entry in batch:
+                    spill.write(json.dumps({**entry, "changed_at": entry["changed_at"].isoformat()}) + "\n")
+        except OSError as e:
+            print(f"Audit spill to {self.spill_path} failed, {len(batch)} entries lost: {str(e)}")
+            with self.lock:
+                self.stats["failed"] += len(batch)
+            return
+        with self.lock:
+            self.stats["spilled"] += len(batch)
+
+    def replay(self):
+        """Write spilled entries back to audit_log; they stay on disk if that fails"""
+        if not os.path.exists(self.spill_path):
+            return
+        try:
+            with open(self.spill_path) as spill:
+                entries = [json.loads(line) for line in spill if line.strip()]
+            for entry in entries:
+                entry["changed_at"] = datetime.fromisoformat(entry["changed_at"])
+            self.write(entries)  # One transaction, so a retry never duplicates entries
+        except Exception as e:
+            print(f"Audit spill replay failed: {str(e)}")
+            return
+        os.remove(self.spill_path)
+        with self.lock:
+            self.stats["replayed"] += len(entries)
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, "depth": self.queue.qsize(), "capacity": self.queue.maxsize}
+
+audit_writer = AuditWriter()
+
+@router.get("/{table_name}/{record_id}")
+def get_record_history(
+    table_name: str,
+    record_id: int,
+    before_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_read_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Newest-first change history of one record. Page with ``before_id``."""
+    if table_name not in AUDITED_TABLES:
+        raise HTTPException(status_code=404, detail=f"Table {table_name} is not audited")
+
+    query = db.query(AuditLog).filter(AuditLog.table_name == table_name, AuditLog.record_id == record_id)
+    if before_id is not None:
+        query = query.filter(AuditLog.id < before_id)
+    entries = query.order_by(AuditLog.id.desc()).limit(limit).all()
+    return {
+        "items": [
+            {
+                "id": entry.id,
+                "action": entry.action,
+                "changes": entry.changes,
+                "actor": entry.actor,
+                "changed_at": entry.changed_at.isoformat(),
+            }
+            for entry in entries
+        ],
+        "next_before_id": entries[-1].id if len(entries) == limit else None,
+    }
@@ -9,6 +9,10 @@ from passlib.context import CryptContext
 from pydantic import BaseModel
 from db.models import Doctor, Patient, Admin
 from fastapi.security import OAuth2PasswordBearer
+from app.events import broadcaster
+from contextvars import ContextVar
+from app.dedupe import index_patient
+import traceback
 
 # ---------------------- Settings ----------------------
 SECRET_KEY = "your_secret_key"
@@ -18,6 +22,8 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 router = APIRouter()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
+# "role:id" of the authenticated caller, for the audit log
+current_actor = ContextVar("current_actor", default=None)
 
 # ---------------------- Database Dependency ----------------------
 def get_db():
@@ -79,11 +85,17 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         if user is None:
             raise credentials_exception
             
+        current_actor.set(f"{user_role}:{user_id}")
         return {"id": user_id, "role": user_role, "user": user}
         
     except JWTError:
         raise credentials_exception
 
+async def require_admin(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
 @router.post("/token")
 def login(data: LoginRequest, db: Session = Depends(get_db)):
     email = data.email
@@ -135,6 +147,16 @@ def register_patient(data: PatientCreate, db: Session = Depends(get_db)):
     except IntegrityError:
         db.rollback()
         raise HTTPException(status_code=500, detail="Database error during registration")
+    broadcaster.publish("patient.created", patient_id=new_patient.id)
+
+    # Flag likely earlier registrations of the same person for review; this
+    # is a few indexed lookups and must never fail the registration itself.
+    try:
+        index_patient(db, new_patient)
+        db.commit()
+    except Exception:
+        db.rollback()
+        print("Duplicate check failed:", traceback.format_exc())
 
     return {
         "message": "Patient registered successfully",
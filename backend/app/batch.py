@@ -0,0 +1,30 @@
+from fastapi import HTTPException
+
+# Upper bound on ids per batch request; keeps the IN list and payload bounded
+MAX_BATCH_IDS = 100
+
+def parse_ids(ids: str):
+    """Parse a comma-separated id list, keeping first-seen order and dropping repeats"""
+    parsed = []
+    seen = set()
+    for part in ids.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            value = int(part)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid id: {part}")
+        if value not in seen:
+            seen.add(value)
+            parsed.append(value)
+    if not parsed:
+        raise HTTPException(status_code=400, detail="ids query parameter is required")
+    if len(parsed) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    return parsed
+
+def in_request_order(records, ids, key=lambda record: record.id):
+    """Return (records ordered as requested, ids that were not found)"""
+    by_id = {key(record): record for record in records}
+    return [by_id[i] for i in ids if i in by_id], [i for i in ids if i not in by_id]
@@ -0,0 +1,158 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+import hashlib
+import re
+
+from fastapi import Request, Response
+from sqlalchemy import event, func, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from db.models import TableVersion
+
+# Columns that move whenever rows are added or changed. Only the ones a model
+# actually has are used, so the same helper works for every table.
+WATERMARK_COLUMNS = ("id", "created_at", "updated_at")
+# Tables with a table_versions row (seeded by db/migrations.py)
+VERSIONED_TABLES = frozenset(("patients", "doctors", "appointments", "feedback"))
+# Target tables of INSERT/UPDATE/DELETE, also inside CTEs
+WRITTEN_TABLE = re.compile(r'\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+"?(\w+)', re.IGNORECASE)
+CHANGED_KEY = "caching_changed_tables"
+CONNECTIONS_KEY = "caching_connections"
+
+@event.listens_for(Engine, "after_cursor_execute")
+def note_written_tables(conn, cursor, statement, parameters, context, executemany):
+    tables = VERSIONED_TABLES.intersection(WRITTEN_TABLE.findall(statement))
+    if tables:
+        conn.info.setdefault(CHANGED_KEY, set()).update(tables)
+
+@event.listens_for(Session, "after_begin")
+def track_connection(session, transaction, connection):
+    session.info.setdefault(CONNECTIONS_KEY, []).append(connection.info)
+
+def _changed_tables(session):
+    changed = set()
+    for info in session.info.pop(CONNECTIONS_KEY, []):
+        changed |= info.pop(CHANGED_KEY, set())
+    return changed
+
+@event.listens_for(Session, "after_rollback")
+def forget_changes(session):
+    _changed_tables(session)
+
+@event.listens_for(Session, "after_commit")
+def bump_table_versions(session):
+    """Advance the version of every validated table the transaction wrote.
+
+    This runs after the commit, in its own autocommit statements, so a new
+    version is never visible before the data it stands for and writers never
+    hold the version row while their own transaction is open. If it fails,
+    listings can answer 304 with the old payload until the table's next write.
+    """
+    changed = _changed_tables(session)
+    if not changed:
+        return
+    try:
+        with session.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for table in sorted(changed):  # One row per statement: no lock-order deadlocks
+                conn.execute(
+                    update(TableVersion)
+                    .where(TableVersion.table_name == table)
+                    .values(version=TableVersion.version + 1, changed_at=datetime.utcnow())
+                )
+    except Exception as e:
+        print(f"Table version bump failed for {', '.join(sorted(changed))}: {str(e)}")
+
+def table_watermark(db: Session, model, *extra):
+    """Return a fingerprint of a table and the time it last changed.
+
+    Normally this is the table's version, one primary key lookup. Without a
+    version row (SQLite) it falls back to the row count plus max
+    id/timestamps: the count catches deletes, the maxima catch inserts and
+    updates. Extra aggregate expressions can be passed for state changes the
+    version does not cover.
+    """
+    version = (
+        db.query(TableVersion.version, TableVersion.changed_at)
+        .filter(TableVersion.table_name == model.__tablename__)
+        .first()
+    )
+    if version is not None:
+        values = [version.version] + (list(db.query(*extra).one()) if extra else [])
+        return values, version.changed_at
+
+    columns = [func.count(model.id)]
+    names = []
+    for name in WATERMARK_COLUMNS:
+        if hasattr(model, name):
+            columns.append(func.max(getattr(model, name)))
+            names.append(name)
+    columns.extend(extra)
+    row = db.query(*columns).one()
+
+    last_modified = None
+    for name, value in zip(names, row[1:]):
+        if isinstance(value, datetime) and (last_modified is None or value > last_modified):
+            last_modified = value
+    return list(row), last_modified
+
+def _http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+def _opaque_tag(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match uses"""
+    candidates = [_opaque_tag(tag.strip()) for tag in header.split(",")]
+    return "*" in candidates or _opaque_tag(etag) in candidates
+
+def conditional_get(request: Request, response: Response, db: Session, *sources):
+    """Apply ETag/Last-Modified validators to a listing endpoint.
+
+    ``sources`` are models, or ``(model, extra_expr, ...)`` tuples, whose
+    watermarks together determine the payload. The request's query string is
+    part of the ETag so filtered listings get their own validators.
+
+    Returns a bare 304 response when the client copy is still fresh, otherwise
+    sets the validator headers on ``response`` and returns None so the caller
+    goes on to build the payload.
+    """
+    parts = [request.url.path, str(request.query_params)]
+    last_modified = None
+    for source in sources:
+        model, extra = (source[0], source[1:]) if isinstance(source, tuple) else (source, ())
+        values, modified = table_watermark(db, model, *extra)
+        parts.append(model.__tablename__)
+        parts.extend(value.isoformat() if isinstance(value, datetime) else str(value) for value in values)
+        if modified is not None and (last_modified is None or modified > last_modified):
+            last_modified = modified
+
+    # Weak: the compression middleware may send the same payload as br, gzip
+    # or identity bytes, which a strong validator would have to tell apart
+    etag = 'W/"' + hashlib.sha1("|".join(parts).encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = _http_date(last_modified)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        not_modified = _etag_matches(if_none_match, etag)
+    else:
+        # If-Modified-Since only has one-second resolution, so it is a weaker
+        # check than the ETag and is ignored when both are sent.
+        not_modified = False
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and last_modified is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+                modified = last_modified if last_modified.tzinfo else last_modified.replace(tzinfo=timezone.utc)
+                not_modified = modified.replace(microsecond=0) <= since
+            except (TypeError, ValueError):
+                not_modified = False
+
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,141 @@
+import gzip
+import threading
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Content types that are already compressed or must be flushed as they are
+# produced (Server-Sent Events).
+SKIP_CONTENT_TYPES = ("image/", "audio/", "video/", "application/zip", "application/gzip", "text/event-stream")
+
+class CompressionStats:
+    """Running totals of how many bytes compression saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.responses = 0
+            self.compressed = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.by_encoding = {}
+
+    def record(self, encoding, size_in, size_out):
+        with self._lock:
+            self.responses += 1
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+            if encoding:
+                self.compressed += 1
+                self.by_encoding[encoding] = self.by_encoding.get(encoding, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            saved = self.bytes_in - self.bytes_out
+            return {
+                "responses": self.responses,
+                "compressed": self.compressed,
+                "bytesIn": self.bytes_in,
+                "bytesOut": self.bytes_out,
+                "bytesSaved": saved,
+                "ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else 1.0,
+                "byEncoding": dict(self.by_encoding),
+            }
+
+stats = CompressionStats()
+
+def choose_encoding(accept_encoding: str):
+    """Pick br or gzip from an Accept-Encoding header, honouring q=0."""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+class CompressionMiddleware:
+    """Compress large single-message responses with brotli or gzip.
+
+    Streaming responses (more than one body message) are passed through
+    untouched so SSE and export streams keep flushing as they are produced.
+    Every response that passes through is counted in ``stats`` so the bytes
+    saved can be read back from ``/metrics/compression``.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        encoding = choose_encoding(accept_encoding)
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            headers = [(k, v) for k, v in start_message["headers"]]
+            header_names = {k.lower() for k, _ in headers}
+            content_type = dict(headers).get(b"content-type", b"").decode("latin-1")
+            if message.get("more_body", False) or b"content-encoding" in header_names or content_type.startswith(SKIP_CONTENT_TYPES):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            use = encoding if len(body) >= self.minimum_size else None
+            payload = compress(body, use) if use else body
+            if use and len(payload) >= len(body):
+                use, payload = None, body
+            stats.record(use, len(body), len(payload))
+
+            if use:
+                headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+                headers.append((b"content-encoding", use.encode()))
+                headers.append((b"content-length", str(len(payload)).encode()))
+            if encoding or use:
+                headers.append((b"vary", b"Accept-Encoding"))
+            await send({**start_message, "headers": headers})
+            await send({"type": "http.response.body", "body": payload})
+
+        await self.app(scope, receive, send_wrapper)
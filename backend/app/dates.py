@@ -0,0 +1,27 @@
+from sqlalchemy import Date, DateTime, and_, case, cast
+
+# Appointment dates and times are free text. A YYYY-MM-DD string naming a
+# real calendar day (Gregorian leap years included), and an HH:MM[:SS] time.
+# Values are checked against these before any cast, because one malformed
+# row would otherwise abort the whole statement.
+ISO_DATE_PATTERN = (
+    r"^(\d{4}-(0[1-9]|1[0-2])-(0[1-9]|1\d|2[0-8])"
+    r"|\d{4}-(0[13-9]|1[0-2])-(29|30)"
+    r"|\d{4}-(0[13578]|1[02])-31"
+    r"|(\d\d(0[48]|[2468][048]|[13579][26])|([02468][048]|[13579][26])00)-02-29)$"
+)
+TIME_PATTERN = r"^([01]\d|2[0-3]):[0-5]\d(:[0-5]\d)?$"
+
+def sql_date(column):
+    """``column`` cast to a date, or NULL when it is not a valid ISO date"""
+    return case((column.regexp_match(ISO_DATE_PATTERN), cast(column, Date)), else_=None)
+
+def sql_datetime(date_column, time_column):
+    """The timestamp of a (date, time) text pair, or NULL when either is malformed"""
+    return case(
+        (
+            and_(date_column.regexp_match(ISO_DATE_PATTERN), time_column.regexp_match(TIME_PATTERN)),
+            cast(date_column + " " + time_column, DateTime),
+        ),
+        else_=None,
+    )
@@ -0,0 +1,348 @@
+from sqlalchemy import func, update, delete, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from collections import defaultdict
+from datetime import datetime
+from difflib import SequenceMatcher
+from itertools import combinations
+import os
+import re
+import unicodedata
+try:
+    import numpy
+except ImportError:  # Pairs are then scored one at a time
+    numpy = None
+from db.models import (
+    Patient, Feedback, Appointment, Medication, MedicationReminder,
+    PatientBlockingKey, DuplicateCandidate, ARCHIVE_TABLES,
+)
+
+# Pairs scoring at least this much are queued for review
+DUPLICATE_THRESHOLD = float(os.environ.get("DUPLICATE_THRESHOLD", "0.55"))
+# Blocks larger than this (a shared clinic phone, a very common name) are
+# skipped: they yield mostly noise, and a block of n costs n(n-1)/2
+# comparisons, so this caps a block at 19,900 pairs.
+MAX_BLOCK_SIZE = int(os.environ.get("DUPLICATE_MAX_BLOCK_SIZE", "200"))
+REBUILD_BATCH_SIZE = 1000
+# Cameroonian subscriber numbers have 9 digits; the last 9 ignore +237/00237
+PHONE_DIGITS = 9
+WEIGHTS = {"phone": 0.45, "name": 0.4, "email": 0.15}
+# Similarity below this floor contributes nothing
+SIMILARITY_FLOOR = 0.5
+# Tables whose patient_id moves to the surviving record on merge
+PATIENT_TABLES = (Feedback, Appointment, Medication, MedicationReminder)
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"), **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"), "l": "4", **dict.fromkeys("mn", "5"), "r": "6",
+}
+
+def fold(text) -> str:
+    """Lowercase ASCII letters only, so "Ndjéyé" and "ndjeye" compare equal"""
+    decomposed = unicodedata.normalize("NFKD", (text or "").casefold())
+    return "".join(ch for ch in decomposed if "a" <= ch <= "z")
+
+def soundex(name: str) -> str:
+    name = fold(name)
+    if not name:
+        return ""
+    code = name[0]
+    previous = SOUNDEX_CODES.get(name[0])
+    for ch in name[1:]:
+        digit = SOUNDEX_CODES.get(ch)
+        if digit and digit != previous:
+            code += digit
+        if ch not in "hw":
+            previous = digit
+    return (code + "000")[:4]
+
+def phone_key(phone) -> str:
+    digits = re.sub(r"\D", "", phone or "")
+    return digits[-PHONE_DIGITS:] if len(digits) >= PHONE_DIGITS else ""
+
+def email_local(email) -> str:
+    """Local part without dots or +tags: jean.paul+clinic@x and jeanpaul@y match"""
+    local = (email or "").split("@")[0].split("+")[0]
+    return fold(local)
+
+def features(patient) -> tuple:
+    """Everything scoring needs, normalized once per patient"""
+    first, last = fold(patient.first_name), fold(patient.last_name)
+    return (
+        patient.id,
+        phone_key(patient.phone_number),
+        first,
+        last,
+        email_local(patient.email),
+        soundex(first),
+        soundex(last),
+    )
+
+def blocking_keys(feature) -> set:
+    _, phone, _, _, email, first_code, last_code = feature
+    keys = set()
+    if phone:
+        keys.add(f"phone:{phone}")
+    if first_code and last_code:
+        # Sorted, so swapped first and last names land in the same block
+        keys.add("name:" + ":".join(sorted((first_code, last_code))))
+    if len(email) >= 4:
+        keys.add(f"email:{email}")
+    return keys
+
+def similarity(a: str, b: str) -> float:
+    if not a or not b:
+        return 0.0
+    ratio = 1.0 if a == b else SequenceMatcher(None, a, b).ratio()
+    return max(0.0, (ratio - SIMILARITY_FLOOR) / (1 - SIMILARITY_FLOOR))
+
+def score_pair(a, b):
+    """(score, reasons) for two feature tuples"""
+    components = {
+        "phone": 1.0 if a[1] and a[1] == b[1] else 0.0,
+        # Both names must match, so siblings sharing a surname and a phone
+        # are not one person; either order, for swapped first/last names
+        "name": max(
+            min(similarity(a[2], b[2]), similarity(a[3], b[3])),
+            min(similarity(a[2], b[3]), similarity(a[3], b[2])),
+        ),
+        "email": similarity(a[4], b[4]),
+    }
+    score = sum(WEIGHTS[name] * value for name, value in components.items())
+    return round(score, 4), {name: round(value, 3) for name, value in components.items() if value}
+
+def pairwise_similarity(left, right):
+    """similarity() of each left[i], right[i], computed once per distinct pair of strings.
+
+    Pairs from blocks repeat the same spellings many times over (a name
+    block shares its Soundex codes), so difflib runs far fewer times than
+    there are pairs.
+    """
+    values, codes = numpy.unique(numpy.concatenate([left, right]), return_inverse=True)
+    codes = codes.reshape(2, -1).astype(numpy.int64)
+    distinct, inverse = numpy.unique(codes[0] * len(values) + codes[1], return_inverse=True)
+    scores = numpy.fromiter(
+        (similarity(values[code // len(values)], values[code % len(values)]) for code in distinct.tolist()),
+        dtype=float, count=len(distinct),
+    )
+    return scores[inverse.reshape(-1)]
+
+def score_matrix(pairs, by_id):
+    """Score components of every pair as arrays: phone, name and email, one entry per pair"""
+    def column(side, index):
+        return numpy.array([by_id[pair[side]][index] for pair in pairs], dtype=str)
+
+    phone_low, phone_high = column(0, 1), column(1, 1)
+    first_low, first_high, last_low, last_high = column(0, 2), column(1, 2), column(0, 3), column(1, 3)
+    return {
+        "phone": ((phone_low == phone_high) & (phone_low != "")).astype(float),
+        # Same rule as score_pair: both names, either order
+        "name": numpy.maximum(
+            numpy.minimum(pairwise_similarity(first_low, first_high), pairwise_similarity(last_low, last_high)),
+            numpy.minimum(pairwise_similarity(first_low, last_high), pairwise_similarity(last_low, first_high)),
+        ),
+        "email": pairwise_similarity(column(0, 4), column(1, 4)),
+    }
+
+def scored(pairs, by_id):
+    """(low, high, score, reasons) for each pair that may reach the threshold"""
+    if numpy is None:
+        for low, high in pairs:
+            yield (low, high, *score_pair(by_id[low], by_id[high]))
+        return
+    components = score_matrix(pairs, by_id)
+    scores = sum(WEIGHTS[name] * values for name, values in components.items())
+    # Scores are rounded to 4 places before the comparison, as in score_pair
+    for index in numpy.nonzero(scores >= DUPLICATE_THRESHOLD - 0.0001)[0].tolist():
+        values = {name: float(components[name][index]) for name in components}
+        yield (
+            pairs[index][0],
+            pairs[index][1],
+            round(float(scores[index]), 4),
+            {name: round(value, 3) for name, value in values.items() if value},
+        )
+
+def score_pairs(pairs, by_id) -> list:
+    """Candidate rows for every pair of ids at or above the threshold.
+
+    With numpy the pairs are scored as arrays, one vectorized pass over all
+    of them; otherwise one at a time.
+    """
+    rows = []
+    now = datetime.utcnow()
+    for low, high, score, reasons in scored(sorted(pairs), by_id):
+        if score >= DUPLICATE_THRESHOLD:
+            rows.append({
+                "patient_id": low,
+                "duplicate_id": high,
+                "score": score,
+                "reasons": reasons,
+                "status": "open",
+                "created_at": now,
+            })
+    return rows
+
+def save_candidates(db: Session, rows):
+    # A pair already reviewed (dismissed or merged) keeps its decision
+    if rows:
+        db.execute(
+            pg_insert(DuplicateCandidate).on_conflict_do_nothing(
+                index_elements=[DuplicateCandidate.patient_id, DuplicateCandidate.duplicate_id]
+            ),
+            rows,
+        )
+
+def index_patient(db: Session, patient) -> list:
+    """(Re)index one patient and queue likely duplicates of it.
+
+    One delete and one insert for the patient's keys, two indexed lookups for
+    the block sizes and for everyone sharing a key, then scoring of just those few records. Returns
+    the candidate rows found. The caller commits.
+    """
+    db.execute(delete(PatientBlockingKey).where(PatientBlockingKey.patient_id == patient.id))
+    if patient.merged_into_id is not None:
+        return []
+    feature = features(patient)
+    keys = blocking_keys(feature)
+    if not keys:
+        return []
+    db.execute(insert(PatientBlockingKey), [{"patient_id": patient.id, "key": key} for key in keys])
+
+    sizes = (
+        db.query(PatientBlockingKey.key, func.count())
+        .filter(PatientBlockingKey.key.in_(keys))
+        .group_by(PatientBlockingKey.key)
+    )
+    small = [key for key, size in sizes if 1 < size <= MAX_BLOCK_SIZE]
+    if not small:
+        return []
+    others = (
+        db.query(Patient)
+        .join(PatientBlockingKey, PatientBlockingKey.patient_id == Patient.id)
+        .filter(PatientBlockingKey.key.in_(small), Patient.id != patient.id)
+        .distinct()
+    )
+    by_id = {patient.id: feature}
+    for other in others:
+        by_id[other.id] = features(other)
+
+    pairs = {(min(patient.id, other), max(patient.id, other)) for other in by_id if other != patient.id}
+    rows = score_pairs(pairs, by_id)
+    save_candidates(db, rows)
+    return rows
+
+def rebuild_index(db: Session) -> dict:
+    """Recompute every blocking key and re-score every block.
+
+    A single pass over patients builds the key -> ids blocks in memory; only
+    pairs inside the same block are compared, so the cost follows the block
+    sizes (at most MAX_BLOCK_SIZE^2 / 2 pairs each) rather than the square
+    of the patient count. The caller commits.
+    """
+    db.execute(delete(PatientBlockingKey))
+    blocks = defaultdict(list)
+    by_id = {}
+    batch = []
+    patients = (
+        db.query(Patient)
+        .filter(Patient.merged_into_id.is_(None))
+        .order_by(Patient.id)
+        .yield_per(REBUILD_BATCH_SIZE)
+    )
+    for patient in patients:
+        feature = features(patient)
+        by_id[patient.id] = feature
+        for key in blocking_keys(feature):
+            blocks[key].append(patient.id)
+            batch.append({"patient_id": patient.id, "key": key})
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            db.execute(insert(PatientBlockingKey), batch)
+            batch = []
+    if batch:
+        db.execute(insert(PatientBlockingKey), batch)
+
+    pairs = set()
+    skipped = 0
+    for ids in blocks.values():
+        if len(ids) > MAX_BLOCK_SIZE:
+            skipped += 1
+            continue
+        pairs.update(combinations(ids, 2))  # ids are ascending, so (low, high)
+    rows = score_pairs(pairs, by_id)
+    for start in range(0, len(rows), REBUILD_BATCH_SIZE):
+        save_candidates(db, rows[start:start + REBUILD_BATCH_SIZE])
+    return {
+        "patients": len(by_id),
+        "blocks": sum(1 for ids in blocks.values() if len(ids) > 1),
+        "oversizedBlocks": skipped,
+        "pairsScored": len(pairs),
+        "candidates": len(rows),
+    }
+
+def merge_patients(db: Session, candidate: DuplicateCandidate, keep_id: int) -> dict:
+    """Fold the other record of ``candidate`` into ``keep_id``.
+
+    Every row pointing at the duplicate, archived rows included, is re-pointed
+    with one UPDATE per table; updated_at is bumped so sync clients pick the
+    moves up, and moves in audited tables are written to the audit log. The duplicate stays as an inactive record with merged_into_id
+    set, so its id still resolves. The caller commits.
+    """
+    # app.auth indexes patients on registration, and app.audit imports app.auth
+    from app.audit import AUDITED_TABLES, record_statement_changes
+
+    merge_id = candidate.duplicate_id if keep_id == candidate.patient_id else candidate.patient_id
+    locked = {
+        patient.id: patient
+        for patient in db.query(Patient)
+        .filter(Patient.id.in_((keep_id, merge_id)))
+        .order_by(Patient.id)
+        .with_for_update()
+    }
+    survivor, duplicate = locked[keep_id], locked[merge_id]
+    now = datetime.utcnow()
+
+    moved = {}
+    for model in PATIENT_TABLES:
+        values = {"patient_id": keep_id, "updated_at": now}
+        if "version" in model.__table__.c:
+            values["version"] = model.version + 1
+        ids = db.execute(
+            update(model)
+            .where(model.patient_id == merge_id)
+            .values(**values)
+            .returning(model.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        moved[model.__tablename__] = len(ids)
+        if model.__tablename__ in AUDITED_TABLES:
+            record_statement_changes(db, model.__tablename__, {
+                record_id: {"patient_id": (merge_id, keep_id)} for record_id in ids
+            })
+        archive = ARCHIVE_TABLES.get(model)
+        if archive is not None:
+            moved[archive.name] = db.execute(
+                update(archive).where(archive.c.patient_id == merge_id).values(patient_id=keep_id)
+            ).rowcount
+
+    for field in ("first_name", "last_name", "phone_number"):
+        if not getattr(survivor, field) and getattr(duplicate, field):
+            setattr(survivor, field, getattr(duplicate, field))
+    duplicate.is_active = False
+    duplicate.merged_into_id = keep_id
+    candidate.status = "merged"
+    candidate.resolved_at = now
+
+    # The duplicate's other open pairs are now pairs of the survivor
+    db.execute(
+        update(DuplicateCandidate)
+        .where(
+            DuplicateCandidate.status == "open",
+            (DuplicateCandidate.patient_id == merge_id) | (DuplicateCandidate.duplicate_id == merge_id),
+        )
+        .values(status="dismissed", resolved_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.flush()
+    index_patient(db, duplicate)
+    index_patient(db, survivor)
+    return {"kept": keep_id, "merged": merge_id, "moved": moved}
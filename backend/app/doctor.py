@@ -1,12 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, status, Request, Response
+from sqlalchemy import func, distinct, insert
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from db.models import Doctor
-from db.database import SessionLocal
+from db.models import Doctor, Appointment, Feedback, DoctorRatingStat, Specialty
+from db.database import SessionLocal, get_read_db
 from pydantic import BaseModel
 from passlib.context import CryptContext
 from typing import Optional, List
 from app.schemas import DoctorCreate, DoctorResponse
+from app.caching import conditional_get
+from app.events import broadcaster
+from app.batch import parse_ids, in_request_order
+from app.writes import raise_for_constraint
+from app.lookups import find, canonical
+from app.archive import with_archive
 
 router = APIRouter()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -19,6 +26,62 @@ def get_db():
     finally:
         db.close()
 
+class DoctorBatchResponse(BaseModel):
+    items: List[DoctorResponse]
+    missing: List[int]
+
+# Sort keys accepted by the doctor listing
+DOCTOR_SORTS = ("rating", "load")
+
+def doctor_metrics_query(db: Session, doctor_ids=None):
+    """Doctors joined with their distinct-patient count and mean rating.
+
+    Patient counts come from a grouped subquery over live and archived
+    appointments and ratings from the running stats (which also cover
+    archived feedback), so a listing costs a single query however many
+    doctors it returns.
+    """
+    appointments = with_archive(Appointment)
+    patients = db.query(
+        appointments.doctor_id.label("doctor_id"),
+        func.count(distinct(appointments.patient_id)).label("patient_count"),
+    )
+    if doctor_ids is not None:
+        patients = patients.filter(appointments.doctor_id.in_(doctor_ids))
+    patients = patients.group_by(appointments.doctor_id).subquery()
+
+    patient_count = func.coalesce(patients.c.patient_count, 0).label("patient_count")
+    average_rating = func.coalesce(
+        DoctorRatingStat.rating_sum * 1.0 / func.nullif(DoctorRatingStat.ratings, 0), 0
+    ).label("average_rating")
+    query = (
+        db.query(Doctor, patient_count, average_rating)
+        .outerjoin(patients, patients.c.doctor_id == Doctor.id)
+        .outerjoin(DoctorRatingStat, DoctorRatingStat.doctor_id == Doctor.id)
+    )
+    if doctor_ids is not None:
+        query = query.filter(Doctor.id.in_(doctor_ids))
+    return query, patient_count, average_rating
+
+def get_doctor_metrics(db: Session, doctor_ids):
+    """Return {doctor_id: (patient_count, average_rating)} for the given doctors"""
+    doctor_ids = list(set(doctor_ids))
+    if not doctor_ids:
+        return {}
+    query, _, _ = doctor_metrics_query(db, doctor_ids)
+    return {doctor.id: (count, float(rating)) for doctor, count, rating in query}
+
+def doctor_response(doctor: Doctor, patient_count=0, average_rating=0.0):
+    return DoctorResponse(
+        id=doctor.id,
+        name=doctor.name or "Unknown",
+        specialty=doctor.specialty or "N/A",
+        email=doctor.email or "N/A",
+        is_active=doctor.is_active if doctor.is_active is not None else True,
+        patientCount=int(patient_count or 0),
+        averageRating=round(float(average_rating or 0), 2)
+    )
+
 # Routes
 @router.get("/profile", response_model=DoctorResponse, status_code=status.HTTP_200_OK)
 def get_doctor_profile(email: str, db: Session = Depends(get_db)):
@@ -28,35 +91,36 @@ def get_doctor_profile(email: str, db: Session = Depends(get_db)):
     doctor = db.query(Doctor).filter(Doctor.email == email.lower()).first()
     if not doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
-    return DoctorResponse(
-        id=doctor.id,
-        name=doctor.name,
-        specialty=doctor.specialty,
-        email=doctor.email,
-        is_active=doctor.is_active,
-        patientCount=0,
-        averageRating=0.0
-    )
+    return doctor_response(doctor, *get_doctor_metrics(db, [doctor.id]).get(doctor.id, (0, 0.0)))
 
 @router.get("", response_model=List[DoctorResponse], status_code=status.HTTP_200_OK)
-def get_all_doctors(specialty: Optional[str] = None, db: Session = Depends(get_db)):
-    """Return a list of all doctors, optionally filtered by specialty"""
+def get_all_doctors(request: Request, response: Response, specialty: Optional[str] = None, sort: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """Return a list of all doctors, optionally filtered by specialty.
+
+    ``sort=rating`` orders by mean rating and ``sort=load`` by distinct
+    patient count, both highest first.
+    """
+    if sort is not None and sort not in DOCTOR_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(DOCTOR_SORTS)}")
+    # patientCount and averageRating move with appointments and feedback too
+    not_modified = conditional_get(request, response, db, Doctor, Appointment, Feedback)
+    if not_modified:
+        return not_modified
     try:
-        query = db.query(Doctor)
+        query, patient_count, average_rating = doctor_metrics_query(db)
         if specialty:
-            query = query.filter(Doctor.specialty.ilike(specialty))
-        doctors = query.all()
+            # Any spelling of the specialty, matched by its integer id
+            match = find(db, Specialty, specialty)
+            if match is None:
+                return []
+            query = query.filter(Doctor.specialty_id == match.id)
+        if sort == "rating":
+            query = query.order_by(average_rating.desc(), Doctor.id)
+        elif sort == "load":
+            query = query.order_by(patient_count.desc(), Doctor.id)
         return [
-            DoctorResponse(
-                id=doctor.id,
-                name=doctor.name or "Unknown",
-                specialty=doctor.specialty or "N/A",
-                email=doctor.email or "N/A",
-                is_active=doctor.is_active if doctor.is_active is not None else True,
-                patientCount=doctor.patientCount if hasattr(doctor, 'patientCount') else 0,
-                averageRating=doctor.averageRating if hasattr(doctor, 'averageRating') else 0.0
-            )
-            for doctor in doctors
+            doctor_response(doctor, count, rating)
+            for doctor, count, rating in query.all()
         ]
     except Exception as e:
         print(f"Error fetching doctors: {str(e)}")
@@ -64,57 +128,52 @@ def get_all_doctors(specialty: Optional[str] = None, db: Session = Depends(get_d
 
 @router.post("", response_model=DoctorResponse, status_code=status.HTTP_201_CREATED)
 def create_doctor(data: DoctorCreate, db: Session = Depends(get_db)):
-    """Create a new doctor"""
-    existing = db.query(Doctor).filter_by(email=data.email).first()
-    if existing:
-        raise HTTPException(status_code=409, detail="Email already registered")
-
+    """Create a new doctor. Duplicate emails are caught by the unique index."""
     hashed_password = pwd_context.hash(data.password) if data.password else None
 
-    new_doctor = Doctor(
-        name=data.name,
-        specialty=data.specialty,
-        email=data.email,
-        password=hashed_password,
-        is_active=True
-    )
-
     try:
-        db.add(new_doctor)
+        specialty_id, specialty = canonical(db, Specialty, data.specialty)
+        new_doctor = db.scalars(
+            insert(Doctor)
+            .values(
+                name=data.name,
+                specialty=specialty,
+                specialty_id=specialty_id,
+                email=data.email,
+                password=hashed_password,
+                is_active=True
+            )
+            .returning(Doctor)
+        ).one()
         db.commit()
-        db.refresh(new_doctor)
-    except IntegrityError:
+    except IntegrityError as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail="Database error during doctor creation")
+        raise_for_constraint(e, {
+            "ix_doctors_email": (409, "Email already registered"),
+        }, "Database error during doctor creation")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+    broadcaster.publish("doctor.created", doctor_id=new_doctor.id)
 
-    return DoctorResponse(
-        id=new_doctor.id,
-        name=new_doctor.name,
-        specialty=new_doctor.specialty,
-        email=new_doctor.email,
-        is_active=new_doctor.is_active,
-        patientCount=0,
-        averageRating=0.0
-    )
+    return doctor_response(new_doctor)
+
+@router.get("/batch", response_model=DoctorBatchResponse, status_code=status.HTTP_200_OK)
+def get_doctors_batch(ids: str, db: Session = Depends(get_read_db)):
+    """Return several doctors in one query, in the order requested (?ids=1,2,3)"""
+    doctor_ids = parse_ids(ids)
+    query, _, _ = doctor_metrics_query(db, doctor_ids)
+    rows, missing = in_request_order(query.all(), doctor_ids, key=lambda row: row[0].id)
+    return DoctorBatchResponse(items=[doctor_response(*row) for row in rows], missing=missing)
 
 @router.get("/{doctor_id}", response_model=DoctorResponse, status_code=status.HTTP_200_OK)
 def get_doctor(doctor_id: int, db: Session = Depends(get_db)):
     """Return the doctor with the specified ID"""
-    doctor = db.query(Doctor).filter(Doctor.id == doctor_id).first()
-    if not doctor:
+    query, _, _ = doctor_metrics_query(db, [doctor_id])
+    row = query.first()
+    if not row:
         raise HTTPException(status_code=404, detail="Doctor not found")
-    return DoctorResponse(
-        id=doctor.id,
-        name=doctor.name,
-        specialty=doctor.specialty,
-        email=doctor.email,
-        is_active=doctor.is_active if doctor.is_active is not None else True,
-        patientCount=0,
-        averageRating=0.0
-    )
+    return doctor_response(*row)
 
 @router.put("/{doctor_id}", response_model=DoctorResponse, status_code=status.HTTP_200_OK)
 def update_doctor(doctor_id: int, data: DoctorCreate, db: Session = Depends(get_db)):
@@ -128,11 +187,15 @@ def update_doctor(doctor_id: int, data: DoctorCreate, db: Session = Depends(get_
         raise HTTPException(status_code=409, detail="Email already registered")
 
     doctor.name = data.name
-    doctor.specialty = data.specialty
+    doctor.specialty_id, doctor.specialty = canonical(db, Specialty, data.specialty)
     doctor.email = data.email
     doctor.is_active = True
     if data.password:
         doctor.password = pwd_context.hash(data.password)
+    # Keep the per-specialty leaderboards in step
+    db.query(DoctorRatingStat).filter(DoctorRatingStat.doctor_id == doctor_id).update(
+        {"specialty_id": doctor.specialty_id}, synchronize_session=False
+    )
 
     try:
         db.commit()
@@ -144,15 +207,7 @@ def update_doctor(doctor_id: int, data: DoctorCreate, db: Session = Depends(get_
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
-    return DoctorResponse(
-        id=doctor.id,
-        name=doctor.name,
-        specialty=doctor.specialty,
-        email=doctor.email,
-        is_active=doctor.is_active if doctor.is_active is not None else True,
-        patientCount=0,
-        averageRating=0.0
-    )
+    return doctor_response(doctor, *get_doctor_metrics(db, [doctor.id]).get(doctor.id, (0, 0.0)))
 
 @router.patch("/{doctor_id}/status", response_model=DoctorResponse, status_code=status.HTTP_200_OK)
 def update_doctor_status(doctor_id: int, db: Session = Depends(get_db)):
@@ -168,13 +223,8 @@ def update_doctor_status(doctor_id: int, db: Session = Depends(get_db)):
     except IntegrityError:
         db.rollback()
         raise HTTPException(status_code=500, detail="Database error during status update")
+    broadcaster.publish(
+        "doctor.status", doctor_id=doctor.id, is_active=doctor.is_active, updated_at=doctor.updated_at.isoformat()
+    )
 
-    return DoctorResponse(
-        id=doctor.id,
-        name=doctor.name,
-        specialty=doctor.specialty,
-        email=doctor.email,
-        is_active=doctor.is_active if doctor.is_active is not None else True,
-        patientCount=0,
-        averageRating=0.0
-    )
\ No newline at end of file
+    return doctor_response(doctor, *get_doctor_metrics(db, [doctor.id]).get(doctor.id, (0, 0.0)))
\ No newline at end of file
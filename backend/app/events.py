@@ -0,0 +1,342 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from sqlalchemy import func, case, select
+from db.database import SessionLocal
+from db.models import Doctor, Patient, Appointment, Feedback, ARCHIVE_TABLES
+
+# Events buffered per client before it is considered too slow. A client that
+# falls this far behind has its backlog dropped and gets a fresh snapshot.
+SUBSCRIBER_QUEUE_SIZE = 32
+# Seconds between keep-alive comments on an idle stream
+KEEPALIVE_SECONDS = 15
+# Seconds between re-reads of the aggregates while dashboards are connected.
+# Events only reach the broadcaster of the worker that handled the write, so
+# this is how other workers' writes show up.
+RESEED_SECONDS = float(os.environ.get("STATS_RESEED_SECONDS", "30"))
+# Appointment statuses counted on the dashboard, as "<status>Appointments"
+APPOINTMENT_STATUSES = ("scheduled", "completed", "cancelled")
+# Event entity -> (model, event field with the row id, column that moves on every change)
+EVENT_ROWS = {
+    "patient": (Patient, "patient_id", "updated_at"),
+    "doctor": (Doctor, "doctor_id", "updated_at"),
+    "appointment": (Appointment, "id", "version"),
+    "feedback": (Feedback, "id", "updated_at"),
+}
+
+def snapshot_stats(db):
+    """Run the dashboard aggregates once; deltas are applied on top of this."""
+    total_patients, active_patients = db.query(
+        func.count(Patient.id),
+        func.sum(case((Patient.is_active == True, 1), else_=0)),
+    ).one()
+    total_doctors, active_doctors = db.query(
+        func.count(Doctor.id),
+        func.sum(case((Doctor.is_active == True, 1), else_=0)),
+    ).one()
+    # Archived rows still count, so archival never moves the totals
+    appointment_rows = select(Appointment.status).union_all(
+        select(ARCHIVE_TABLES[Appointment].c.status)
+    ).subquery()
+    appointments = dict(
+        db.query(appointment_rows.c.status, func.count()).group_by(appointment_rows.c.status).all()
+    )
+    feedback_rows = select(Feedback.rating).union_all(
+        select(ARCHIVE_TABLES[Feedback].c.rating)
+    ).subquery()
+    total_feedback, rating_sum = db.query(func.count(), func.sum(feedback_rows.c.rating)).one()
+    return {
+        "totalPatients": total_patients or 0,
+        "activePatients": int(active_patients or 0),
+        "totalDoctors": total_doctors or 0,
+        "activeDoctors": int(active_doctors or 0),
+        "totalAppointments": sum(appointments.values()),
+        **{f"{status}Appointments": appointments.get(status, 0) for status in APPOINTMENT_STATUSES},
+        "totalFeedback": total_feedback or 0,
+        "ratingSum": int(rating_sum or 0),
+    }
+
+def as_mark(value):
+    """Event marks travel as JSON: versions as ints, timestamps as ISO strings"""
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+class SnapshotReader:
+    """The dashboard aggregates read in one REPEATABLE READ transaction.
+
+    The transaction stays open so events published while it ran can be
+    checked against the same snapshot: ``unseen`` drops the ones whose
+    writes the aggregates already include.
+    """
+
+    def __init__(self):
+        self.db = SessionLocal()
+        try:
+            if self.db.get_bind().dialect.name == "postgresql":
+                self.db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            self.stats = snapshot_stats(self.db)
+        except Exception:
+            self.db.close()
+            raise
+
+    def mark(self, entity, row_id):
+        """(present, change mark) of one row as of the snapshot"""
+        model, _, column = EVENT_ROWS[entity]
+        tables = [model.__table__] + ([ARCHIVE_TABLES[model]] if model in ARCHIVE_TABLES else [])
+        row = self.db.execute(
+            select(tables[0].c[column]).where(tables[0].c.id == row_id).union_all(
+                *[select(table.c[column]).where(table.c.id == row_id) for table in tables[1:]]
+            )
+        ).first()
+        return (False, None) if row is None else (True, row[0])
+
+    def unseen(self, events):
+        """The parts of ``events``, in order, that happened after the snapshot"""
+        created = set()
+
+        def after(entity, row_id, mark):
+            present, seen = self.mark(entity, row_id)
+            if not present:
+                # Gone from the snapshot: either created since, or deleted before it
+                return (entity, row_id) in created
+            return seen is None or mark is None or seen < as_mark(mark)
+
+        kept = []
+        for event in events:
+            entity, action = event["type"].split(".")
+            row_id = event.get(EVENT_ROWS[entity][1])
+            if "moved" in event:
+                # A status change of many appointments: keep the rows changed since
+                moved = [row for row in event["moved"] if after(entity, row["id"], row["version"])]
+                if moved:
+                    previous = {}
+                    for row in moved:
+                        previous[row["previous"]] = previous.get(row["previous"], 0) + 1
+                    kept.append({**event, "previous": previous, "moved": moved})
+            elif row_id is None:
+                kept.append(event)
+            elif action == "created":
+                if not self.mark(entity, row_id)[0]:
+                    created.add((entity, row_id))
+                    kept.append(event)
+            elif after(entity, row_id, event.get(EVENT_ROWS[entity][2])):
+                kept.append(event)
+        return kept
+
+    def close(self):
+        self.db.close()
+
+def open_snapshot():
+    return SnapshotReader()
+
+def compute_snapshot():
+    reader = open_snapshot()
+    try:
+        return reader.stats
+    finally:
+        reader.close()
+
+def with_derived(snapshot):
+    data = dict(snapshot)
+    data["averageRating"] = round(data["ratingSum"] / data["totalFeedback"], 2) if data["totalFeedback"] else 0.0
+    return data
+
+def appointment_status_changes(counts, sign=1):
+    """Counter changes for {status: appointments} entering (+1) or leaving (-1) those statuses"""
+    return {
+        f"{status}Appointments": sign * count
+        for status, count in counts.items()
+        if status in APPOINTMENT_STATUSES and count
+    }
+
+def apply_delta(snapshot, event):
+    """Update the snapshot in place and return the changed counters."""
+    kind = event["type"]
+    changes = {}
+    if kind == "feedback.created":
+        changes = {"totalFeedback": 1, "ratingSum": event["rating"]}
+    elif kind == "appointment.created":
+        changes = {"totalAppointments": 1, **appointment_status_changes({event["status"]: 1})}
+    elif kind == "appointment.status":
+        # {"previous": {status: count}, "status": new status} for one or many appointments
+        moved = sum(event["previous"].values())
+        changes = appointment_status_changes(event["previous"], -1)
+        for key, value in appointment_status_changes({event["status"]: moved}).items():
+            changes[key] = changes.get(key, 0) + value
+        changes = {key: value for key, value in changes.items() if value}
+    elif kind == "appointment.deleted":
+        changes = {"totalAppointments": -1, **appointment_status_changes({event["status"]: 1}, -1)}
+    elif kind == "patient.created":
+        changes = {"totalPatients": 1, "activePatients": 1}
+    elif kind == "patient.status":
+        changes = {"activePatients": 1 if event["is_active"] else -1}
+    elif kind == "doctor.created":
+        changes = {"totalDoctors": 1, "activeDoctors": 1}
+    elif kind == "doctor.status":
+        changes = {"activeDoctors": 1 if event["is_active"] else -1}
+    for key, value in changes.items():
+        snapshot[key] += value
+    return changes
+
+class Subscriber:
+    def __init__(self, size):
+        self.queue = asyncio.Queue(maxsize=size)
+        self.dropped = 0
+
+    def offer(self, message):
+        if self.queue.full():
+            # Backpressure: never block the broadcaster on one slow client.
+            # Throw away its backlog and tell it to resynchronise instead.
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+            return
+        self.queue.put_nowait(message)
+
+class StatsBroadcaster:
+    """Fans one stream of stat deltas out to every connected dashboard.
+
+    Write handlers call ``publish`` after their commit, from whatever thread
+    they run on. The delta is applied once to an in-memory snapshot on the
+    event loop and the same message is queued for each subscriber, so N
+    dashboards cost one computation rather than N aggregate queries.
+
+    Events published while the snapshot is being read are also held back
+    and checked against it (``SnapshotReader.unseen``), so a write that
+    committed just before the read is not counted twice. While dashboards
+    are connected the snapshot is re-read every RESEED_SECONDS; subscribers
+    get a resync when that changes the numbers.
+    """
+
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE, reseed_seconds=RESEED_SECONDS):
+        self.queue_size = queue_size
+        self.reseed_seconds = reseed_seconds
+        self.subscribers = set()
+        self.loop = None
+        self.snapshot = None
+        self.version = 0
+        self._seeding = None
+        self._pending = []
+        self._reseeding = None
+
+    def attach(self, loop):
+        self.loop = loop
+
+    def publish(self, event_type, **fields):
+        if self.loop is None or not (self.subscribers or self._seeding):
+            return
+        self.loop.call_soon_threadsafe(self._dispatch, {"type": event_type, **fields})
+
+    def _dispatch(self, event):
+        if self._seeding is not None:
+            self._pending.append(event)
+        if self.snapshot is None:
+            return
+        changes = apply_delta(self.snapshot, event)
+        if not changes:
+            return
+        self.version += 1
+        message = {
+            "type": "delta",
+            "version": self.version,
+            "event": event,
+            "changes": changes,
+            "stats": with_derived(self.snapshot),
+        }
+        for subscriber in self.subscribers:
+            subscriber.offer(message)
+
+    async def _refresh(self):
+        """Read a fresh snapshot and install it with every event published meanwhile applied"""
+        initial = self.snapshot is None
+        reader = None
+        try:
+            reader = await asyncio.to_thread(open_snapshot)
+            snapshot = reader.stats
+            while self._pending:
+                pending, self._pending = self._pending, []
+                for event in await asyncio.to_thread(reader.unseen, pending):
+                    apply_delta(snapshot, event)
+            # From the emptiness check above to clearing _seeding below is one
+            # loop step, so no event can fall between the two snapshots
+            if initial:
+                self.snapshot = snapshot
+            elif self.snapshot is not None and snapshot != self.snapshot:
+                self.snapshot = snapshot
+                self.version += 1
+                for subscriber in self.subscribers:
+                    subscriber.offer({"type": "resync"})
+        finally:
+            self._seeding = None
+            if reader is not None:
+                await asyncio.to_thread(reader.close)
+
+    async def reseed(self):
+        """Re-read the snapshot; subscribers get a resync if the numbers moved"""
+        # Concurrent callers share a single read
+        if self._seeding is None:
+            self._pending = []
+            self._seeding = asyncio.ensure_future(self._refresh())
+        await self._seeding
+
+    async def _reseed_periodically(self):
+        while self.subscribers:
+            await asyncio.sleep(self.reseed_seconds)
+            try:
+                await self.reseed()
+            except Exception as e:
+                print(f"Dashboard snapshot refresh failed: {str(e)}")
+
+    async def subscribe(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        if self.snapshot is None:
+            await self.reseed()
+        subscriber = Subscriber(self.queue_size)
+        self.subscribers.add(subscriber)
+        if self._reseeding is None and self.reseed_seconds:
+            self._reseeding = asyncio.ensure_future(self._reseed_periodically())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers:
+            # Re-seed from the database when the next dashboard connects
+            self.snapshot = None
+            if self._reseeding is not None:
+                self._reseeding.cancel()
+                self._reseeding = None
+
+    def current(self):
+        return {"type": "snapshot", "version": self.version, "stats": with_derived(self.snapshot)}
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "version": self.version,
+            "dropped": sum(s.dropped for s in self.subscribers),
+        }
+
+broadcaster = StatsBroadcaster()
+
+def format_sse(message):
+    event = message["type"]
+    return f"event: {event}\nid: {message.get('version', 0)}\ndata: {json.dumps(message)}\n\n"
+
+async def event_stream():
+    """Subscribe and yield SSE frames until the client disconnects."""
+    subscriber = await broadcaster.subscribe()
+    try:
+        yield format_sse(broadcaster.current())
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if message["type"] == "resync":
+                message = broadcaster.current()
+            yield format_sse(message)
+    finally:
+        broadcaster.unsubscribe(subscriber)
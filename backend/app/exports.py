@@ -0,0 +1,231 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func
+from datetime import datetime, date, timedelta
+from typing import Optional
+import csv
+import io
+import zlib
+from db.database import SessionLocal, ReplicaSessionLocal, replica_engine, replica_monitor
+from db.models import Feedback, FeedbackCategory, Appointment, AppointmentCategory, Doctor, Patient, Specialty
+from app.auth import require_admin
+from app.archive import with_archive
+from app.dates import sql_date
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional, CSV is always available
+    pyarrow = None
+
+router = APIRouter(prefix="/exports", tags=["Exports"])
+
+# Rows fetched per round trip from the server-side cursor, and per Arrow
+# record batch / Parquet row group.
+EXPORT_CHUNK_SIZE = 5000
+# Rows newer than this are left for the next export, so a transaction that
+# took an id just before the export but commits just after it is not skipped.
+EXPORT_SAFETY_SECONDS = 2
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+def feedback_export(source):
+    columns = [
+        ("id", source.id, "int64"),
+        ("created_at", source.created_at, "timestamp"),
+        ("patient_id", source.patient_id, "int64"),
+        ("doctor_id", source.doctor_id, "int64"),
+        ("doctor_name", Doctor.name, "string"),
+        ("specialty", func.coalesce(Specialty.name, Doctor.specialty), "string"),
+        ("category", FeedbackCategory.name, "string"),
+        ("rating", source.rating, "int64"),
+        ("comment", source.comment, "string"),
+    ]
+    statement = (
+        select(*[expression.label(name) for name, expression, _ in columns])
+        .select_from(source)
+        .outerjoin(Doctor, Doctor.id == source.doctor_id)
+        .outerjoin(Specialty, Specialty.id == Doctor.specialty_id)
+        .outerjoin(FeedbackCategory, FeedbackCategory.id == source.category_id)
+    )
+    return columns, statement
+
+def appointment_export(source):
+    columns = [
+        ("id", source.id, "int64"),
+        ("created_at", source.created_at, "timestamp"),
+        ("date", sql_date(source.date), "date"),  # NULL when the free text is not a date
+        ("time", source.time, "string"),
+        ("status", source.status, "string"),
+        ("category", func.coalesce(AppointmentCategory.name, source.category), "string"),
+        ("description", source.description, "string"),
+        ("patient_id", source.patient_id, "int64"),
+        ("patient_name", Patient.first_name + " " + Patient.last_name, "string"),
+        ("doctor_id", source.doctor_id, "int64"),
+        ("doctor_name", Doctor.name, "string"),
+    ]
+    statement = (
+        select(*[expression.label(name) for name, expression, _ in columns])
+        .select_from(source)
+        .outerjoin(Doctor, Doctor.id == source.doctor_id)
+        .outerjoin(Patient, Patient.id == source.patient_id)
+        .outerjoin(AppointmentCategory, AppointmentCategory.id == source.category_id)
+    )
+    return columns, statement
+
+# Dataset -> (model, column list and statement builder)
+EXPORT_DATASETS = {
+    "feedback": (Feedback, feedback_export),
+    "appointments": (Appointment, appointment_export),
+}
+
+def arrow_schema(columns):
+    types = {
+        "int64": pyarrow.int64(),
+        "timestamp": pyarrow.timestamp("us"),
+        "date": pyarrow.date32(),
+        "string": pyarrow.string(),
+    }
+    return pyarrow.schema([(name, types[kind]) for name, _, kind in columns])
+
+class ChunkSink:
+    """Write-only file object for the Arrow writers, drained after every batch"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def csv_chunks(columns, partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _, _ in columns])
+    for rows in partitions:
+        writer.writerows(
+            [value.isoformat() if isinstance(value, (datetime, date)) else value for value in row]
+            for row in rows
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+def arrow_chunks(columns, partitions, file_format):
+    schema = arrow_schema(columns)
+    sink = ChunkSink()
+    if file_format == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    for rows in partitions:
+        arrays = [pyarrow.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+        writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_rows(db, statement):
+    """Result partitions off a server-side cursor; closes the session when done"""
+    try:
+        result = db.execute(statement.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        for rows in result.partitions():
+            yield rows
+    finally:
+        db.close()
+
+@router.get("/{dataset}")
+def export_dataset(
+    dataset: str,
+    file_format: str = Query("csv", alias="format", pattern="^(csv|arrow|parquet)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after_id: int = Query(0, ge=0),
+    until_id: Optional[int] = Query(None, ge=0),
+    include_archive: bool = True,
+    gzip: bool = False,
+    current_user: dict = Depends(require_admin)
+):
+    """Stream a dataset as CSV, Arrow IPC or Parquet, in id order.
+
+    ``since``/``until`` bound created_at. Rows are read through a server-side
+    cursor and encoded chunk by chunk, so memory stays flat however many rows
+    match. The response's ``X-Export-Until-Id`` header is the id watermark the
+    export stops at; to resume an interrupted download, call again with
+    ``after_id`` set to the last id received and ``until_id`` set to that
+    watermark. ``gzip`` wraps the file in a .gz container.
+    """
+    if dataset not in EXPORT_DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset {dataset}")
+    if file_format != "csv" and pyarrow is None:
+        raise HTTPException(status_code=501, detail=f"{file_format} export requires pyarrow")
+
+    model, build = EXPORT_DATASETS[dataset]
+    source = with_archive(model) if include_archive else model
+    columns, statement = build(source)
+
+    # Exports tolerate replica lag; the session lives as long as the stream
+    use_replica = replica_engine is not None and replica_monitor.healthy()
+    db = ReplicaSessionLocal() if use_replica else SessionLocal()
+    try:
+        if until_id is None:
+            horizon = datetime.utcnow() - timedelta(seconds=EXPORT_SAFETY_SECONDS)
+            until_id = db.execute(
+                select(func.max(source.id)).where(source.created_at <= horizon)
+            ).scalar() or 0
+    except Exception:
+        db.close()
+        raise
+
+    statement = statement.where(source.id > after_id, source.id <= until_id)
+    if since:
+        statement = statement.where(source.created_at >= since)
+    if until:
+        statement = statement.where(source.created_at < until)
+    partitions = stream_rows(db, statement.order_by(source.id))
+
+    chunks = csv_chunks(columns, partitions) if file_format == "csv" else arrow_chunks(columns, partitions, file_format)
+    filename = f"{dataset}-{datetime.utcnow():%Y%m%d}.{file_format}"
+    media_type = MEDIA_TYPES[file_format]
+    if gzip:
+        chunks = gzipped(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Export-Until-Id": str(until_id),
+        },
+    )
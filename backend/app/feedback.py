@@ -1,9 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from sqlalchemy import insert, select, func, distinct
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from db.database import SessionLocal
-from db.models import Feedback, FeedbackCategory, Doctor, Patient
+from db.database import SessionLocal, get_read_db
+from db.models import Feedback, FeedbackCategory, Doctor, Patient, Appointment, DoctorRatingStat
 from app.schemas import FeedbackResponse, FeedbackBase, FeedbackCategoryResponse, DoctorResponse, PatientResponse
 from app.auth import get_current_user
+from app.caching import conditional_get
+from app.events import broadcaster
+from app.doctor import get_doctor_metrics
+from app.writes import raise_for_constraint
+from app.ratings import record_ratings
+from app.feedback_queue import feedback_queue, FLUSH_INTERVAL_SECONDS
+from app.archive import feedback_source, with_archive
+from typing import Optional
+import queue
 from pydantic import BaseModel
 import traceback
 from datetime import datetime
@@ -33,7 +44,7 @@ class FeedbackResponse(FeedbackBase):
         from_attributes = True
 
 @router.get("/feedback_categories", response_model=list[FeedbackCategoryResponse])
-def list_categories(db: Session = Depends(get_db)):
+def list_categories(db: Session = Depends(get_read_db)):
     """Return a list of feedback categories"""
     categories = db.query(FeedbackCategory).all()
     if not categories:
@@ -47,20 +58,47 @@ def list_categories(db: Session = Depends(get_db)):
     ]
 
 @router.get("/", response_model=list[FeedbackResponse])
-def list_feedback(doctor_id: int = None, patient_id: int = None, db: Session = Depends(get_db)):
-    """Return a list of feedback, optionally filtered by doctor_id or patient_id"""
-    query = db.query(Feedback)
+def list_feedback(
+    request: Request,
+    response: Response,
+    doctor_id: int = None,
+    patient_id: int = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Return a list of feedback, optionally filtered by doctor_id, patient_id or creation time.
+
+    Archived feedback is included unless ``since`` lies inside the retention period.
+    """
+    # Each entry embeds its doctor (with patient count) and patient, so those tables feed the ETag too
+    not_modified = conditional_get(
+        request, response, db,
+        Feedback,
+        Doctor,
+        Appointment,
+        Patient,
+    )
+    if not_modified:
+        return not_modified
+    source = feedback_source(since)
+    query = db.query(source)
     
     # Apply filters
     if doctor_id:
-        query = query.filter(Feedback.doctor_id == doctor_id)
+        query = query.filter(source.doctor_id == doctor_id)
     if patient_id:
-        query = query.filter(Feedback.patient_id == patient_id)
+        query = query.filter(source.patient_id == patient_id)
+    if since:
+        query = query.filter(source.created_at >= since)
+    if until:
+        query = query.filter(source.created_at < until)
     
     feedback = query.all()
     if not feedback:
         # Don't raise 404 error, just return empty list
         return []
+    metrics = get_doctor_metrics(db, [fb.doctor_id for fb in feedback])
     return [
         FeedbackResponse(
             id=fb.id,
@@ -77,8 +115,8 @@ def list_feedback(doctor_id: int = None, patient_id: int = None, db: Session = D
                 specialty=fb.doctor.specialty or "N/A",
                 email=fb.doctor.email or "N/A",
                 is_active=fb.doctor.is_active if fb.doctor.is_active is not None else True,
-                patientCount=0,
-                averageRating=0.0
+                patientCount=metrics.get(fb.doctor_id, (0, 0.0))[0],
+                averageRating=round(metrics.get(fb.doctor_id, (0, 0.0))[1], 2)
             ),
             patient=PatientResponse(
                 id=fb.patient.id,
@@ -97,40 +135,60 @@ def list_feedback(doctor_id: int = None, patient_id: int = None, db: Session = D
 
 @router.post("/", response_model=FeedbackResponse, status_code=status.HTTP_201_CREATED)
 def create_feedback(data: FeedbackBase, db: Session = Depends(get_db)):
-    """Create a new feedback entry"""
-    # Validate doctor_id
-    doctor = db.query(Doctor).filter(Doctor.id == data.doctor_id).first()
-    if not doctor:
-        raise HTTPException(status_code=404, detail="Doctor not found")
-    
-    # Validate patient_id
-    patient = db.query(Patient).filter(Patient.id == data.patient_id).first()
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
-
+    """Create a new feedback entry.
 
-    # Validate category_id
-    category = db.query(FeedbackCategory).filter(FeedbackCategory.id == data.category_id).first()
-    if not category:
-        raise HTTPException(status_code=404, detail="Feedback category not found")
-
-    # Create feedback
-    new_feedback = Feedback(
-    patient_id=data.patient_id,
-    doctor_id=data.doctor_id,
-    category_id=data.category_id,
-    rating=data.rating,
-    comment=data.comment
+    Doctor, patient and category are checked by foreign keys instead of
+    three SELECTs. The inserted row, the referenced records and the doctor's
+    current figures all come back from one statement.
+    """
+    new = (
+        insert(Feedback)
+        .values(
+            patient_id=data.patient_id,
+            doctor_id=data.doctor_id,
+            category_id=data.category_id,
+            rating=data.rating,
+            comment=data.comment
+        )
+        .returning(*Feedback.__table__.c)
+        .cte("new_feedback")
     )
+    # These read the running stats from before the insert; the new rating is added below
+    rating_count = func.coalesce(select(DoctorRatingStat.ratings).where(DoctorRatingStat.doctor_id == new.c.doctor_id).scalar_subquery(), 0)
+    rating_sum = func.coalesce(select(DoctorRatingStat.rating_sum).where(DoctorRatingStat.doctor_id == new.c.doctor_id).scalar_subquery(), 0)
+    # Archived appointments still count, as in get_doctor_metrics
+    appointments = with_archive(Appointment)
+    patient_count = select(func.count(distinct(appointments.patient_id))).where(appointments.doctor_id == new.c.doctor_id).scalar_subquery()
     try:
-        db.add(new_feedback)
+        row = db.execute(
+            select(
+                new, Doctor, Patient, FeedbackCategory,
+                rating_count.label("rating_count"),
+                rating_sum.label("rating_sum"),
+                patient_count.label("patient_count"),
+            )
+            .select_from(new)
+            .join(Doctor, Doctor.id == new.c.doctor_id)
+            .join(Patient, Patient.id == new.c.patient_id)
+            .join(FeedbackCategory, FeedbackCategory.id == new.c.category_id)
+        ).one()
+        record_ratings(db, [(row.doctor_id, row.rating, row.created_at)])
         db.commit()
-        db.refresh(new_feedback)
+    except IntegrityError as e:
+        db.rollback()
+        raise_for_constraint(e, {
+            "feedback_doctor_id_fkey": (404, "Doctor not found"),
+            "feedback_patient_id_fkey": (404, "Patient not found"),
+            "feedback_category_id_fkey": (404, "Feedback category not found"),
+        }, "Failed to create feedback")
     except Exception as e:
         db.rollback()
         # Log the full stack trace for debugging
         print("Error creating feedback:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Failed to create feedback: {str(e)}") 
+    new_feedback, doctor, patient, category = row, row.Doctor, row.Patient, row.FeedbackCategory
+    average_rating = (row.rating_sum + row.rating) / (row.rating_count + 1)
+    broadcaster.publish("feedback.created", id=new_feedback.id, doctor_id=new_feedback.doctor_id, rating=new_feedback.rating)
     return FeedbackResponse(
         id=new_feedback.id,
         patient_id=new_feedback.patient_id,
@@ -146,8 +204,8 @@ def create_feedback(data: FeedbackBase, db: Session = Depends(get_db)):
             specialty=doctor.specialty or "N/A",
             email=doctor.email or "N/A",
             is_active=doctor.is_active if doctor.is_active is not None else True,
-            patientCount=0,
-            averageRating=0.0
+            patientCount=row.patient_count,
+            averageRating=round(average_rating, 2)
         ),
         patient=PatientResponse(
             id=patient.id,
@@ -158,4 +216,30 @@ def create_feedback(data: FeedbackBase, db: Session = Depends(get_db)):
             created_at=patient.created_at.isoformat() if patient.created_at else datetime.utcnow().isoformat(),
             is_active=patient.is_active if patient.is_active is not None else True
         )
-    )
\ No newline at end of file
+    )
+
+@router.post("/ingest", status_code=status.HTTP_202_ACCEPTED)
+def ingest_feedback(data: FeedbackBase):
+    """Queue a feedback entry for batched insertion and return a ticket.
+
+    Meant for kiosk bursts: no database work happens on the request path.
+    Poll /feedback/ingest/{ticket} for the stored id. Answers 503 with
+    Retry-After when the queue is full.
+    """
+    try:
+        ticket = feedback_queue.submit(data.dict())
+    except queue.Full:
+        raise HTTPException(
+            status_code=503,
+            detail="Feedback queue is full, please retry shortly",
+            headers={"Retry-After": str(max(1, int(FLUSH_INTERVAL_SECONDS * 4)))},
+        )
+    return {"ticket": ticket, "status": "queued"}
+
+@router.get("/ingest/{ticket}")
+def get_ingest_status(ticket: str, db: Session = Depends(get_db)):
+    """Return the outcome of a queued feedback submission, whichever worker accepted it"""
+    state = feedback_queue.ticket_status(ticket, db)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired ticket")
+    return {"ticket": ticket, **state}
@@ -0,0 +1,298 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from sqlalchemy import insert, delete
+from sqlalchemy.exc import IntegrityError
+from db.database import SessionLocal
+from db.models import Feedback, Doctor, Patient, FeedbackCategory, FeedbackTicket
+from app.events import broadcaster
+from app.ratings import record_ratings
+
+QUEUE_MAX_SIZE = int(os.environ.get("FEEDBACK_QUEUE_MAX_SIZE", "5000"))
+FLUSH_BATCH_SIZE = int(os.environ.get("FEEDBACK_FLUSH_BATCH_SIZE", "200"))
+FLUSH_INTERVAL_SECONDS = float(os.environ.get("FEEDBACK_FLUSH_INTERVAL", "0.5"))
+# Doctors and categories are reloaded wholesale this often
+REFERENCE_TTL_SECONDS = 60
+# Patient ids are cached as they are seen; the cache is reset past this size
+PATIENT_CACHE_MAX = 100_000
+# How many tickets this process remembers in memory for status lookups
+TICKET_HISTORY = 50_000
+# Finished tickets are kept in feedback_tickets this long
+TICKET_RETENTION = timedelta(days=1)
+# A ticket neither in this process nor in feedback_tickets yet reads as
+# queued (on another worker) for this long after it was issued
+TICKET_PENDING_SECONDS = 60
+FLUSH_RETRIES = 3
+
+class ReferenceCache:
+    """Known doctor, patient and category ids, checked without a query per row.
+
+    Doctors and categories are small and loaded in full. Patients are cached
+    positively: ids not yet seen are confirmed with one IN query per batch.
+    """
+
+    def __init__(self):
+        self.doctors = set()
+        self.categories = set()
+        self.patients = set()
+        self.loaded_at = 0.0
+
+    def refresh(self, db):
+        self.doctors = {row[0] for row in db.query(Doctor.id)}
+        self.categories = {row[0] for row in db.query(FeedbackCategory.id)}
+        self.loaded_at = time.monotonic()
+
+    def unknown_ids(self, db, items):
+        """Return {field: set(ids)} for every referenced id that does not exist"""
+        if time.monotonic() - self.loaded_at > REFERENCE_TTL_SECONDS:
+            self.refresh(db)
+
+        doctors = {item["doctor_id"] for item in items} - self.doctors
+        categories = {item["category_id"] for item in items} - self.categories
+        if doctors or categories:
+            # Something new was referenced: reload before rejecting anything
+            self.refresh(db)
+            doctors -= self.doctors
+            categories -= self.categories
+
+        patients = {item["patient_id"] for item in items} - self.patients
+        if patients:
+            found = {row[0] for row in db.query(Patient.id).filter(Patient.id.in_(patients))}
+            if len(self.patients) + len(found) > PATIENT_CACHE_MAX:
+                self.patients = set()
+            self.patients |= found
+            patients -= found
+        return {"doctor_id": doctors, "patient_id": patients, "category_id": categories}
+
+    def forget(self):
+        """Drop every cached id, after the database rejected one of them"""
+        self.patients = set()
+        self.loaded_at = 0.0
+
+def feedback_row(item) -> dict:
+    return {
+        "patient_id": item["patient_id"],
+        "doctor_id": item["doctor_id"],
+        "category_id": item["category_id"],
+        "rating": item["rating"],
+        "comment": item["comment"],
+        "created_at": item["received_at"],
+        "updated_at": item["received_at"],
+    }
+
+class FeedbackIngestQueue:
+    """Accepts feedback into a bounded in-memory queue and writes it in batches.
+
+    Semantics:
+    - ``submit`` never touches the database. It returns a ticket, or raises
+      ``queue.Full`` when the queue is at capacity so the caller can answer
+      503 and the kiosk can retry later (backpressure).
+    - A single writer thread flushes when FLUSH_BATCH_SIZE items are waiting
+      or FLUSH_INTERVAL_SECONDS after the first item of a batch arrived.
+      Each flush validates against ``ReferenceCache`` and writes all valid
+      rows with one multi-row INSERT ... RETURNING in one transaction,
+      together with the doctors' running rating stats. If a stale cache
+      entry makes that INSERT violate a foreign key, the rows are retried
+      one by one and only the offending ones are rejected.
+    - Durability: a 202 means "held in this process's memory". Items are
+      drained on graceful shutdown, but a crash or kill loses anything not
+      yet flushed (at most one queue's worth). Use the synchronous POST
+      /feedback/ endpoint where that is not acceptable.
+    - Ticket outcomes (stored, rejected) are written to feedback_tickets in
+      the flush's transaction, so with several workers any of them can
+      answer a poll. Tickets carry their issue time: one found nowhere
+      reads as queued for TICKET_PENDING_SECONDS, then as unknown.
+    """
+
+    def __init__(self, max_size=QUEUE_MAX_SIZE):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.references = ReferenceCache()
+        self.tickets = OrderedDict()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.stats = {"accepted": 0, "rejectedFull": 0, "stored": 0, "invalid": 0, "failed": 0, "flushes": 0}
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name="feedback-writer", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=10):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def submit(self, data: dict) -> str:
+        ticket = f"{int(time.time()):x}-{uuid.uuid4().hex}"
+        item = {**data, "ticket": ticket, "received_at": datetime.utcnow()}
+        # Before the put: the writer may store the item before this thread runs again
+        self.set_ticket(ticket, {"status": "queued"})
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self.lock:
+                self.tickets.pop(ticket, None)
+                self.stats["rejectedFull"] += 1
+            raise
+        with self.lock:
+            self.stats["accepted"] += 1
+        return ticket
+
+    def set_ticket(self, ticket, state):
+        with self.lock:
+            self.tickets[ticket] = state
+            self.tickets.move_to_end(ticket)
+            while len(self.tickets) > TICKET_HISTORY:
+                self.tickets.popitem(last=False)
+
+    def ticket_status(self, ticket, db=None):
+        """This process's view of a ticket, else the stored outcome, else
+        queued while the ticket is recent; None for unknown tickets"""
+        with self.lock:
+            state = self.tickets.get(ticket)
+        if state is not None or db is None:
+            return state
+        stored = db.get(FeedbackTicket, ticket)
+        if stored is not None:
+            return {
+                key: value
+                for key, value in (("status", stored.status), ("feedback_id", stored.feedback_id), ("detail", stored.detail))
+                if value is not None
+            }
+        try:
+            issued = int(ticket.split("-", 1)[0], 16)
+        except ValueError:
+            return None
+        return {"status": "queued"} if 0 <= time.time() - issued <= TICKET_PENDING_SECONDS else None
+
+    def record_outcomes(self, db, outcomes):
+        """Stage {ticket: state} for feedback_tickets, pruning expired tickets; the caller commits"""
+        now = datetime.utcnow()
+        rows = [
+            {"ticket": ticket, "status": state["status"], "feedback_id": state.get("feedback_id"),
+             "detail": state.get("detail"), "created_at": now}
+            for ticket, state in outcomes.items()
+        ]
+        if rows:
+            db.execute(insert(FeedbackTicket), rows)
+        db.execute(delete(FeedbackTicket).where(FeedbackTicket.created_at < datetime.utcnow() - TICKET_RETENTION))
+
+    def next_batch(self):
+        """Block for the first item, then gather more until size or time runs out"""
+        try:
+            batch = [self.queue.get(timeout=FLUSH_INTERVAL_SECONDS)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + FLUSH_INTERVAL_SECONDS
+        while len(batch) < FLUSH_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            batch = self.next_batch()
+            if batch:
+                self.flush(batch)
+
+    def insert_each(self, db, items):
+        """Insert rows one by one, each under a savepoint; rejects those that still fail.
+
+        The fallback when the batch INSERT hits a foreign key: a cached
+        reference can go stale (a patient merged or deleted since), and
+        one such row must not fail the rest of the batch.
+        """
+        stored = []
+        for item in items:
+            try:
+                with db.begin_nested():
+                    stored.append((item, db.execute(insert(Feedback).returning(Feedback.id), feedback_row(item)).scalar_one()))
+            except IntegrityError:
+                self.set_ticket(item["ticket"], {"status": "rejected", "detail": "Unknown patient_id, doctor_id or category_id"})
+        return stored
+
+    def record_failures(self, batch):
+        db = SessionLocal()
+        try:
+            self.record_outcomes(db, {item["ticket"]: {"status": "failed", "detail": "Database error"} for item in batch})
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Could not record {len(batch)} failed feedback tickets: {str(e)}")
+        finally:
+            db.close()
+
+    def flush(self, batch):
+        for attempt in range(1, FLUSH_RETRIES + 1):
+            db = SessionLocal()
+            try:
+                unknown = self.references.unknown_ids(db, batch)
+                valid = []
+                for item in batch:
+                    bad = [field for field, ids in unknown.items() if item[field] in ids]
+                    if bad:
+                        self.set_ticket(item["ticket"], {"status": "rejected", "detail": f"Unknown {', '.join(bad)}"})
+                    else:
+                        valid.append(item)
+
+                stored = []
+                if valid:
+                    try:
+                        with db.begin_nested():
+                            ids = db.execute(
+                                insert(Feedback).returning(Feedback.id, sort_by_parameter_order=True),
+                                [feedback_row(item) for item in valid],
+                            ).scalars().all()
+                        stored = list(zip(valid, ids))
+                    except IntegrityError:
+                        self.references.forget()
+                        stored = self.insert_each(db, valid)
+                    record_ratings(db, [(item["doctor_id"], item["rating"], item["received_at"]) for item, _ in stored])
+                # Rejections are already in memory; stored outcomes only go there after the commit
+                outcomes = {item["ticket"]: self.ticket_status(item["ticket"]) for item in batch}
+                outcomes.update({item["ticket"]: {"status": "stored", "feedback_id": feedback_id} for item, feedback_id in stored})
+                self.record_outcomes(db, {
+                    ticket: state for ticket, state in outcomes.items() if state and state["status"] != "queued"
+                })
+                db.commit()
+                break
+            except Exception:
+                db.rollback()
+                print(f"Feedback flush attempt {attempt} failed:", traceback.format_exc())
+                if attempt == FLUSH_RETRIES:
+                    for item in batch:
+                        self.set_ticket(item["ticket"], {"status": "failed", "detail": "Database error"})
+                    # Pollers on other workers would otherwise see these as queued, then unknown
+                    self.record_failures(batch)
+                    with self.lock:
+                        self.stats["failed"] += len(batch)
+                    return
+                time.sleep(0.2 * attempt)
+            finally:
+                db.close()
+
+        for item, feedback_id in stored:
+            self.set_ticket(item["ticket"], {"status": "stored", "feedback_id": feedback_id})
+            broadcaster.publish("feedback.created", id=feedback_id, doctor_id=item["doctor_id"], rating=item["rating"])
+        with self.lock:
+            self.stats["flushes"] += 1
+            self.stats["stored"] += len(stored)
+            self.stats["invalid"] += len(batch) - len(stored)
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, "depth": self.queue.qsize(), "capacity": self.queue.maxsize}
+
+feedback_queue = FeedbackIngestQueue()
@@ -0,0 +1,171 @@
+from sqlalchemy import func, delete, insert
+from sqlalchemy.orm import Session
+from datetime import date, datetime, timedelta
+import os
+from db.database import SessionLocal
+from db.models import Appointment, Doctor, Specialty, AppointmentForecast
+from app.archive import with_archive
+from app.jobs import job
+from app.lookups import find
+
+try:
+    import numpy
+except ImportError:  # Only the nightly job needs numpy; the API reads stored rows
+    numpy = None
+
+# Days of appointment history the models are fitted on, and days forecast
+FORECAST_HISTORY_DAYS = int(os.environ.get("FORECAST_HISTORY_DAYS", "365"))
+FORECAST_HORIZON_DAYS = int(os.environ.get("FORECAST_HORIZON_DAYS", "28"))
+SEASON_DAYS = 7
+# Smoothing parameters tried for every specialty; each keeps the combination
+# with the lowest one-step-ahead error. Trends are damped so a busy fortnight
+# is not extrapolated a month ahead.
+ALPHAS = (0.05, 0.1, 0.2, 0.4, 0.6)
+BETAS = (0.0, 0.02, 0.1)
+GAMMAS = (0.05, 0.15, 0.3)
+DAMPING = 0.9
+# Width of the lower/upper band, in standard deviations of the fit error (~95%)
+INTERVAL_Z = 1.96
+
+def daily_series(db: Session, start: date, end: date):
+    """(specialties, matrix of appointments per specialty and day in [start, end))"""
+    appointments = with_archive(Appointment)
+    rows = (
+        db.query(Doctor.specialty_id, appointments.date, func.count(appointments.id))
+        .join(Doctor, Doctor.id == appointments.doctor_id)
+        .filter(appointments.date >= start.isoformat(), appointments.date < end.isoformat())
+        .group_by(Doctor.specialty_id, appointments.date)
+        .all()
+    )
+    names = dict(db.query(Specialty.id, Specialty.name))
+    specialties = sorted({names[specialty_id] for specialty_id, _, _ in rows if specialty_id in names})
+    index = {specialty: i for i, specialty in enumerate(specialties)}
+    series = numpy.zeros((len(specialties), (end - start).days))
+    for specialty_id, day, count in rows:
+        try:
+            offset = (date.fromisoformat(day) - start).days
+        except (TypeError, ValueError):  # Dates are free-form strings
+            continue
+        if specialty_id in names:
+            series[index[names[specialty_id]], offset] += count
+    return specialties, series
+
+def fit(series):
+    """Damped additive Holt-Winters with a weekly season, for every series at once.
+
+    Every (alpha, beta, gamma) combination is run side by side: the state
+    arrays have shape (combinations, series), so each day of history costs
+    a handful of array operations however many specialties there are.
+    Returns the final level, trend and seasonal state of each series' best
+    combination, and the standard deviation of its one-step errors.
+    """
+    grid = numpy.array([(a, b, g) for a in ALPHAS for b in BETAS for g in GAMMAS])
+    alpha, beta, gamma = (grid[:, i, None] for i in range(3))
+    count, days = series.shape
+    first, second = series[:, :SEASON_DAYS].mean(axis=1), series[:, SEASON_DAYS:2 * SEASON_DAYS].mean(axis=1)
+
+    level = numpy.tile(first, (len(grid), 1))
+    trend = numpy.tile((second - first) / SEASON_DAYS, (len(grid), 1))
+    season = numpy.tile(series[:, :SEASON_DAYS] - first[:, None], (len(grid), 1, 1))
+    sse = numpy.zeros((len(grid), count))
+    for t in range(SEASON_DAYS, days):
+        observed = series[:, t]
+        seasonal = season[:, :, t % SEASON_DAYS]
+        error = observed - (level + DAMPING * trend + seasonal)
+        sse += error ** 2
+        new_level = alpha * (observed - seasonal) + (1 - alpha) * (level + DAMPING * trend)
+        trend = beta * (new_level - level) + (1 - beta) * DAMPING * trend
+        season[:, :, t % SEASON_DAYS] = gamma * (observed - new_level) + (1 - gamma) * seasonal
+        level = new_level
+
+    best = sse.argmin(axis=0)
+    columns = numpy.arange(count)
+    sigma = numpy.sqrt(sse[best, columns] / max(days - SEASON_DAYS, 1))
+    return level[best, columns], trend[best, columns], season[best, columns], alpha[best, 0], sigma
+
+def project(state, days: int, horizon: int):
+    """(expected, lower, upper), each of shape (series, horizon), for the days after the history"""
+    level, trend, season, alpha, sigma = state
+    steps = numpy.arange(1, horizon + 1)
+    damped = numpy.cumsum(DAMPING ** steps)
+    positions = (days - 1 + steps) % SEASON_DAYS
+    expected = level[:, None] + damped[None, :] * trend[:, None] + season[:, positions]
+    # Error variance grows with the horizon as level errors accumulate
+    spread = INTERVAL_Z * sigma[:, None] * numpy.sqrt(1 + (steps[None, :] - 1) * alpha[:, None] ** 2)
+    expected = numpy.clip(expected, 0, None)
+    return expected, numpy.clip(expected - spread, 0, None), expected + spread
+
+def refresh_forecasts(db: Session, today=None) -> dict:
+    """Fit every specialty's history and replace the stored forecasts.
+
+    History ends yesterday; the forecast covers today and the following
+    FORECAST_HORIZON_DAYS - 1 days. The caller commits, so readers see
+    either the old forecast or the new one.
+    """
+    if numpy is None:
+        raise RuntimeError("Forecasting requires numpy")
+    today = today or date.today()
+    start = today - timedelta(days=FORECAST_HISTORY_DAYS)
+    specialties, series = daily_series(db, start, today)
+    # Drop the leading days before any appointment, so a young database is
+    # not fitted on a year of zeros
+    active = numpy.flatnonzero(series.sum(axis=0))
+    if active.size:
+        series = series[:, active[0]:]
+    if not specialties or series.shape[1] < 2 * SEASON_DAYS:
+        return {"specialties": 0, "rows": 0, "historyDays": series.shape[1]}
+
+    expected, lower, upper = project(fit(series), series.shape[1], FORECAST_HORIZON_DAYS)
+    now = datetime.utcnow()
+    rows = [
+        {
+            "specialty": specialty,
+            "day": today + timedelta(days=step),
+            "expected": round(float(expected[i, step]), 2),
+            "lower": round(float(lower[i, step]), 2),
+            "upper": round(float(upper[i, step]), 2),
+            "generated_at": now,
+        }
+        for i, specialty in enumerate(specialties)
+        for step in range(FORECAST_HORIZON_DAYS)
+    ]
+    db.execute(delete(AppointmentForecast))
+    db.execute(insert(AppointmentForecast), rows)
+    return {"specialties": len(specialties), "rows": len(rows), "historyDays": series.shape[1]}
+
+@job("forecast.refresh")
+def refresh_forecasts_job(context, payload):
+    """Recompute the appointment forecasts, e.g. nightly"""
+    db = SessionLocal()
+    try:
+        summary = refresh_forecasts(db)
+        db.commit()
+    finally:
+        db.close()
+    return summary
+
+def stored_forecast(db: Session, days: int, specialty=None) -> dict:
+    """The precomputed forecast from today on, grouped by specialty"""
+    today = date.today()
+    query = (
+        db.query(AppointmentForecast)
+        .filter(AppointmentForecast.day >= today, AppointmentForecast.day < today + timedelta(days=days))
+        .order_by(AppointmentForecast.specialty, AppointmentForecast.day)
+    )
+    if specialty:
+        match = find(db, Specialty, specialty)
+        query = query.filter(AppointmentForecast.specialty == (match.name if match else specialty))
+    specialties = {}
+    generated_at = None
+    for row in query:
+        generated_at = row.generated_at
+        specialties.setdefault(row.specialty, []).append({
+            "date": row.day.isoformat(),
+            "expected": row.expected,
+            "lower": row.lower,
+            "upper": row.upper,
+        })
+    return {
+        "generatedAt": generated_at.isoformat() if generated_at else None,
+        "specialties": [{"specialty": name, "days": values} for name, values in specialties.items()],
+    }
@@ -0,0 +1,395 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from pydantic import BaseModel
+from sqlalchemy import select, update, func, case
+from sqlalchemy.orm import Session
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+from typing import Optional
+import importlib
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from db.database import SessionLocal, get_db
+from db.models import Job
+from app.auth import get_current_user, require_admin, current_actor
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+# Pool processes per worker; each runs one job at a time
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "1"))
+# A running job whose worker has not heartbeated for this long is requeued
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", "120"))
+# Retry n waits JOB_RETRY_BASE_SECONDS * 2**(n-1)
+JOB_RETRY_BASE_SECONDS = 10
+# Handlers write progress at most this often; it doubles as a heartbeat
+PROGRESS_INTERVAL_SECONDS = 1.0
+# Modules that register handlers with @job; imported by the worker and its pool processes
+JOB_MODULES = ("app.reminders", "app.archive", "app.ratings", "app.kpis", "app.forecast", "app.lookups")
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+class JobSpec:
+    def __init__(self, function, concurrency, max_attempts):
+        self.function = function
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+JOB_HANDLERS = {}
+
+def job(kind: str, concurrency: int = 1, max_attempts: int = 3):
+    """Register a function as the handler of ``kind`` jobs.
+
+    Handlers run in a pool process as ``handler(context, payload)`` and
+    return a JSON-serializable result. ``concurrency`` caps how many jobs of
+    the kind one worker runs at once. An exception retries the job with
+    exponential backoff until ``max_attempts`` attempts have been made.
+    """
+    def register(function):
+        JOB_HANDLERS[kind] = JobSpec(function, concurrency, max_attempts)
+        return function
+    return register
+
+class JobCancelled(Exception):
+    """Raised from ``JobContext.progress`` once a cancel has been requested"""
+
+class JobContext:
+    """Handed to a running handler for progress reporting"""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.reported_at = 0.0
+
+    def progress(self, fraction: float, message: Optional[str] = None):
+        """Record progress (0-1); raises JobCancelled if the job was cancelled"""
+        now = time.monotonic()
+        if now - self.reported_at < PROGRESS_INTERVAL_SECONDS and fraction < 1:
+            return
+        self.reported_at = now
+        db = SessionLocal()
+        try:
+            current = db.execute(
+                update(Job)
+                .where(Job.id == self.job_id)
+                .values(progress=min(max(fraction, 0.0), 1.0), message=message, heartbeat_at=datetime.utcnow())
+                .returning(Job.status)
+            ).scalar()
+            db.commit()
+        finally:
+            db.close()
+        if current == "cancelling":
+            raise JobCancelled()
+
+def enqueue(db: Session, kind: str, payload: Optional[dict] = None, priority: int = 0,
+            delay_seconds: float = 0, max_attempts: Optional[int] = None) -> Job:
+    """Queue a job in the caller's transaction; it becomes runnable when that commits"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind {kind}")
+    new_job = Job(
+        kind=kind,
+        payload=payload or {},
+        status="queued",
+        priority=priority,
+        attempts=0,
+        max_attempts=max_attempts or JOB_HANDLERS[kind].max_attempts,
+        run_after=datetime.utcnow() + timedelta(seconds=delay_seconds),
+        progress=0.0,
+        created_by=current_actor.get(),
+    )
+    db.add(new_job)
+    return new_job
+
+def claim(db: Session, worker: str, kinds):
+    """Take the next runnable job of one of ``kinds``, or None.
+
+    Locked rows are skipped, so any number of workers can claim
+    concurrently without blocking on or double-running a job.
+    """
+    now = datetime.utcnow()
+    next_job = (
+        select(Job.id)
+        .where(Job.status == "queued", Job.run_after <= now, Job.kind.in_(kinds))
+        .order_by(Job.priority.desc(), Job.run_after, Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    claimed = db.execute(
+        update(Job)
+        .where(Job.id == next_job)
+        .values(
+            status="running", attempts=Job.attempts + 1, worker=worker,
+            started_at=now, heartbeat_at=now, progress=0.0, message=None,
+        )
+        .returning(Job.id, Job.kind, Job.payload)
+        .execution_options(synchronize_session=False)
+    ).first()
+    db.commit()
+    return claimed
+
+def requeue_stale(db: Session) -> int:
+    """Give jobs of dead workers back to the queue, or fail them when out of attempts"""
+    now = datetime.utcnow()
+    stale = (
+        Job.status.in_(("running", "cancelling")),
+        Job.heartbeat_at < now - timedelta(seconds=JOB_STALE_SECONDS),
+    )
+    requeued = db.execute(
+        update(Job)
+        .where(*stale, Job.status == "running", Job.attempts < Job.max_attempts)
+        .values(status="queued", worker=None, run_after=now, error="Worker stopped responding")
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.execute(
+        update(Job)
+        .where(*stale)
+        .values(
+            status=case((Job.status == "cancelling", "cancelled"), else_="failed"),
+            error="Worker stopped responding",
+            finished_at=now,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return requeued
+
+def execute(job_id: int, kind: str, payload: dict):
+    """Entry point inside a pool process"""
+    return JOB_HANDLERS[kind].function(JobContext(job_id), payload)
+
+def load_handlers():
+    for module in JOB_MODULES:
+        importlib.import_module(module)
+
+class JobWorker:
+    """Claims jobs and runs them in a process pool until stopped.
+
+    Heavy handlers get a process each, so they neither hold the API's event
+    loop nor share its GIL. SIGTERM stops claiming and lets running jobs
+    finish; a worker that dies outright leaves its jobs to requeue_stale.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.running = {}  # future -> (job id, kind)
+        self.stopping = False
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self):
+        load_handlers()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        context = multiprocessing.get_context("spawn")
+        print(f"Job worker {self.name} started with {self.workers} processes")
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=load_handlers) as pool:
+            maintained_at = 0.0
+            while not self.stopping or self.running:
+                if not self.stopping:
+                    self.fill(pool)
+                if time.monotonic() - maintained_at > JOB_STALE_SECONDS / 4:
+                    self.maintain()
+                    maintained_at = time.monotonic()
+                if self.running:
+                    done, _ = wait(self.running, timeout=JOB_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.complete(future)
+                else:
+                    time.sleep(JOB_POLL_SECONDS)
+        print(f"Job worker {self.name} stopped")
+
+    def fill(self, pool):
+        while len(self.running) < self.workers:
+            busy = {}
+            for _, kind in self.running.values():
+                busy[kind] = busy.get(kind, 0) + 1
+            kinds = [kind for kind, spec in JOB_HANDLERS.items() if busy.get(kind, 0) < spec.concurrency]
+            if not kinds:
+                return
+            db = SessionLocal()
+            try:
+                claimed = claim(db, self.name, kinds)
+            except Exception:
+                db.rollback()
+                print("Job claim failed:", traceback.format_exc())
+                return
+            finally:
+                db.close()
+            if claimed is None:
+                return
+            future = pool.submit(execute, claimed.id, claimed.kind, claimed.payload)
+            self.running[future] = (claimed.id, claimed.kind)
+
+    def maintain(self):
+        """Heartbeat this worker's jobs and requeue those of dead workers"""
+        db = SessionLocal()
+        try:
+            ids = [job_id for job_id, _ in self.running.values()]
+            if ids:
+                db.execute(
+                    update(Job)
+                    .where(Job.id.in_(ids), Job.worker == self.name)
+                    .values(heartbeat_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+                db.commit()
+            requeue_stale(db)
+        except Exception:
+            db.rollback()
+            print("Job maintenance failed:", traceback.format_exc())
+        finally:
+            db.close()
+
+    def complete(self, future):
+        job_id, kind = self.running.pop(future)
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            record = db.query(Job).filter(Job.id == job_id, Job.worker == self.name).first()
+            if record is None:  # Requeued as stale and picked up elsewhere
+                return
+            try:
+                record.result = future.result()
+                record.status = "succeeded"
+                record.progress = 1.0
+                record.error = None
+            except JobCancelled:
+                record.status = "cancelled"
+            except Exception as exc:
+                record.error = "".join(traceback.format_exception(exc))
+                if record.attempts < record.max_attempts and record.status == "running":
+                    record.status = "queued"
+                    record.worker = None
+                    record.run_after = now + timedelta(seconds=JOB_RETRY_BASE_SECONDS * 2 ** (record.attempts - 1))
+                    print(f"Job {job_id} ({kind}) attempt {record.attempts} failed; retrying")
+                else:
+                    record.status = "cancelled" if record.status == "cancelling" else "failed"
+                    print(f"Job {job_id} ({kind}) failed:", record.error)
+            if record.status in FINISHED_STATUSES:
+                record.finished_at = now
+            db.commit()
+        except Exception:
+            db.rollback()
+            print(f"Recording the outcome of job {job_id} failed:", traceback.format_exc())
+        finally:
+            db.close()
+
+class JobCreate(BaseModel):
+    kind: str
+    payload: dict = {}
+    priority: int = 0
+
+def job_response(record: Job) -> dict:
+    return {
+        "id": record.id,
+        "kind": record.kind,
+        "status": record.status,
+        "progress": record.progress,
+        "message": record.message,
+        "attempts": record.attempts,
+        "maxAttempts": record.max_attempts,
+        "result": record.result,
+        "error": record.error,
+        "createdBy": record.created_by,
+        "createdAt": record.created_at.isoformat() if record.created_at else None,
+        "startedAt": record.started_at.isoformat() if record.started_at else None,
+        "finishedAt": record.finished_at.isoformat() if record.finished_at else None,
+    }
+
+def job_counts(db: Session) -> dict:
+    """Jobs per kind and status, and how long the oldest runnable job has waited"""
+    counts = {}
+    for kind, job_status, count in db.query(Job.kind, Job.status, func.count(Job.id)).group_by(Job.kind, Job.status):
+        counts.setdefault(kind, {})[job_status] = count
+    oldest = (
+        db.query(func.min(Job.run_after))
+        .filter(Job.status == "queued", Job.run_after <= datetime.utcnow())
+        .scalar()
+    )
+    return {
+        "kinds": counts,
+        "oldestQueuedSeconds": round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else 0.0,
+    }
+
+@router.post("", status_code=status.HTTP_202_ACCEPTED)
+def create_job(data: JobCreate, db: Session = Depends(get_db), current_user: dict = Depends(require_admin)):
+    """Queue a job; poll GET /jobs/{id} for its progress and result"""
+    try:
+        new_job = enqueue(db, data.kind, data.payload, data.priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db.commit()
+    return job_response(new_job)
+
+def visible_to(query, current_user: dict):
+    """Admins see every job; anyone else only the jobs they queued"""
+    if current_user["role"] == "admin":
+        return query
+    return query.filter(Job.created_by == f"{current_user['role']}:{current_user['id']}")
+
+@router.get("")
+def list_jobs(
+    kind: Optional[str] = None,
+    job_status: Optional[str] = Query(None, alias="status"),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Most recent jobs first"""
+    query = visible_to(db.query(Job), current_user)
+    if kind:
+        query = query.filter(Job.kind == kind)
+    if job_status:
+        query = query.filter(Job.status == job_status)
+    return [job_response(record) for record in query.order_by(Job.id.desc()).limit(limit)]
+
+@router.get("/{job_id}")
+def get_job(job_id: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    """Status, progress and, once finished, the result or error of a job.
+
+    Reads the primary so a job is visible straight after it was queued.
+    Results can hold recipients and tracebacks, so only admins and the
+    job's creator can read it.
+    """
+    record = visible_to(db.query(Job), current_user).filter(Job.id == job_id).first()
+    if not record:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(record)
+
+@router.post("/{job_id}/cancel")
+def cancel_job(job_id: int, db: Session = Depends(get_db), current_user: dict = Depends(require_admin)):
+    """Cancel a queued job at once, or ask a running one to stop at its next progress report"""
+    record = db.query(Job).filter(Job.id == job_id).with_for_update().first()
+    if not record:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if record.status in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job is already {record.status}")
+    if record.status == "queued":
+        record.status = "cancelled"
+        record.finished_at = datetime.utcnow()
+    else:
+        record.status = "cancelling"
+    db.commit()
+    return job_response(record)
+
+if __name__ == "__main__":
+    # python -m app.jobs                          run a worker
+    # python -m app.jobs enqueue KIND [JSON]      queue a job, e.g. from cron
+    from app.jobs import JobWorker, enqueue, load_handlers
+    if sys.argv[1:2] == ["enqueue"]:
+        load_handlers()
+        session = SessionLocal()
+        try:
+            queued = enqueue(session, sys.argv[2], json.loads(sys.argv[3]) if len(sys.argv) > 3 else {})
+            session.commit()
+            print(f"Queued job {queued.id}")
+        finally:
+            session.close()
+    else:
+        JobWorker().run()
@@ -0,0 +1,198 @@
+from sqlalchemy import func, cast, Date
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+from db.database import SessionLocal
+from db.models import Patient, Appointment, Feedback, DailyKpi, Job
+from app.archive import with_archive
+from app.jobs import job, enqueue
+
+# A day is snapshotted this long after it ends, so rows stamped just before
+# midnight but committed just after it still make it into the snapshot.
+ROLLUP_DELAY = timedelta(minutes=10)
+PERIOD_DAYS = {"day": 1, "week": 7, "month": 30}
+COUNTERS = ("patients", "appointments", "feedback", "rating_sum")
+
+def midnight(day: date) -> datetime:
+    return datetime.combine(day, time.min)
+
+def sources(include_archive: bool):
+    if include_archive:
+        return Patient, with_archive(Appointment), with_archive(Feedback)
+    return Patient, Appointment, Feedback
+
+def counts_between(db: Session, start=None, end=None) -> dict:
+    """Rows created in [start, end), counted with range scans on created_at.
+
+    Without a start the whole history is counted, archived rows included.
+    """
+    patients, appointments, feedback = sources(include_archive=start is None)
+
+    def window(query, column):
+        if start is not None:
+            query = query.filter(column >= start)
+        if end is not None:
+            query = query.filter(column < end)
+        return query
+
+    feedback_count, rating_sum = window(
+        db.query(func.count(feedback.id), func.coalesce(func.sum(feedback.rating), 0)), feedback.created_at
+    ).one()
+    return {
+        "patients": window(db.query(func.count(patients.id)), patients.created_at).scalar() or 0,
+        "appointments": window(db.query(func.count(appointments.id)), appointments.created_at).scalar() or 0,
+        "feedback": feedback_count or 0,
+        "rating_sum": int(rating_sum or 0),
+    }
+
+def totals_before(db: Session, day: date) -> Optional[dict]:
+    """Running totals of everything created before ``day`` began.
+
+    Reads the latest snapshot before ``day`` and counts live only the days
+    after it that are not snapshotted yet (normally none, or just today).
+    None if kpis.roll_up has never run: there is no baseline to count from,
+    and counting the whole history instead is what the snapshots avoid.
+    """
+    snapshot = db.query(DailyKpi).filter(DailyKpi.day < day).order_by(DailyKpi.day.desc()).first()
+    if snapshot is None:
+        if db.query(DailyKpi.day).first() is None:
+            return None
+        # Snapshots start at the first day with any rows
+        return dict.fromkeys(COUNTERS, 0)
+    totals = {name: getattr(snapshot, name) for name in COUNTERS}
+    start = snapshot.day + timedelta(days=1)
+    if start < day:
+        live = counts_between(db, midnight(start), midnight(day))
+        totals = {name: totals[name] + live[name] for name in COUNTERS}
+    return totals
+
+def roll_up(db: Session, through: date) -> int:
+    """Rewrite the running-total snapshot of every closed day up to ``through``.
+
+    Totals are recomputed from the source tables, archives included, with
+    one grouped pass per table. Rows deleted since a day was first
+    snapshotted therefore drop out of its totals, instead of being counted
+    forever. Meant for the kpis.roll_up job; reads never write snapshots.
+    """
+    patients, appointments, feedback = sources(include_archive=True)
+    end = midnight(through + timedelta(days=1))
+
+    per_day = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for name, model in (("patients", patients), ("appointments", appointments)):
+        day = cast(model.created_at, Date)
+        for bucket, count in db.query(day, func.count(model.id)).filter(model.created_at < end).group_by(day):
+            per_day[bucket][name] = count
+    day = cast(feedback.created_at, Date)
+    rows = (
+        db.query(day, func.count(feedback.id), func.coalesce(func.sum(feedback.rating), 0))
+        .filter(feedback.created_at < end)
+        .group_by(day)
+    )
+    for bucket, count, rating_sum in rows:
+        per_day[bucket]["feedback"] = count
+        per_day[bucket]["rating_sum"] = int(rating_sum)
+    if not per_day:
+        return 0
+
+    snapshots = []
+    totals = dict.fromkeys(COUNTERS, 0)
+    day = min(per_day)
+    while day <= through:
+        for name in COUNTERS:
+            totals[name] += per_day[day][name]
+        snapshots.append({"day": day, **totals, "created_at": datetime.utcnow()})
+        day += timedelta(days=1)
+    statement = pg_insert(DailyKpi)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[DailyKpi.day],
+            set_={name: statement.excluded[name] for name in (*COUNTERS, "created_at")},
+        ),
+        snapshots,
+    )
+    return len(snapshots)
+
+def rollup_target() -> date:
+    """The last day that can be snapshotted now"""
+    return (datetime.utcnow() - ROLLUP_DELAY).date() - timedelta(days=1)
+
+@job("kpis.roll_up")
+def roll_up_job(context, payload):
+    """Recompute the daily snapshots through the last closed day, e.g. nightly.
+
+    Days after the last snapshot are counted live by totals_before, so a
+    missed run only makes the dashboard slower, never wrong.
+    """
+    db = SessionLocal()
+    try:
+        days = roll_up(db, rollup_target())
+        db.commit()
+    finally:
+        db.close()
+    return {"days": days}
+
+def ensure_kpi_snapshots(db: Session):
+    """Queue the first roll-up on start against a database with rows but no snapshots"""
+    if db.query(DailyKpi.day).first() is not None:
+        return
+    if all(db.query(model.id).first() is None for model in (Patient, Appointment, Feedback)):
+        return
+    pending = db.query(Job.id).filter(Job.kind == "kpis.roll_up", Job.status.in_(("queued", "running"))).first()
+    if pending is None:
+        enqueue(db, "kpis.roll_up")
+        db.commit()
+
+def percent_change(current, previous) -> float:
+    if not previous:
+        return 100.0 if current else 0.0
+    return (current - previous) / previous * 100
+
+def satisfaction(feedback, rating_sum):
+    """Mean rating on a 0-100 scale, or None without feedback"""
+    return rating_sum / feedback * 20 if feedback else None
+
+def period_kpis(db: Session, period: str = "week") -> dict:
+    """Totals now, and the last complete period against the one before it.
+
+    For ``week`` the current period is the 7 full days before today and the
+    previous period the 7 days before that. The cost is four snapshot
+    lookups plus range counts over today only, whatever the history size.
+
+    Until the first roll-up has run there is nothing to compare against:
+    the totals are counted once and every change is None, with
+    ``baseline`` False.
+    """
+    days = PERIOD_DAYS[period]
+    today = datetime.utcnow().date()
+    now = totals_before(db, today + timedelta(days=1))
+    if now is None:
+        now = counts_between(db)
+        return {
+            "totals": now,
+            "satisfaction": satisfaction(now["feedback"], now["rating_sum"]) or 0.0,
+            "baseline": False,
+            "changes": dict.fromkeys(("patients", "appointments", "feedback", "satisfaction")),
+        }
+    before_previous = totals_before(db, today - timedelta(days=2 * days))
+    before_current = totals_before(db, today - timedelta(days=days))
+    end_current = totals_before(db, today)
+
+    current = {name: end_current[name] - before_current[name] for name in COUNTERS}
+    previous = {name: before_current[name] - before_previous[name] for name in COUNTERS}
+    current_satisfaction = satisfaction(current["feedback"], current["rating_sum"])
+    previous_satisfaction = satisfaction(previous["feedback"], previous["rating_sum"])
+    return {
+        "totals": now,
+        "satisfaction": satisfaction(now["feedback"], now["rating_sum"]) or 0.0,
+        "baseline": True,
+        "changes": {
+            "patients": percent_change(current["patients"], previous["patients"]),
+            "appointments": percent_change(current["appointments"], previous["appointments"]),
+            "feedback": percent_change(current["feedback"], previous["feedback"]),
+            # Percentage points, and only when both periods had feedback
+            "satisfaction": current_satisfaction - previous_satisfaction
+                if current_satisfaction is not None and previous_satisfaction is not None else 0.0,
+        },
+    }
@@ -0,0 +1,176 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy import case, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from difflib import SequenceMatcher
+from itertools import combinations
+import re
+import unicodedata
+from db.database import SessionLocal, get_read_db
+from db.models import Doctor, Appointment, DoctorRatingStat, Specialty, AppointmentCategory, appointments_archive
+from app.auth import require_admin
+from app.jobs import job
+
+router = APIRouter(prefix="/lookups", tags=["Lookups"])
+
+# Entries whose keys are at least this similar are listed for an admin to
+# review. They are never merged automatically: distinct specialties can be
+# this close ("hepatology"/"hematology" scores 0.9).
+REVIEW_CUTOFF = 0.88
+BACKFILL_BATCH_SIZE = 5000
+
+# (table, text column, id column, lookup model) pairs kept in step. The text
+# columns stay, holding the canonical name, for API responses and sync clients.
+BACKFILLS = (
+    (Doctor.__table__, "specialty", "specialty_id", Specialty),
+    (Appointment.__table__, "category", "category_id", AppointmentCategory),
+    (appointments_archive, "category", "category_id", AppointmentCategory),
+)
+
+def lookup_key(text) -> str:
+    """Case-, accent- and punctuation-insensitive key, e.g. obstetrique gyneco for Obstétrique & Gynéco"""
+    decomposed = unicodedata.normalize("NFKD", (text or "").casefold())
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", stripped).split())
+
+def display_name(text: str) -> str:
+    name = " ".join(text.split())
+    return name.title() if name.islower() or name.isupper() else name
+
+def find(db: Session, model, text):
+    """The (id, name) row whose folded key ``text`` matches, or None"""
+    key = lookup_key(text)
+    if not key:
+        return None
+    return db.execute(select(model.id, model.name).where(model.key == key)).first()
+
+def resolve(db: Session, model, text):
+    """(id, name) for ``text``, adding a new entry if nothing matches; None for blank text.
+
+    Concurrent writers adding the same new name end up with the same row.
+    """
+    row = find(db, model, text)
+    if row is not None or not lookup_key(text):
+        return row
+    db.execute(
+        pg_insert(model)
+        .values(name=display_name(text), key=lookup_key(text))
+        .on_conflict_do_nothing(index_elements=[model.key])
+    )
+    return db.execute(select(model.id, model.name).where(model.key == lookup_key(text))).one()
+
+def canonical(db: Session, model, text):
+    """(id, name) to store for user-entered ``text``; (None, text) when it is blank"""
+    row = resolve(db, model, text)
+    return (row.id, row.name) if row is not None else (None, text)
+
+def backfill_column(db: Session, table, text_name: str, id_name: str, model) -> int:
+    """Point every row without an id at its canonical entry, in id-range batches.
+
+    Each distinct spelling is resolved once; the rows are then updated with
+    one CASE statement per batch, each committed on its own so no long
+    transaction holds locks on a big table. Returns the rows updated.
+    """
+    text_column, id_column = table.c[text_name], table.c[id_name]
+    spellings = db.execute(
+        select(text_column).where(id_column.is_(None), text_column.isnot(None)).distinct()
+    ).scalars().all()
+    resolved = {spelling: resolve(db, model, spelling) for spelling in spellings}
+    resolved = {spelling: row for spelling, row in resolved.items() if row is not None}
+    db.commit()
+    if not resolved:
+        return 0
+
+    low, high = db.execute(select(func.min(table.c.id), func.max(table.c.id))).one()
+    updated = 0
+    for start in range(low, high + 1, BACKFILL_BATCH_SIZE):
+        updated += db.execute(
+            update(table)
+            .where(
+                table.c.id >= start,
+                table.c.id < start + BACKFILL_BATCH_SIZE,
+                id_column.is_(None),
+                text_column.in_(resolved),
+            )
+            .values({
+                id_name: case({spelling: row.id for spelling, row in resolved.items()}, value=text_column),
+                text_name: case({spelling: row.name for spelling, row in resolved.items()}, value=text_column),
+            })
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+    return updated
+
+def near_misses(db: Session, model, cutoff: float = REVIEW_CUTOFF) -> list:
+    """Pairs of entries with similar keys, most similar first, e.g. a typo next to the real name.
+
+    The lookup tables hold tens of rows, so every pair is compared.
+    """
+    rows = db.execute(select(model.id, model.name, model.key)).all()
+    pairs = []
+    for a, b in combinations(rows, 2):
+        similarity = SequenceMatcher(None, a.key, b.key).ratio()
+        if similarity >= cutoff:
+            pairs.append({
+                "entries": [{"id": a.id, "name": a.name}, {"id": b.id, "name": b.name}],
+                "similarity": round(similarity, 3),
+            })
+    return sorted(pairs, key=lambda pair: -pair["similarity"])
+
+def needs_backfill(db: Session) -> bool:
+    """Whether any row still has text but no lookup id"""
+    return any(
+        db.execute(
+            select(table.c.id).where(table.c[id_name].is_(None), table.c[text_name].isnot(None)).limit(1)
+        ).first() is not None
+        for table, text_name, id_name, _ in BACKFILLS
+    )
+
+def backfill_lookups(db: Session) -> dict:
+    updated = {
+        f"{table.name}.{id_name}": backfill_column(db, table, text_name, id_name, model)
+        for table, text_name, id_name, model in BACKFILLS
+    }
+    # Leaderboard rows copy their doctor's specialty
+    updated["doctor_rating_stats.specialty_id"] = db.execute(
+        update(DoctorRatingStat)
+        .where(DoctorRatingStat.specialty_id.is_(None))
+        .values(specialty_id=select(Doctor.specialty_id).where(Doctor.id == DoctorRatingStat.doctor_id).scalar_subquery())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return updated
+
+def ensure_lookups(db: Session):
+    """Map existing strings on start, so the integer joins see every row after an upgrade"""
+    if needs_backfill(db):
+        print(f"Backfilled lookup ids: {backfill_lookups(db)}")
+
+@job("lookups.backfill")
+def backfill_lookups_job(context, payload):
+    """Canonicalize specialty and category strings written before the lookup tables existed"""
+    db = SessionLocal()
+    try:
+        return {
+            "updated": backfill_lookups(db),
+            "nearMisses": len(near_misses(db, Specialty)) + len(near_misses(db, AppointmentCategory)),
+        }
+    finally:
+        db.close()
+
+@router.get("/review")
+def review_lookups(db: Session = Depends(get_read_db), current_user: dict = Depends(require_admin)):
+    """Similar specialty and category names that may be the same thing, for an admin to check"""
+    return {
+        "specialties": near_misses(db, Specialty),
+        "categories": near_misses(db, AppointmentCategory),
+    }
+
+if __name__ == "__main__":
+    # The API backfills on start; this runs it without starting a server
+    db = SessionLocal()
+    try:
+        print(backfill_lookups(db))
+        print({"specialties": near_misses(db, Specialty), "categories": near_misses(db, AppointmentCategory)})
+    finally:
+        db.close()
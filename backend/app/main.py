@@ -1,8 +1,11 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from db.database import Base, engine, SessionLocal
+import asyncio
+import time
+from db.database import Base, engine, SessionLocal, READ_PRIMARY_COOKIE, READ_YOUR_WRITES_SECONDS
 from db.models import FeedbackCategory
+from db.migrations import apply_migrations
 from app.doctor import router as doctor_router
 from app.patient import router as patient_router
 from app.feedback import router as feedback_router
@@ -11,9 +14,25 @@ from app.reminders import router as reminders_router
 from app.appointments import router as appointments_router, public_router as appointments_public_router
 from app.medications import router as medications_router
 from app.statistics import router as statistics_router
+from app.metrics import router as metrics_router
+from app.sync import router as sync_router
+from app.text_analytics import router as text_analytics_router, text_indexer
+from app.archive import router as archive_router
+from app.audit import router as audit_router, audit_writer
+from app.exports import router as exports_router
+from app.jobs import router as jobs_router
+from app.profiler import router as profiler_router, ProfilerMiddleware, instrument_routes, profiler
+from app.compression import CompressionMiddleware
+from app.admission import AdmissionMiddleware
+from app.events import broadcaster
+from app.feedback_queue import feedback_queue
+from app.ratings import ensure_rating_stats
+from app.lookups import router as lookups_router, ensure_lookups
+from app.kpis import ensure_kpi_snapshots
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    broadcaster.attach(asyncio.get_running_loop())
     db = SessionLocal()
     try:
         # Initialize feedback categories only if none exist
@@ -23,20 +42,54 @@ async def lifespan(app: FastAPI):
             for name in categories:
                 db.add(FeedbackCategory(name=name))
             db.commit()
-        yield
+        ensure_lookups(db)
+        ensure_rating_stats(db)
+        ensure_kpi_snapshots(db)
     finally:
         db.close()
+    feedback_queue.start()
+    text_indexer.start()
+    audit_writer.start()
+    profiler.start_continuous()
+    try:
+        yield
+    finally:
+        # Drain queued feedback before the process exits
+        feedback_queue.stop()
+        text_indexer.stop()
+        audit_writer.stop()
+        profiler.stop_continuous()
 
 app = FastAPI(title="DGH Care API", version="1.0.0", lifespan=lifespan)
 
+# Innermost, so shed requests still get CORS headers the browser can read
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://192.168.1.186:3000", "http://localhost:3000","*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified", "Content-Disposition", "X-Export-Until-Id"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+app.add_middleware(ProfilerMiddleware)
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """Pin a client to the primary for a few seconds after a successful write"""
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        response.set_cookie(
+            READ_PRIMARY_COOKIE,
+            str(time.time() + READ_YOUR_WRITES_SECONDS),
+            max_age=READ_YOUR_WRITES_SECONDS,
+            httponly=True,
+            samesite="lax",
+        )
+    return response
 Base.metadata.create_all(bind=engine)
+apply_migrations(engine)
 
 app.include_router(doctor_router, prefix="/doctor", tags=["Doctors"])
 app.include_router(patient_router, prefix="/patients", tags=["Patients"])
@@ -47,6 +100,17 @@ app.include_router(appointments_router, prefix="/appointments", tags=["Appointme
 app.include_router(appointments_public_router, prefix="/appointments/public", tags=["Appointments Public"])
 app.include_router(medications_router, prefix="/medications", tags=["Medications"])
 app.include_router(statistics_router)
+app.include_router(metrics_router)
+app.include_router(sync_router)
+app.include_router(text_analytics_router)
+app.include_router(archive_router)
+app.include_router(audit_router)
+app.include_router(exports_router)
+app.include_router(jobs_router)
+app.include_router(lookups_router)
+app.include_router(profiler_router)
+# After every router: maps endpoints to routes for the profiler
+instrument_routes(app)
 
 @app.get("/health")
 def health_check():
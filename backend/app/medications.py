@@ -1,14 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header, Response
+from sqlalchemy import func, literal_column, insert, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from typing import List, Optional
 from pydantic import BaseModel
-from db.database import get_db
+from db.database import get_db, get_read_db
 from db.models import Medication, Doctor, Patient
 from app.auth import get_current_user
-from datetime import datetime
+from app.batch import parse_ids, in_request_order
+from app.writes import raise_for_constraint, etag, parse_if_match, check_version
+from datetime import datetime, date
 
 router = APIRouter()
 
+# Largest page the pharmacy-wide active listing will return
+MAX_ACTIVE_PAGE = 500
+
 class MedicationBase(BaseModel):
     patient_id: int
     doctor_id: int
@@ -16,8 +24,8 @@ class MedicationBase(BaseModel):
     dosage: str
     frequency: str
     instructions: Optional[str] = None
-    start_date: Optional[str] = None
-    end_date: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
 
 class MedicationCreate(MedicationBase):
     pass
@@ -25,57 +33,109 @@ class MedicationCreate(MedicationBase):
 class MedicationResponse(MedicationBase):
     id: int
     created_at: datetime
+    version: Optional[int] = None
     doctor_name: Optional[str] = None
     patient_name: Optional[str] = None
     
     class Config:
         orm_mode = True
 
+class MedicationBatchResponse(BaseModel):
+    items: List[MedicationResponse]
+    missing: List[int]
+
+class ActiveMedicationPage(BaseModel):
+    items: List[MedicationResponse]
+    next_after_id: Optional[int] = None
+
+def check_dates(medication: MedicationBase):
+    if medication.start_date and medication.end_date and medication.end_date < medication.start_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_date cannot be before start_date"
+        )
+
+def medication_query(db: Session):
+    """Medications with doctor and patient names resolved in the same query"""
+    return (
+        db.query(Medication, Doctor.name, Patient.id, Patient.first_name, Patient.last_name)
+        .outerjoin(Doctor, Doctor.id == Medication.doctor_id)
+        .outerjoin(Patient, Patient.id == Medication.patient_id)
+    )
+
+def with_names(rows):
+    medications = []
+    for medication, doctor_name, patient_id, first_name, last_name in rows:
+        medication.doctor_name = doctor_name
+        if patient_id is not None:
+            medication.patient_name = f"{first_name} {last_name}"
+        medications.append(medication)
+    return medications
+
+def active_on(day: date):
+    """Filter for prescriptions whose inclusive [start_date, end_date] covers day.
+
+    NULL bounds are open-ended. The expression matches the GiST index on
+    daterange(start_date, end_date, '[]') so it stays an index scan.
+    """
+    return func.daterange(Medication.start_date, Medication.end_date, literal_column("'[]'")).op("@>")(day)
+
 @router.post("/", response_model=MedicationResponse, status_code=status.HTTP_201_CREATED)
 def create_medication(medication: MedicationCreate, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    """Create a new medication record"""
-    
-    # Verify patient and doctor exist
-    patient = db.query(Patient).filter(Patient.id == medication.patient_id).first()
-    if not patient:
-        raise HTTPException(status_code=404, detail=f"Patient with ID {medication.patient_id} not found")
-    
-    doctor = db.query(Doctor).filter(Doctor.id == medication.doctor_id).first()
-    if not doctor:
-        raise HTTPException(status_code=404, detail=f"Doctor with ID {medication.doctor_id} not found")
-    
-    # Create medication record
-    db_medication = Medication(
-        patient_id=medication.patient_id,
-        doctor_id=medication.doctor_id,
-        medication=medication.medication,
-        dosage=medication.dosage,
-        frequency=medication.frequency,
-        instructions=medication.instructions,
-        start_date=medication.start_date,
-        end_date=medication.end_date
-    )
-    
-    db.add(db_medication)
-    db.commit()
-    db.refresh(db_medication)
+    """Create a new medication record.
+
+    The patient and doctor are checked by their foreign keys rather than
+    looked up first, and the names come back from the same statement.
+    """
+    check_dates(medication)
     
-    # Add doctor and patient names for the response
-    db_medication.doctor_name = doctor.name
-    db_medication.patient_name = f"{patient.first_name} {patient.last_name}"
+    # Insert and read back the row with names in one round-trip
+    new_medication = (
+        insert(Medication)
+        .values(
+            patient_id=medication.patient_id,
+            doctor_id=medication.doctor_id,
+            medication=medication.medication,
+            dosage=medication.dosage,
+            frequency=medication.frequency,
+            instructions=medication.instructions,
+            start_date=medication.start_date,
+            end_date=medication.end_date
+        )
+        .returning(*Medication.__table__.c)
+        .cte("new_medication")
+    )
+    try:
+        row = db.execute(
+            select(new_medication, Doctor.name.label("doctor_name"), Patient.first_name, Patient.last_name)
+            .select_from(new_medication)
+            .join(Doctor, Doctor.id == new_medication.c.doctor_id)
+            .join(Patient, Patient.id == new_medication.c.patient_id)
+        ).one()
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise_for_constraint(e, {
+            "medications_patient_id_fkey": (404, f"Patient with ID {medication.patient_id} not found"),
+            "medications_doctor_id_fkey": (404, f"Doctor with ID {medication.doctor_id} not found"),
+        }, "Database error during medication creation")
     
-    return db_medication
+    return {**row._mapping, "patient_name": f"{row.first_name} {row.last_name}"}
 
 @router.get("/", response_model=List[MedicationResponse])
 def get_medications(
     patient_id: Optional[int] = None, 
     doctor_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    active_on_date: Optional[date] = Query(None, alias="active_on"),
+    db: Session = Depends(get_read_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get medications with optional filters"""
+    """Get medications with optional filters.
+
+    ``active_on=YYYY-MM-DD`` keeps only prescriptions running on that day.
+    """
     
-    query = db.query(Medication)
+    query = medication_query(db)
     
     # Apply filters if provided
     if patient_id:
@@ -83,85 +143,108 @@ def get_medications(
     
     if doctor_id:
         query = query.filter(Medication.doctor_id == doctor_id)
+
+    if active_on_date:
+        query = query.filter(active_on(active_on_date))
     
-    # Get medications
-    medications = query.all()
-    
-    # Add doctor and patient names for the response
-    for medication in medications:
-        doctor = db.query(Doctor).filter(Doctor.id == medication.doctor_id).first()
-        patient = db.query(Patient).filter(Patient.id == medication.patient_id).first()
-        
-        if doctor:
-            medication.doctor_name = doctor.name
-        
-        if patient:
-            medication.patient_name = f"{patient.first_name} {patient.last_name}"
-    
-    return medications
+    return with_names(query.order_by(Medication.id).all())
+
+@router.get("/active", response_model=ActiveMedicationPage)
+def get_active_medications(
+    on: Optional[date] = None,
+    after_id: int = 0,
+    limit: int = Query(100, ge=1, le=MAX_ACTIVE_PAGE),
+    db: Session = Depends(get_read_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Pharmacy-wide listing of prescriptions active on a day (default today).
+
+    Pages are keyed on id: pass the returned ``next_after_id`` as
+    ``after_id`` to continue, so deep pages cost the same as the first.
+    """
+    day = on or date.today()
+    rows = (
+        medication_query(db)
+        .filter(active_on(day), Medication.id > after_id)
+        .order_by(Medication.id)
+        .limit(limit)
+        .all()
+    )
+    items = with_names(rows)
+    return ActiveMedicationPage(
+        items=items,
+        next_after_id=items[-1].id if len(items) == limit else None
+    )
+
+@router.get("/batch", response_model=MedicationBatchResponse)
+def get_medications_batch(
+    ids: str,
+    db: Session = Depends(get_read_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get several medications in one query, in the order requested (?ids=1,2,3)"""
+    medication_ids = parse_ids(ids)
+    rows = medication_query(db).filter(Medication.id.in_(medication_ids)).all()
+    items, missing = in_request_order(with_names(rows), medication_ids)
+    return {"items": items, "missing": missing}
 
 @router.get("/{medication_id}", response_model=MedicationResponse)
 def get_medication(
     medication_id: int, 
+    response: Response,
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get a specific medication by ID"""
+    """Get a specific medication by ID. The ETag is its version, for If-Match on update."""
     
-    medication = db.query(Medication).filter(Medication.id == medication_id).first()
+    row = medication_query(db).filter(Medication.id == medication_id).first()
     
-    if not medication:
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Medication with ID {medication_id} not found"
         )
     
-    # Add doctor and patient names for the response
-    doctor = db.query(Doctor).filter(Doctor.id == medication.doctor_id).first()
-    patient = db.query(Patient).filter(Patient.id == medication.patient_id).first()
-    
-    if doctor:
-        medication.doctor_name = doctor.name
-    
-    if patient:
-        medication.patient_name = f"{patient.first_name} {patient.last_name}"
-    
-    return medication
+    response.headers["ETag"] = etag(row[0].version)
+    return with_names([row])[0]
 
 @router.put("/{medication_id}", response_model=MedicationResponse)
 def update_medication(
     medication_id: int, 
     medication: MedicationCreate, 
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Update an existing medication"""
-    
-    db_medication = db.query(Medication).filter(Medication.id == medication_id).first()
+    """Update an existing medication; ``If-Match`` works as for appointments"""
+    check_dates(medication)
+    expected = parse_if_match(if_match)
+    row = medication_query(db).filter(Medication.id == medication_id).first()
     
-    if not db_medication:
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Medication with ID {medication_id} not found"
         )
+    db_medication = with_names([row])[0]
+    check_version(db_medication.version, expected, "Medication")
+    linked = (db_medication.doctor_id, db_medication.patient_id)
     
     # Update medication fields
     for key, value in medication.dict().items():
         setattr(db_medication, key, value)
     
-    db.commit()
-    db.refresh(db_medication)
-    
-    # Add doctor and patient names for the response
-    doctor = db.query(Doctor).filter(Doctor.id == db_medication.doctor_id).first()
-    patient = db.query(Patient).filter(Patient.id == db_medication.patient_id).first()
-    
-    if doctor:
-        db_medication.doctor_name = doctor.name
-    
-    if patient:
-        db_medication.patient_name = f"{patient.first_name} {patient.last_name}"
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Medication was modified by someone else; reload and retry")
     
+    # Names come from the first query unless the update moved the medication
+    if (medication.doctor_id, medication.patient_id) != linked:
+        db_medication = with_names([medication_query(db).filter(Medication.id == medication_id).one()])[0]
+    response.headers["ETag"] = etag(db_medication.version)
     return db_medication
 
 @router.delete("/{medication_id}", status_code=status.HTTP_204_NO_CONTENT)
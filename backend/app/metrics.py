@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from db.database import get_read_db
+from app.compression import stats as compression_stats
+from app.events import broadcaster
+from app.feedback_queue import feedback_queue
+from app.text_analytics import text_indexer
+from app.audit import audit_writer
+from app.admission import admission
+from app.jobs import job_counts
+from app.singleflight import flights
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+@router.get("/compression")
+def get_compression_metrics():
+    """Return how many response bytes compression has saved since startup"""
+    return compression_stats.snapshot()
+
+@router.get("/stream")
+def get_stream_metrics():
+    """Return the number of live dashboard subscribers and dropped events"""
+    return broadcaster.stats()
+
+@router.get("/feedback-queue")
+def get_feedback_queue_metrics():
+    """Return depth and throughput counters of the feedback ingestion queue"""
+    return feedback_queue.snapshot()
+
+@router.get("/text-index")
+def get_text_index_metrics():
+    """Return progress of the background feedback text indexer"""
+    return text_indexer.snapshot()
+
+@router.get("/audit")
+def get_audit_metrics():
+    """Return buffer depth and write counters of the audit log writer"""
+    return audit_writer.snapshot()
+
+@router.get("/admission")
+def get_admission_metrics():
+    """Return per-class concurrency, queue depth and shed counts of admission control"""
+    return admission.snapshot()
+
+@router.get("/jobs")
+def get_job_metrics(db: Session = Depends(get_read_db)):
+    """Return job counts per kind and status, and the age of the oldest runnable job"""
+    return job_counts(db)
+
+@router.get("/singleflight")
+def get_singleflight_metrics():
+    """Return per-endpoint executions and the duplicate executions saved by request coalescing"""
+    return flights.snapshot()
@@ -1,10 +1,20 @@
-from fastapi import APIRouter, Depends,HTTPException,status
+from fastapi import APIRouter, Depends,HTTPException,status, Request, Response, Query
 from datetime import datetime
+from typing import Optional
+from sqlalchemy import func, case, select, union_all, literal, cast, null, tuple_, String, Integer, DateTime
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from db.database import SessionLocal
-from db.models import Patient
-from app.schemas import PatientResponse
+from db.database import SessionLocal, get_read_db
+from sqlalchemy.orm import aliased
+from db.models import Patient, Appointment, Medication, MedicationReminder, Feedback, FeedbackCategory, Doctor, DuplicateCandidate
+from app.schemas import PatientResponse, PatientBatchResponse, TimelineEntry, TimelinePage
+from app.caching import conditional_get
+from app.events import broadcaster
+from app.batch import parse_ids, in_request_order
+from app.auth import get_current_user, require_admin
+from app.dedupe import merge_patients, rebuild_index
+from app.dates import sql_datetime
+from app.archive import with_archive
 
 router = APIRouter()
 
@@ -16,8 +26,11 @@ def get_db():
         db.close()
 
 @router.get("/", response_model=list[PatientResponse])
-def list_patients(db: Session = Depends(get_db)):
+def list_patients(request: Request, response: Response, db: Session = Depends(get_read_db)):
     """Return a list of all patients"""
+    not_modified = conditional_get(request, response, db, Patient)
+    if not_modified:
+        return not_modified
     try:
         patients = db.query(Patient).all()
         return [
@@ -37,7 +50,7 @@ def list_patients(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Failed to fetch patients: {str(e)}")
 
 @router.get("/search", response_model=list[PatientResponse])
-def search_patients(name: str = None, db: Session = Depends(get_db)):
+def search_patients(name: str = None, db: Session = Depends(get_read_db)):
     """Search patients by name"""
     try:
         query = db.query(Patient)
@@ -65,6 +78,121 @@ def search_patients(name: str = None, db: Session = Depends(get_db)):
         print(f"Error searching patients: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to search patients: {str(e)}")
 
+@router.get("/batch", response_model=PatientBatchResponse)
+def get_patients_batch(
+    ids: str,
+    db: Session = Depends(get_read_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Return several patients in one query, in the order requested (?ids=1,2,3)"""
+    patient_ids = parse_ids(ids)
+    patients, missing = in_request_order(
+        db.query(Patient).filter(Patient.id.in_(patient_ids)).all(), patient_ids
+    )
+    return PatientBatchResponse(
+        items=[
+            PatientResponse(
+                id=patient.id,
+                first_name=patient.first_name or "Unknown",
+                last_name=patient.last_name or "Unknown",
+                email=patient.email or "N/A",
+                phone_number=patient.phone_number or "N/A",
+                created_at=patient.created_at.isoformat() if patient.created_at else datetime.utcnow().isoformat(),
+                is_active=patient.is_active if patient.is_active is not None else True
+            )
+            for patient in patients
+        ],
+        missing=missing
+    )
+
+def patient_summary(patient):
+    return {
+        "id": patient.id,
+        "first_name": patient.first_name,
+        "last_name": patient.last_name,
+        "email": patient.email,
+        "phone_number": patient.phone_number,
+        "created_at": patient.created_at.isoformat() if patient.created_at else None,
+        "is_active": patient.is_active,
+    }
+
+@router.get("/duplicates")
+def list_duplicates(
+    status: str = Query("open", pattern="^(open|merged|dismissed)$"),
+    min_score: float = Query(0.0, ge=0, le=1),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_read_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Likely duplicate records, highest score first"""
+    first, second = aliased(Patient), aliased(Patient)
+    rows = (
+        db.query(DuplicateCandidate, first, second)
+        .join(first, first.id == DuplicateCandidate.patient_id)
+        .join(second, second.id == DuplicateCandidate.duplicate_id)
+        .filter(DuplicateCandidate.status == status, DuplicateCandidate.score >= min_score)
+        .order_by(DuplicateCandidate.score.desc(), DuplicateCandidate.id)
+        .limit(limit)
+        .all()
+    )
+    return [
+        {
+            "id": candidate.id,
+            "score": candidate.score,
+            "reasons": candidate.reasons,
+            "status": candidate.status,
+            "patient": patient_summary(patient),
+            "duplicate": patient_summary(duplicate),
+        }
+        for candidate, patient, duplicate in rows
+    ]
+
+def open_candidate(db: Session, candidate_id: int) -> DuplicateCandidate:
+    candidate = db.query(DuplicateCandidate).filter(DuplicateCandidate.id == candidate_id).with_for_update().first()
+    if not candidate:
+        raise HTTPException(status_code=404, detail="Duplicate candidate not found")
+    if candidate.status != "open":
+        raise HTTPException(status_code=409, detail=f"Duplicate candidate is already {candidate.status}")
+    return candidate
+
+@router.post("/duplicates/{candidate_id}/merge")
+def merge_duplicate(
+    candidate_id: int,
+    keep: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Merge a duplicate pair into ``keep`` (by default the older record)"""
+    candidate = open_candidate(db, candidate_id)
+    keep_id = candidate.patient_id if keep is None else keep
+    if keep_id not in (candidate.patient_id, candidate.duplicate_id):
+        raise HTTPException(status_code=400, detail="keep must be one of the pair's patient ids")
+    result = merge_patients(db, candidate, keep_id)
+    db.commit()
+    merged = db.get(Patient, result["merged"])
+    broadcaster.publish("patient.status", patient_id=merged.id, is_active=False, updated_at=merged.updated_at.isoformat())
+    return result
+
+@router.post("/duplicates/{candidate_id}/dismiss")
+def dismiss_duplicate(
+    candidate_id: int,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Mark a pair as distinct people; it is not proposed again"""
+    candidate = open_candidate(db, candidate_id)
+    candidate.status = "dismissed"
+    candidate.resolved_at = datetime.utcnow()
+    db.commit()
+    return {"id": candidate.id, "status": candidate.status}
+
+@router.post("/duplicates/rebuild")
+def rebuild_duplicates(db: Session = Depends(get_db), current_user: dict = Depends(require_admin)):
+    """Recompute the blocking index and score every block, e.g. after changing weights"""
+    result = rebuild_index(db)
+    db.commit()
+    return result
+
 @router.patch("/{patient_id}/status", response_model=PatientResponse, status_code=status.HTTP_200_OK)
 def update_patient_status(patient_id: int, db: Session = Depends(get_db)):
     """Toggle the active status of a patient"""
@@ -76,6 +204,9 @@ def update_patient_status(patient_id: int, db: Session = Depends(get_db)):
         patient.is_active = not patient.is_active
         db.commit()
         db.refresh(patient)
+        broadcaster.publish(
+            "patient.status", patient_id=patient.id, is_active=patient.is_active, updated_at=patient.updated_at.isoformat()
+        )
         return PatientResponse(
             id=patient.id,
             first_name=patient.first_name or "Unknown",
@@ -91,4 +222,123 @@ def update_patient_status(patient_id: int, db: Session = Depends(get_db)):
     except Exception as e:
         db.rollback()
         print(f"Error updating patient status: {str(e)}")  # Log to console
-        raise HTTPException(status_code=500, detail=f"Failed to update patient status: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to update patient status: {str(e)}")
+
+def timeline_query(patient_id: int):
+    """UNION ALL of everything on a patient's chart as uniform timeline rows.
+
+    Each branch is an indexed lookup on patient_id with the doctor name
+    joined in, so the whole chart, archived rows included, is one statement.
+    """
+    def row(kind, id_, occurred_at, title, detail, status, rating, doctor_id, doctor_name):
+        return (
+            literal(kind, String).label("kind"),
+            id_.label("id"),
+            occurred_at.label("occurred_at"),
+            title.label("title"),
+            detail.label("detail"),
+            status.label("status"),
+            rating.label("rating"),
+            doctor_id.label("doctor_id"),
+            doctor_name.label("doctor_name"),
+        )
+
+    no_text = cast(null(), String)
+    no_int = cast(null(), Integer)
+    # Archived appointments, feedback and reminders are still part of the chart
+    appointment = with_archive(Appointment)
+    reminder = with_archive(MedicationReminder)
+    entry = with_archive(Feedback)
+
+    appointments = (
+        select(*row(
+            "appointment", appointment.id,
+            # Free-text date and time; a malformed pair falls back to creation time
+            func.coalesce(sql_datetime(appointment.date, appointment.time), appointment.created_at),
+            func.coalesce(appointment.category, "Appointment"), appointment.description,
+            appointment.status, no_int, appointment.doctor_id, Doctor.name,
+        ))
+        .select_from(appointment)
+        .outerjoin(Doctor, Doctor.id == appointment.doctor_id)
+        .where(appointment.patient_id == patient_id)
+    )
+    medications = (
+        select(*row(
+            "medication", Medication.id,
+            func.coalesce(cast(Medication.start_date, DateTime), Medication.created_at),
+            Medication.medication, Medication.dosage + " - " + Medication.frequency,
+            no_text, no_int, Medication.doctor_id, Doctor.name,
+        ))
+        .select_from(Medication)
+        .outerjoin(Doctor, Doctor.id == Medication.doctor_id)
+        .where(Medication.patient_id == patient_id)
+    )
+    reminders = (
+        select(*row(
+            "reminder", reminder.id, reminder.created_at,
+            reminder.medication, reminder.time + " " + reminder.frequency,
+            case((reminder.is_active == True, "active"), else_="inactive"),
+            no_int, no_int, no_text,
+        ))
+        .where(reminder.patient_id == patient_id)
+    )
+    feedback = (
+        select(*row(
+            "feedback", entry.id, entry.created_at,
+            FeedbackCategory.name, entry.comment,
+            no_text, entry.rating, entry.doctor_id, Doctor.name,
+        ))
+        .select_from(entry)
+        .outerjoin(Doctor, Doctor.id == entry.doctor_id)
+        .outerjoin(FeedbackCategory, FeedbackCategory.id == entry.category_id)
+        .where(entry.patient_id == patient_id)
+    )
+    return union_all(appointments, medications, reminders, feedback).subquery("timeline")
+
+def encode_cursor(entry):
+    return f"{entry.occurred_at.isoformat()}|{entry.kind}|{entry.id}"
+
+def decode_cursor(cursor: str):
+    try:
+        occurred_at, kind, id_ = cursor.split("|")
+        return datetime.fromisoformat(occurred_at), kind, int(id_)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/{patient_id}/timeline", response_model=TimelinePage)
+def get_patient_timeline(
+    patient_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    order: str = "desc",
+    db: Session = Depends(get_read_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Return a patient's appointments, prescriptions, reminders and feedback
+    as one chronologically ordered page.
+
+    Pass ``next_cursor`` back as ``cursor`` for the next page. The chart
+    costs two queries (patient check plus one UNION ALL) instead of four
+    separate calls with per-row name lookups.
+    """
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    if not db.query(Patient.id).filter(Patient.id == patient_id).first():
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    timeline = timeline_query(patient_id)
+    key = tuple_(timeline.c.occurred_at, timeline.c.kind, timeline.c.id)
+    # Rows with no usable timestamp cannot be placed or paged past
+    query = select(timeline).where(timeline.c.occurred_at.isnot(None))
+    if cursor:
+        position = tuple_(*decode_cursor(cursor))
+        query = query.where(key < position if order == "desc" else key > position)
+    columns = (timeline.c.occurred_at, timeline.c.kind, timeline.c.id)
+    query = query.order_by(*(c.desc() if order == "desc" else c.asc() for c in columns)).limit(limit + 1)
+
+    rows = db.execute(query).all()
+    items = [TimelineEntry(**row._mapping) for row in rows[:limit]]
+    return TimelinePage(
+        items=items,
+        next_cursor=encode_cursor(items[-1]) if len(rows) > limit else None
+    )
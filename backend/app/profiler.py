@@ -0,0 +1,441 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+from collections import Counter
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+import secrets
+import sys
+import threading
+import time
+from app.auth import require_admin
+
+router = APIRouter(prefix="/admin/profile", tags=["Profiling"], dependencies=[Depends(require_admin)])
+
+# Sampling period of on-demand and tagged-request profiles
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+# A single request lasts milliseconds, so it is sampled more finely
+PROFILE_REQUEST_INTERVAL_MS = 1
+PROFILE_MAX_SECONDS = 120
+# Period of the always-on sampler; 0 disables it. At 50 ms it costs well
+# under 1% of a core (see "overheadPercent" in its summary).
+PROFILE_CONTINUOUS_INTERVAL_MS = float(os.environ.get("PROFILE_CONTINUOUS_INTERVAL_MS", "0"))
+# Tags handed out for single-request profiles: how long they stay valid,
+# and how many (pending or finished) are kept
+PROFILE_TAG_TTL_SECONDS = 600
+MAX_PROFILE_TAGS = 50
+PROFILE_TAG_HEADER = "x-profile-tag"
+SQL_FUNCTIONS = {"do_execute", "do_executemany", "do_execute_no_params"}
+SQL_LABEL_LENGTH = 80
+TOP_ENTRIES = 20
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+route_labels = {}  # endpoint code object -> "GET /path"
+tagged_frames = {}  # frame of a tagged request's endpoint -> tag
+traced_endpoints = set()
+current_tag = contextvars.ContextVar("profile_tag", default=None)
+_labels = {}
+
+def frame_label(code) -> str:
+    """"function (file:line)", with paths relative to the backend or site-packages"""
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        if path.startswith(PROJECT_ROOT):
+            path = os.path.relpath(path, PROJECT_ROOT)
+        elif "site-packages" in path:
+            path = path.split("site-packages" + os.sep, 1)[1]
+        else:
+            path = os.path.basename(path)
+        label = _labels[code] = f"{code.co_name} ({path}:{code.co_firstlineno})"
+    return label
+
+def sql_text(statement) -> str:
+    return " ".join(str(statement).split())[:SQL_LABEL_LENGTH]
+
+class Profile:
+    """Aggregated stack samples: per stack, per route and per SQL statement"""
+
+    def __init__(self, interval_ms: float):
+        self.interval_ms = interval_ms
+        self.stacks = Counter()
+        self.routes = Counter()
+        self.route_sql = Counter()
+        self.statements = Counter()
+        self.functions = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, stack, route, statement):
+        with self.lock:
+            self.samples += 1
+            self.stacks[stack] += 1
+            self.routes[route] += 1
+            if statement is not None:
+                self.route_sql[route] += 1
+                self.statements[statement] += 1
+                self.functions[stack[-2]] += 1
+            else:
+                self.functions[stack[-1]] += 1
+
+    def collapsed(self) -> str:
+        """One "root;caller;callee count" line per distinct stack, for flamegraph.pl/speedscope"""
+        with self.lock:
+            return "".join(
+                ";".join(frame.replace(";", ",") for frame in stack) + f" {count}\n"
+                for stack, count in self.stacks.most_common()
+            )
+
+    def flamegraph(self) -> dict:
+        """The stacks as a {"name", "value", "children"} tree, as d3-flame-graph reads"""
+        root = {"name": "all", "value": 0, "children": {}}
+        with self.lock:
+            for stack, count in self.stacks.items():
+                root["value"] += count
+                node = root
+                for frame in stack:
+                    node = node["children"].setdefault(frame, {"name": frame, "value": 0, "children": {}})
+                    node["value"] += count
+
+        def listed(node):
+            return {**node, "children": [listed(child) for child in node["children"].values()]}
+        return listed(root)
+
+    def summary(self) -> dict:
+        with self.lock:
+            total = max(self.samples, 1)
+            return {
+                "startedAt": self.started_at,
+                "seconds": round(self.wall_seconds, 3),
+                "intervalMs": self.interval_ms,
+                "samples": self.samples,
+                # CPU the sampler thread itself used, as a share of the wall time
+                "overheadPercent": round(100 * self.cpu_seconds / self.wall_seconds, 3) if self.wall_seconds else 0.0,
+                "routes": [
+                    {
+                        "route": route,
+                        "samples": count,
+                        "share": round(count / total, 4),
+                        "sqlShare": round(self.route_sql[route] / count, 4),
+                    }
+                    for route, count in self.routes.most_common(TOP_ENTRIES)
+                ],
+                "sql": [
+                    {"statement": statement, "samples": count, "share": round(count / total, 4)}
+                    for statement, count in self.statements.most_common(TOP_ENTRIES)
+                ],
+                "functions": [
+                    {"frame": frame, "samples": count, "share": round(count / total, 4)}
+                    for frame, count in self.functions.most_common(TOP_ENTRIES)
+                ],
+            }
+
+def sample(profile: Profile, keep, skip_ident):
+    """Add one sample of every thread ``keep(route, tag)`` accepts"""
+    for ident, frame in sys._current_frames().items():
+        if ident == skip_ident:
+            continue
+        codes, route, route_depth, statement, tag, ours = [], None, None, None, None, False
+        while frame is not None:
+            code = frame.f_code
+            codes.append(code)
+            if route is None and code in route_labels:
+                route, route_depth = route_labels[code], len(codes)
+            if statement is None and code.co_name in SQL_FUNCTIONS and "sqlalchemy" in code.co_filename:
+                statement = frame.f_locals.get("statement")
+            if tag is None and tagged_frames:
+                tag = tagged_frames.get(frame)
+            ours = ours or code.co_filename.startswith(PROJECT_ROOT)
+            frame = frame.f_back
+        if not ours or not keep(route, tag):
+            continue
+        # Request stacks start at the endpoint; framework frames below it are noise
+        if route is not None:
+            codes = codes[:route_depth]
+            root = route
+        else:
+            root = "[other threads]"
+        stack = (root, *(frame_label(code) for code in reversed(codes)))
+        if statement is not None:
+            statement = sql_text(statement)
+            stack += ("[sql] " + statement,)
+        profile.add(stack, root, statement)
+
+class Sampler(threading.Thread):
+    """Background thread sampling every interval until stopped"""
+
+    def __init__(self, profile: Profile, keep):
+        super().__init__(daemon=True, name="profiler")
+        self.profile = profile
+        self.keep = keep
+        self.stopping = threading.Event()
+
+    def run(self):
+        interval = self.profile.interval_ms / 1000
+        started, cpu_started = time.monotonic(), time.thread_time()
+        while not self.stopping.wait(interval):
+            sample(self.profile, self.keep, threading.get_ident())
+            self.profile.wall_seconds = time.monotonic() - started
+            self.profile.cpu_seconds = time.thread_time() - cpu_started
+        self.profile.wall_seconds = time.monotonic() - started
+        self.profile.cpu_seconds = time.thread_time() - cpu_started
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+def request_threads(route, tag):
+    return route is not None
+
+def any_thread(route, tag):
+    return True
+
+class Profiler:
+    """On-demand, per-request and always-on profiles of this worker"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = None
+        self.continuous = None
+        self.tags = {}
+
+    def start(self, interval_ms: float, all_threads: bool) -> Sampler:
+        with self.lock:
+            if self.running is not None:
+                raise RuntimeError("A profile is already being recorded")
+            self.running = Sampler(Profile(interval_ms), any_thread if all_threads else request_threads)
+        self.running.start()
+        return self.running
+
+    def finish(self, sampler: Sampler) -> Profile:
+        sampler.stop()
+        with self.lock:
+            self.running = None
+        return sampler.profile
+
+    def start_continuous(self, interval_ms: float = PROFILE_CONTINUOUS_INTERVAL_MS):
+        if interval_ms > 0 and self.continuous is None:
+            self.continuous = Sampler(Profile(interval_ms), request_threads)
+            self.continuous.start()
+
+    def stop_continuous(self):
+        if self.continuous is not None:
+            self.continuous.stop()
+            self.continuous = None
+
+    def reset_continuous(self) -> Profile:
+        """The always-on profile so far; sampling continues into a fresh one"""
+        previous = self.continuous.profile
+        self.stop_continuous()
+        self.start_continuous(previous.interval_ms)
+        return previous
+
+    def create_tag(self, interval_ms: float = PROFILE_REQUEST_INTERVAL_MS) -> str:
+        now = time.time()
+        with self.lock:
+            for tag, entry in list(self.tags.items()):
+                if entry["status"] != "running" and now - entry["createdAt"] > PROFILE_TAG_TTL_SECONDS:
+                    del self.tags[tag]
+            # A running tag's request still has to stop its sampler
+            idle = [tag for tag, entry in self.tags.items() if entry["status"] != "running"]
+            for tag in idle[:max(len(self.tags) - MAX_PROFILE_TAGS + 1, 0)]:
+                del self.tags[tag]
+            tag = secrets.token_urlsafe(12)
+            self.tags[tag] = {"status": "pending", "createdAt": now, "intervalMs": interval_ms, "sampler": None}
+        return tag
+
+    def begin_tagged(self, tag):
+        """Start profiling the request carrying ``tag``; False if the tag is unknown or used"""
+        with self.lock:
+            entry = self.tags.get(tag)
+            if entry is None or entry["status"] != "pending":
+                return False
+            entry["status"] = "running"
+            entry["sampler"] = Sampler(Profile(entry["intervalMs"]), lambda route, sampled: sampled == tag)
+        entry["sampler"].start()
+        return True
+
+    def end_tagged(self, tag, method, path, status):
+        """Stop the tag's sampler; blocks while the thread joins, so run it off the event loop"""
+        with self.lock:
+            entry = self.tags.get(tag)
+        if entry is None:
+            return
+        entry["sampler"].stop()
+        entry.update(status="finished", request=f"{method} {path}", statusCode=status)
+
+    def tagged(self, tag):
+        return self.tags.get(tag)
+
+profiler = Profiler()
+
+def traced(call):
+    """Endpoint wrapper that marks its frame when the request carries a profile tag"""
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def endpoint(*args, **kwargs):
+            tag = current_tag.get()
+            if tag is None:
+                return await call(*args, **kwargs)
+            frame = sys._getframe()
+            tagged_frames[frame] = tag
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                tagged_frames.pop(frame, None)
+    else:
+        @functools.wraps(call)
+        def endpoint(*args, **kwargs):
+            tag = current_tag.get()
+            if tag is None:
+                return call(*args, **kwargs)
+            frame = sys._getframe()
+            tagged_frames[frame] = tag
+            try:
+                return call(*args, **kwargs)
+            finally:
+                tagged_frames.pop(frame, None)
+    traced_endpoints.add(endpoint)
+    return endpoint
+
+def api_routes(app):
+    """(full path, methods, dependant) of every API route, as requests reach it.
+
+    Newer FastAPI versions keep included routers nested and call a copy of
+    each route's dependant built for the inclusion, not the route's own.
+    """
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            yield route.path, route.methods, route.dependant
+        for context in getattr(route, "effective_route_contexts", tuple)():
+            if isinstance(context.original_route, APIRoute):
+                yield context.path, context.methods, context.dependant or context.original_route.dependant
+
+def instrument_routes(app):
+    """Map endpoint code to route labels and wrap endpoints for tagged profiles.
+
+    Call once, after every router is included. Code objects shared by
+    several routes (decorator wrappers) are left out of the map, so a
+    sample is attributed to the route's own function.
+    """
+    owners = {}
+    for path, methods, dependant in api_routes(app):
+        label = f"{'|'.join(sorted(methods))} {path}"
+        function = dependant.call
+        while True:
+            if function not in traced_endpoints:
+                owners.setdefault(function.__code__, set()).add(label)
+            if not hasattr(function, "__wrapped__"):
+                break
+            function = function.__wrapped__
+        if dependant.call not in traced_endpoints:
+            dependant.call = traced(dependant.call)
+    route_labels.clear()
+    route_labels.update({code: labels.pop() for code, labels in owners.items() if len(labels) == 1})
+
+class ProfilerMiddleware:
+    """Profile the one request carrying a tag from POST /admin/profile/requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        tag = None
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == PROFILE_TAG_HEADER.encode():
+                    tag = value.decode("latin-1")
+        if tag is None or not profiler.begin_tagged(tag):
+            await self.app(scope, receive, send)
+            return
+
+        status = None
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = current_tag.set(tag)
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            current_tag.reset(token)
+            await asyncio.to_thread(profiler.end_tagged, tag, scope["method"], scope["path"], status)
+
+def render(profile: Profile, output: str):
+    if output == "collapsed":
+        return PlainTextResponse(profile.collapsed())
+    if output == "flamegraph":
+        return profile.flamegraph()
+    return profile.summary()
+
+OUTPUT_PATTERN = "^(summary|collapsed|flamegraph)$"
+
+@router.post("")
+async def record_profile(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(PROFILE_INTERVAL_MS, ge=1, le=1000),
+    all_threads: bool = False,
+    output: str = Query("summary", alias="format", pattern=OUTPUT_PATTERN),
+):
+    """Sample this worker's request threads for ``seconds`` and return the profile.
+
+    Time is attributed to the route whose endpoint is running and, within
+    it, to SQL statements being executed. ``all_threads`` also keeps
+    background threads running project code. ``format=collapsed`` returns
+    folded stacks and ``format=flamegraph`` a d3-flame-graph tree.
+    """
+    try:
+        sampler = profiler.start(interval_ms, all_threads)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile = await asyncio.to_thread(profiler.finish, sampler)
+    return render(profile, output)
+
+@router.post("/requests", status_code=201)
+def create_request_profile(interval_ms: float = Query(PROFILE_REQUEST_INTERVAL_MS, ge=0.5, le=1000)):
+    """Hand out a one-time tag; the next request sending it as X-Profile-Tag is profiled"""
+    return {
+        "tag": profiler.create_tag(interval_ms),
+        "header": "X-Profile-Tag",
+        "expiresInSeconds": PROFILE_TAG_TTL_SECONDS,
+    }
+
+@router.get("/requests/{tag}")
+def get_request_profile(tag: str, output: str = Query("summary", alias="format", pattern=OUTPUT_PATTERN)):
+    """The profile of the request that carried ``tag``, once it has finished"""
+    entry = profiler.tagged(tag)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired profile tag")
+    if entry["status"] != "finished":
+        return {"status": entry["status"]}
+    if output != "summary":
+        return render(entry["sampler"].profile, output)
+    return {
+        "status": "finished",
+        "request": entry["request"],
+        "statusCode": entry["statusCode"],
+        **entry["sampler"].profile.summary(),
+    }
+
+@router.get("/continuous")
+def get_continuous_profile(
+    output: str = Query("summary", alias="format", pattern=OUTPUT_PATTERN),
+    reset: bool = False,
+):
+    """The always-on profile (PROFILE_CONTINUOUS_INTERVAL_MS) since start or the last reset"""
+    if profiler.continuous is None:
+        raise HTTPException(status_code=404, detail="Continuous profiling is disabled")
+    profile = profiler.reset_continuous() if reset else profiler.continuous.profile
+    return render(profile, output)
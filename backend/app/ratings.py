@@ -0,0 +1,214 @@
+from sqlalchemy import func, select, insert, update, case, literal, text, DateTime
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from datetime import datetime
+import os
+from db.database import SessionLocal
+from db.models import Doctor, Feedback, DoctorRatingStat, Specialty
+from app.archive import with_archive
+from app.jobs import job
+from app.lookups import find
+
+# Every doctor starts as if they had PRIOR_WEIGHT ratings of PRIOR_MEAN, so a
+# single 5-star review cannot outrank hundreds of 4.8s.
+PRIOR_MEAN = float(os.environ.get("RATING_PRIOR_MEAN", "3.0"))
+PRIOR_WEIGHT = float(os.environ.get("RATING_PRIOR_WEIGHT", "10"))
+# A rating counts half as much in the "recent" score after this many days
+HALF_LIFE_SECONDS = float(os.environ.get("RATING_HALF_LIFE_DAYS", "90")) * 86400
+# Ratings at or above this count as positive for the Wilson bound
+POSITIVE_RATING = 4
+WILSON_Z = 1.96  # 95% confidence
+RANKING_SORTS = ("bayesian", "wilson", "recent")
+
+def decay_weight(age_seconds: float) -> float:
+    return 0.5 ** (max(age_seconds, 0.0) / HALF_LIFE_SECONDS)
+
+def sql_decay_weight(later, earlier):
+    """SQL version of decay_weight for a value recorded at ``earlier``, seen at ``later``"""
+    return func.power(0.5, func.extract("epoch", later - earlier) / HALF_LIFE_SECONDS)
+
+def score_values():
+    """Column values derived from the running sums, for an UPDATE"""
+    stat = DoctorRatingStat
+    n = func.nullif(stat.ratings, 0)
+    p = stat.positive * 1.0 / n
+    z2 = WILSON_Z ** 2
+    return {
+        "bayesian": (PRIOR_MEAN * PRIOR_WEIGHT + stat.rating_sum) / (PRIOR_WEIGHT + stat.ratings),
+        # Lower bound of the Wilson interval for the share of positive ratings
+        "wilson": func.coalesce(
+            (p + z2 / (2 * n) - WILSON_Z * func.sqrt((p * (1 - p) + z2 / (4 * n)) / n)) / (1 + z2 / n),
+            0.0,
+        ),
+        "recent": (PRIOR_MEAN * PRIOR_WEIGHT + stat.decayed_sum) / (PRIOR_WEIGHT + stat.decayed_weight),
+        "specialty_id": select(Doctor.specialty_id).where(Doctor.id == stat.doctor_id).scalar_subquery(),
+        "updated_at": datetime.utcnow(),
+    }
+
+def update_scores(db: Session, doctor_ids=None):
+    statement = update(DoctorRatingStat).values(**score_values())
+    if doctor_ids is not None:
+        statement = statement.where(DoctorRatingStat.doctor_id.in_(doctor_ids))
+    db.execute(statement.execution_options(synchronize_session=False))
+
+def record_ratings(db: Session, ratings):
+    """Fold new (doctor_id, rating, created_at) tuples into the running sums.
+
+    Call inside the transaction that inserts the feedback, so the stats and
+    the feedback commit or roll back together. Ratings are pre-aggregated
+    per doctor, then written with one upsert and one score update.
+    """
+    by_doctor = {}
+    for doctor_id, rating, created_at in ratings:
+        if doctor_id is not None and rating is not None:
+            by_doctor.setdefault(doctor_id, []).append((rating, created_at or datetime.utcnow()))
+    if not by_doctor:
+        return
+
+    rows = []
+    for doctor_id in sorted(by_doctor):  # Stable lock order across writers
+        values = by_doctor[doctor_id]
+        latest = max(created_at for _, created_at in values)
+        weights = [decay_weight((latest - created_at).total_seconds()) for _, created_at in values]
+        rows.append({
+            "doctor_id": doctor_id,
+            "ratings": len(values),
+            "rating_sum": sum(rating for rating, _ in values),
+            "positive": sum(1 for rating, _ in values if rating >= POSITIVE_RATING),
+            "decayed_sum": sum(weight * rating for weight, (rating, _) in zip(weights, values)),
+            "decayed_weight": sum(weights),
+            "decayed_at": latest,
+        })
+
+    stat = DoctorRatingStat
+    statement = pg_insert(stat)
+    new = statement.excluded
+    later = func.greatest(stat.decayed_at, new.decayed_at)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[stat.doctor_id],
+            set_={
+                "ratings": stat.ratings + new.ratings,
+                "rating_sum": stat.rating_sum + new.rating_sum,
+                "positive": stat.positive + new.positive,
+                # Both sides are re-based to the later of the two timestamps
+                "decayed_sum": stat.decayed_sum * sql_decay_weight(later, stat.decayed_at)
+                    + new.decayed_sum * sql_decay_weight(later, new.decayed_at),
+                "decayed_weight": stat.decayed_weight * sql_decay_weight(later, stat.decayed_at)
+                    + new.decayed_weight * sql_decay_weight(later, new.decayed_at),
+                "decayed_at": later,
+            },
+        ),
+        rows,
+    )
+    update_scores(db, list(by_doctor))
+
+def refresh_decay(db: Session):
+    """Age every doctor's recent score to now.
+
+    Scores only move when a doctor gets new feedback; run this periodically
+    (e.g. daily) so doctors without recent feedback drift toward the prior.
+    """
+    now = literal(datetime.utcnow(), DateTime)
+    weight = sql_decay_weight(now, DoctorRatingStat.decayed_at)
+    db.execute(
+        update(DoctorRatingStat)
+        .values(
+            decayed_sum=DoctorRatingStat.decayed_sum * weight,
+            decayed_weight=DoctorRatingStat.decayed_weight * weight,
+            decayed_at=now,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    update_scores(db)
+
+def rebuild_rating_stats(db: Session):
+    """Recompute every doctor's stats from all feedback, archived included, in one pass.
+
+    The stats table is locked against record_ratings for the rest of the
+    transaction first: a writer that already upserted has committed its
+    feedback before the rebuild reads it, and one that has not waits and
+    adds its ratings on top of the rebuilt sums.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text(f"LOCK TABLE {DoctorRatingStat.__tablename__} IN SHARE ROW EXCLUSIVE MODE"))
+    feedback = with_archive(Feedback)
+    now = literal(datetime.utcnow(), DateTime)
+    weight = sql_decay_weight(now, func.coalesce(feedback.created_at, now))
+    ratings = (
+        select(
+            feedback.doctor_id,
+            Doctor.specialty_id,
+            func.count(feedback.id),
+            func.sum(feedback.rating),
+            func.sum(case((feedback.rating >= POSITIVE_RATING, 1), else_=0)),
+            func.sum(feedback.rating * weight),
+            func.sum(weight),
+            now,
+            literal(0.0),
+            literal(0.0),
+            literal(0.0),
+            now,
+        )
+        .join(Doctor, Doctor.id == feedback.doctor_id)
+        .where(feedback.rating.isnot(None))
+        .group_by(feedback.doctor_id, Doctor.specialty_id)
+    )
+    db.query(DoctorRatingStat).delete(synchronize_session=False)
+    db.execute(
+        insert(DoctorRatingStat).from_select(
+            ["doctor_id", "specialty_id", "ratings", "rating_sum", "positive", "decayed_sum", "decayed_weight",
+             "decayed_at", "bayesian", "wilson", "recent", "updated_at"],
+            ratings,
+        )
+    )
+    update_scores(db)
+
+@job("ratings.refresh")
+def refresh_ratings_job(context, payload):
+    """Age recent scores to now, e.g. nightly; {"rebuild": true} recomputes from all feedback"""
+    db = SessionLocal()
+    try:
+        if payload.get("rebuild"):
+            rebuild_rating_stats(db)
+        else:
+            refresh_decay(db)
+        db.commit()
+    finally:
+        db.close()
+    return {"rebuilt": bool(payload.get("rebuild"))}
+
+def ensure_rating_stats(db: Session):
+    """Build the stats on first start against a database that already has feedback"""
+    if db.query(DoctorRatingStat.doctor_id).first() is None and db.query(Feedback.id).first() is not None:
+        rebuild_rating_stats(db)
+        db.commit()
+
+def leaderboard(db: Session, sort="bayesian", specialty=None, limit=10):
+    """Top doctors by a maintained score, read off its index"""
+    score = getattr(DoctorRatingStat, sort)
+    query = (
+        db.query(DoctorRatingStat, Doctor.name, Specialty.name)
+        .join(Doctor, Doctor.id == DoctorRatingStat.doctor_id)
+        .outerjoin(Specialty, Specialty.id == DoctorRatingStat.specialty_id)
+    )
+    if specialty is not None:
+        match = find(db, Specialty, specialty)
+        if match is None:
+            return []
+        query = query.filter(DoctorRatingStat.specialty_id == match.id)
+    rows = query.order_by(score.desc(), DoctorRatingStat.doctor_id).limit(limit).all()
+    return [
+        {
+            "doctorId": stat.doctor_id,
+            "name": name,
+            "specialty": specialty_name,
+            "ratings": stat.ratings,
+            "averageRating": round(stat.rating_sum / stat.ratings, 2) if stat.ratings else 0.0,
+            "score": round(getattr(stat, sort), 3),
+            "bayesian": round(stat.bayesian, 3),
+            "wilson": round(stat.wilson, 3),
+            "recent": round(stat.recent, 3),
+        }
+        for stat, name, specialty_name in rows
+    ]
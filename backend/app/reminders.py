@@ -1,12 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from datetime import datetime
+from sqlalchemy import insert, select, func
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from typing import List
+from typing import List, Optional
 import os
 from db.database import SessionLocal
 from db.models import MedicationReminder, Patient
 from app.schemas import MedicationReminderCreate, MedicationReminderResponse
+from app.writes import raise_for_constraint
+from app.jobs import job, enqueue, job_response
+from app.auth import require_admin
+from app.sms import render, render_batch, measure, cost_report
 from twilio.rest import Client
 
 router = APIRouter()
@@ -18,6 +23,11 @@ twilio_phone_number = os.environ.get("TWILIO_PHONE_NUMBER", "+237678574116")  #
 
 client = Client(twilio_account_sid, twilio_auth_token) if twilio_account_sid != "AC7364a7087d38dc46748517bf9baa2e03" else None
 
+# Reminders rendered and sent per batch in a bulk run
+REMINDER_RUN_BATCH_SIZE = 1000
+# Failures listed individually in a job result; the rest are only counted
+MAX_REPORTED_FAILURES = 100
+
 def get_db():
     db = SessionLocal()
     try:
@@ -25,53 +35,135 @@ def get_db():
     finally:
         db.close()
 
-def send_sms_reminder(to_phone: str, message: str):
-    """Send SMS reminder using Twilio"""
+def send_messages(messages):
+    """(sent, failures) for a list of {"to": ..., "body": ...}"""
+    sent, failed = 0, []
+    for message in messages:
+        try:
+            client.messages.create(body=message["body"], from_=twilio_phone_number, to=message["to"])
+            sent += 1
+        except Exception as e:
+            failed.append({"to": message["to"], "error": str(e)})
+    return sent, failed
+
+@job("sms.send", concurrency=2, max_attempts=1)
+def send_sms_job(context, payload):
+    """Send {"messages": [{"to": ..., "body": ...}]}, reporting progress as it goes.
+
+    Failures are reported per message rather than retried: a retry would
+    resend the messages that did go out. The result includes the segments
+    billed and their cost.
+    """
+    messages = payload.get("messages", [])
+    report = cost_report(measure(message["body"]) for message in messages)
+    if client is None:
+        return {"sent": 0, "failed": [], "skipped": len(messages), "reason": "Twilio client not configured", "report": report}
+    sent, failed = 0, []
+    for index, message in enumerate(messages):
+        try:
+            client.messages.create(body=message["body"], from_=twilio_phone_number, to=message["to"])
+            sent += 1
+        except Exception as e:
+            failed.append({"to": message["to"], "error": str(e)})
+        context.progress((index + 1) / len(messages), f"{index + 1}/{len(messages)} messages")
+    return {"sent": sent, "failed": failed, "skipped": 0, "report": report}
+
+@job("reminders.run", max_attempts=1)
+def reminder_run_job(context, payload):
+    """Render and send every active reminder of patients with a phone number.
+
+    Reminders are read in id-ordered batches and rendered a batch at a time
+    with one precompiled template. {"dry_run": true} renders without sending,
+    to see what a run would cost; the result reports segments and cost either way.
+    """
+    locale = payload.get("locale")
+    dry_run = payload.get("dry_run") or client is None
+    db = SessionLocal()
     try:
-        if client:
-            message = client.messages.create(
-                body=message,
-                from_=twilio_phone_number,
-                to=to_phone
+        active = (
+            select(MedicationReminder.id, MedicationReminder.medication, MedicationReminder.time,
+                   MedicationReminder.frequency, Patient.phone_number)
+            .join(Patient, Patient.id == MedicationReminder.patient_id)
+            .where(MedicationReminder.is_active == True, Patient.phone_number.isnot(None), Patient.phone_number != "")
+        )
+        if payload.get("patient_ids"):
+            active = active.where(MedicationReminder.patient_id.in_(payload["patient_ids"]))
+        total = db.execute(select(func.count()).select_from(active.subquery())).scalar() or 0
+
+        rendered, sent, failures, failed = [], 0, [], 0
+        last_id, done = 0, 0
+        while True:
+            rows = db.execute(
+                active.where(MedicationReminder.id > last_id)
+                .order_by(MedicationReminder.id)
+                .limit(REMINDER_RUN_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            messages = render_batch(
+                "reminder",
+                ({"medication": row.medication, "time": row.time, "frequency": row.frequency} for row in rows),
+                locale,
             )
-            print(f"Message sent with SID: {message.sid}")
-            return True
-        else:
-            print("Twilio client not configured. SMS not sent.")
-            return False
-    except Exception as e:
-        print(f"Failed to send SMS: {str(e)}")
-        return False
+            rendered.extend(messages)
+            if not dry_run:
+                batch_sent, batch_failed = send_messages(
+                    [{"to": row.phone_number, "body": message.body} for row, message in zip(rows, messages)]
+                )
+                sent += batch_sent
+                failed += len(batch_failed)
+                failures.extend(batch_failed[:MAX_REPORTED_FAILURES - len(failures)])
+            done += len(rows)
+            context.progress(done / max(total, 1), f"{done}/{total} reminders")
+    finally:
+        db.close()
+    return {
+        "dryRun": bool(dry_run),
+        "sent": sent,
+        "failedCount": failed,
+        "failed": failures,
+        "report": cost_report(rendered),
+    }
 
 @router.post("/", response_model=MedicationReminderResponse, status_code=status.HTTP_201_CREATED)
 async def create_reminder(
     reminder: MedicationReminderCreate, 
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
-    """Create a new medication reminder"""
+    """Create a new medication reminder.
+
+    The confirmation SMS is queued as a job in the same transaction, so it
+    is sent by the job worker even if this process restarts.
+    """
     try:
-        # Check if patient exists
-        patient = db.query(Patient).filter(Patient.id == reminder.patient_id).first()
-        if not patient:
-            raise HTTPException(status_code=404, detail="Patient not found")
-        
-        # Create reminder
-        new_reminder = MedicationReminder(
-            patient_id=reminder.patient_id,
-            medication=reminder.medication,
-            time=reminder.time,
-            frequency=reminder.frequency
+        # The patient is checked by its foreign key; the phone number for the
+        # SMS comes back from the same statement as the new row.
+        new = (
+            insert(MedicationReminder)
+            .values(
+                patient_id=reminder.patient_id,
+                medication=reminder.medication,
+                time=reminder.time,
+                frequency=reminder.frequency
+            )
+            .returning(*MedicationReminder.__table__.c)
+            .cte("new_reminder")
         )
-        
-        db.add(new_reminder)
-        db.commit()
-        db.refresh(new_reminder)
-        
+        new_reminder = db.execute(
+            select(new, Patient.phone_number)
+            .select_from(new)
+            .join(Patient, Patient.id == new.c.patient_id)
+        ).one()
+
         # Send SMS reminder if phone number exists
-        if patient.phone_number:
-            message = f"Reminder: Take your {reminder.medication} at {reminder.time} ({reminder.frequency}). - Douala General Hospital"
-            background_tasks.add_task(send_sms_reminder, patient.phone_number, message)
+        if new_reminder.phone_number:
+            message = render(
+                "reminder", reminder.locale,
+                medication=reminder.medication, time=reminder.time, frequency=reminder.frequency,
+            )
+            enqueue(db, "sms.send", {"messages": [{"to": new_reminder.phone_number, "body": message.body}]})
+        db.commit()
         
         return MedicationReminderResponse(
             id=new_reminder.id,
@@ -83,14 +175,32 @@ async def create_reminder(
             created_at=new_reminder.created_at.isoformat()
         )
         
-    except IntegrityError:
+    except IntegrityError as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail="Database error during reminder creation")
+        raise_for_constraint(e, {
+            "medication_reminders_patient_id_fkey": (404, "Patient not found"),
+        }, "Database error during reminder creation")
     except Exception as e:
         db.rollback()
         print(f"Error creating reminder: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create reminder: {str(e)}")
 
+@router.post("/run", status_code=status.HTTP_202_ACCEPTED)
+def run_reminders(
+    locale: Optional[str] = Query(None, pattern="^(en|fr)$"),
+    dry_run: bool = False,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Queue a job sending every active reminder as an SMS.
+
+    Poll GET /jobs/{id} for progress; its result reports the messages sent
+    and the segments and cost of the run. ``dry_run`` only renders them.
+    """
+    queued = enqueue(db, "reminders.run", {"locale": locale, "dry_run": dry_run})
+    db.commit()
+    return job_response(queued)
+
 @router.get("/", response_model=List[MedicationReminderResponse])
 async def get_patient_reminders(patient_id: int, db: Session = Depends(get_db)):
     """Get all reminders for a patient"""
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
+from datetime import datetime
 
 class DoctorBase(BaseModel):
     name: str
@@ -9,6 +10,8 @@ class DoctorResponse(DoctorBase):
     id: int
     specialty: str
     email: str
+    patientCount: int = 0
+    averageRating: float = 0.0
     class Config:
         from_attributes = True
 
@@ -32,6 +35,10 @@ class PatientResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class PatientBatchResponse(BaseModel):
+    items: List[PatientResponse]
+    missing: List[int]
+
 class FeedbackCategoryResponse(BaseModel):
     id: int
     name: str
@@ -61,6 +68,7 @@ class MedicationReminderBase(BaseModel):
 
 class MedicationReminderCreate(MedicationReminderBase):
     patient_id: int
+    locale: Optional[str] = None  # SMS language, en or fr; SMS_DEFAULT_LOCALE if unset
 
 class MedicationReminderResponse(MedicationReminderBase):
     id: int
@@ -68,4 +76,19 @@ class MedicationReminderResponse(MedicationReminderBase):
     is_active: bool
     created_at: str
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class TimelineEntry(BaseModel):
+    kind: str  # appointment, medication, reminder or feedback
+    id: int
+    occurred_at: datetime
+    title: Optional[str] = None
+    detail: Optional[str] = None
+    status: Optional[str] = None
+    rating: Optional[int] = None
+    doctor_id: Optional[int] = None
+    doctor_name: Optional[str] = None
+
+class TimelinePage(BaseModel):
+    items: List[TimelineEntry]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,158 @@
+import asyncio
+import functools
+import os
+import threading
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+# Callers joining an in-flight computation give up after this many seconds
+SINGLEFLIGHT_TIMEOUT_SECONDS = float(os.environ.get("SINGLEFLIGHT_TIMEOUT_SECONDS", "30"))
+# Handler arguments of these types make up the coalescing key; anything else
+# (request, response, current user) is ignored
+KEY_TYPES = (str, int, float, bool, type(None))
+
+class Call:
+    """One in-flight synchronous computation and its outcome"""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Run at most one computation per key at a time; concurrent callers share its outcome.
+
+    A caller arriving while a computation for its key is running waits for
+    that one instead of starting its own, and gets the same result, or the
+    same exception. Nothing is cached: once the computation finishes, the
+    next caller starts a fresh one. Synchronous callers (threads) and
+    asynchronous ones (the event loop) are tracked separately.
+    """
+
+    def __init__(self, timeout=SINGLEFLIGHT_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.tasks = {}
+        self.stats = {}
+
+    def count(self, name, counter, amount=1):
+        with self.lock:
+            stats = self.stats.setdefault(
+                name, {"calls": 0, "executions": 0, "coalesced": 0, "errors": 0, "timeouts": 0, "inFlight": 0}
+            )
+            stats[counter] += amount
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run or join the synchronous computation for ``key``; key[0] names it in the stats"""
+        name = key[0]
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+        self.count(name, "calls")
+
+        if not leader:
+            self.count(name, "coalesced")
+            if not call.done.wait(self.timeout):
+                self.count(name, "timeouts")
+                raise TimeoutError(f"{name} did not finish within {self.timeout}s")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self.count(name, "executions")
+        self.count(name, "inFlight")
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            self.count(name, "errors")
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            self.count(name, "inFlight", -1)
+            call.done.set()
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """Run or join the coroutine for ``key``.
+
+        The computation runs as its own task, so a caller that disconnects
+        does not cancel it for the others still waiting.
+        """
+        name = key[0]
+        self.count(name, "calls")
+        task = self.tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self.tasks[key] = task
+            self.count(name, "executions")
+            self.count(name, "inFlight")
+            task.add_done_callback(functools.partial(self.finished, key))
+        else:
+            self.count(name, "coalesced")
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            self.count(name, "timeouts")
+            raise TimeoutError(f"{name} did not finish within {self.timeout}s")
+
+    def finished(self, key, task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+        self.count(key[0], "inFlight", -1)
+        if task.cancelled() or task.exception() is not None:
+            self.count(key[0], "errors")
+
+    def snapshot(self):
+        with self.lock:
+            endpoints = {name: dict(stats) for name, stats in self.stats.items()}
+        return {
+            "timeoutSeconds": self.timeout,
+            "savedExecutions": sum(stats["coalesced"] for stats in endpoints.values()),
+            "endpoints": endpoints,
+        }
+
+flights = SingleFlight()
+
+def call_key(name, kwargs):
+    """(name, params) for a handler call: its plain arguments, plus the database
+    its session is bound to, so replica and primary reads are not merged"""
+    params = []
+    for argument, value in sorted(kwargs.items()):
+        if isinstance(value, KEY_TYPES):
+            params.append((argument, value))
+        elif isinstance(value, Session):
+            params.append((argument, str(value.get_bind().url)))
+    return (name, tuple(params))
+
+def singleflight(name=None, flight: SingleFlight = flights):
+    """Coalesce concurrent identical calls of an endpoint into one execution.
+
+    For handlers whose result depends only on their plain parameters, not
+    on who is asking. Works on sync and async handlers alike. A caller that
+    waits longer than the flight's timeout gets a 504.
+    """
+    def decorate(fn):
+        label = name or fn.__name__
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                try:
+                    return await flight.do_async(call_key(label, kwargs), fn, *args, **kwargs)
+                except TimeoutError as e:
+                    raise HTTPException(status_code=504, detail=str(e))
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                try:
+                    return flight.do(call_key(label, kwargs), fn, *args, **kwargs)
+                except TimeoutError as e:
+                    raise HTTPException(status_code=504, detail=str(e))
+        return wrapper
+    return decorate
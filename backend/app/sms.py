@@ -0,0 +1,236 @@
+from string import Formatter
+import os
+import random
+import sys
+import time
+import unicodedata
+
+# Every SMS is billed per segment. GSM-7 fits 160 characters in one segment
+# (153 per segment once split); a single character outside it switches the
+# whole message to UCS-2, which fits only 70 (67).
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Sent as an escape plus a character, so each costs two septets
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+SEGMENT_LIMITS = {"gsm7": (160, 153), "ucs2": (70, 67)}
+
+# Replacements that keep the meaning: typography and ligatures. Other
+# accented Latin letters lose their accent (see to_gsm7); anything else,
+# e.g. the ɛ/ɔ/ŋ of Cameroonian languages, keeps the message in UCS-2.
+TRANSLITERATIONS = {
+    "‘": "'", "’": "'", "ʼ": "'", "“": '"', "”": '"', "«": '"', "»": '"',
+    "–": "-", "—": "-", "…": "...", "\u00a0": " ", "\u202f": " ",
+    "œ": "oe", "Œ": "OE", "ç": "c",
+}
+
+SMS_SEGMENT_COST = float(os.environ.get("SMS_SEGMENT_COST", "0.05"))
+SMS_COST_CURRENCY = os.environ.get("SMS_COST_CURRENCY", "USD")
+# Messages longer than this are shortened by truncating their :trunc field
+SMS_MAX_SEGMENTS = int(os.environ.get("SMS_MAX_SEGMENTS", "1"))
+# A truncated field keeps at least this many characters, even at the cost of a segment
+MIN_TRUNCATED_LENGTH = 8
+SMS_DEFAULT_LOCALE = os.environ.get("SMS_DEFAULT_LOCALE", "en")
+
+# {field:trunc} marks the one field that may be shortened to save a segment
+TEMPLATES = {
+    "reminder": {
+        "en": "Reminder: Take your {medication:trunc} at {time} ({frequency}). - Douala General Hospital",
+        "fr": "Rappel : prenez votre {medication:trunc} à {time} ({frequency}). - Hôpital Général de Douala",
+    },
+}
+
+_gsm7_cache = {}
+
+def to_gsm7(text: str):
+    """``text`` rewritten in GSM-7 where that is safe, or None if it cannot be"""
+    cached = _gsm7_cache.get(text)
+    if cached is not None or text in _gsm7_cache:
+        return cached
+    out = []
+    for ch in text:
+        if ch in GSM7_BASIC or ch in GSM7_EXTENDED:
+            out.append(ch)
+        elif ch in TRANSLITERATIONS:
+            out.append(TRANSLITERATIONS[ch])
+        else:
+            base = "".join(c for c in unicodedata.normalize("NFKD", ch) if not unicodedata.combining(c))
+            if not base or not all(c in GSM7_BASIC for c in base):
+                out = None
+                break
+            out.append(base)
+    result = "".join(out) if out is not None else None
+    if len(_gsm7_cache) < 100000:  # Field values repeat a lot (drug names, times)
+        _gsm7_cache[text] = result
+    return result
+
+def septets(text: str) -> int:
+    return len(text) + sum(1 for ch in text if ch in GSM7_EXTENDED)
+
+def ucs2_units(text: str) -> int:
+    # Characters outside the BMP take a surrogate pair
+    return len(text) + sum(1 for ch in text if ord(ch) > 0xFFFF)
+
+def segment_count(length: int, encoding: str) -> int:
+    single, multi = SEGMENT_LIMITS[encoding]
+    if length <= single:
+        return 1
+    return -(-length // multi)
+
+def capacity(segments: int, encoding: str) -> int:
+    single, multi = SEGMENT_LIMITS[encoding]
+    return single if segments == 1 else multi * segments
+
+class RenderedMessage:
+    __slots__ = ("body", "encoding", "length", "segments", "transliterated", "truncated")
+
+    def __init__(self, body, encoding, length, transliterated=False, truncated=False):
+        self.body = body
+        self.encoding = encoding
+        self.length = length
+        self.segments = segment_count(length, encoding)
+        self.transliterated = transliterated
+        self.truncated = truncated
+
+def measure(body: str) -> RenderedMessage:
+    """Encoding and segments of a message that is sent as is"""
+    if all(ch in GSM7_BASIC or ch in GSM7_EXTENDED for ch in body):
+        return RenderedMessage(body, "gsm7", septets(body))
+    return RenderedMessage(body, "ucs2", ucs2_units(body))
+
+def cut(text: str, budget: int, size) -> str:
+    """Longest prefix of ``text`` plus "." that fits in ``budget`` units"""
+    while text and size(text) + 1 > budget:
+        text = text[:-1]
+    return text.rstrip() + "."
+
+class CompiledTemplate:
+    """A template parsed once, with its literal text converted and measured up front.
+
+    Rendering then only converts the field values, so batches of thousands
+    of messages do not re-parse or re-measure the fixed text.
+    """
+
+    def __init__(self, text: str):
+        self.parts = []  # (literal, field name or None, truncatable)
+        for literal, field, spec, _ in Formatter().parse(text):
+            self.parts.append((literal, field, spec == "trunc"))
+        literal = "".join(part[0] for part in self.parts)
+        self.literal_gsm = [to_gsm7(part[0]) for part in self.parts]
+        self.gsm_ok = all(part is not None for part in self.literal_gsm)
+        self.literal_septets = septets("".join(self.literal_gsm)) if self.gsm_ok else None
+        self.literal_units = ucs2_units(literal)
+        self.literal_transliterated = self.gsm_ok and "".join(self.literal_gsm) != literal
+
+    def render(self, values: dict, max_segments: int = SMS_MAX_SEGMENTS) -> RenderedMessage:
+        fields = {field: str(values[field]) for _, field, _ in self.parts if field is not None}
+        converted = {name: to_gsm7(value) for name, value in fields.items()} if self.gsm_ok else None
+        if converted is not None and all(value is not None for value in converted.values()):
+            encoding, literals, chosen, size = "gsm7", self.literal_gsm, converted, septets
+            length = self.literal_septets + sum(septets(value) for value in converted.values())
+            transliterated = self.literal_transliterated or converted != fields
+        else:
+            encoding, literals, chosen, size = "ucs2", [part[0] for part in self.parts], fields, ucs2_units
+            length = self.literal_units + sum(ucs2_units(value) for value in fields.values())
+            transliterated = False
+
+        # Shorten to max_segments if the field can keep enough of itself,
+        # otherwise to the fewest segments it can, otherwise leave it
+        truncated = False
+        field = next((field for _, field, truncatable in self.parts if truncatable), None)
+        segments = segment_count(length, encoding)
+        if field is not None and segments > max_segments:
+            rest = length - size(chosen[field])
+            for target in range(max_segments, segments):
+                budget = capacity(target, encoding) - rest
+                if budget > MIN_TRUNCATED_LENGTH:
+                    chosen = {**chosen, field: cut(chosen[field], budget, size)}
+                    length = rest + size(chosen[field])
+                    truncated = True
+                    break
+
+        body = "".join(
+            literal + (chosen[field] if field is not None else "")
+            for literal, (_, field, _) in zip(literals, self.parts)
+        )
+        return RenderedMessage(body, encoding, length, transliterated, truncated)
+
+COMPILED = {
+    (name, locale): CompiledTemplate(text)
+    for name, locales in TEMPLATES.items()
+    for locale, text in locales.items()
+}
+
+def template(name: str, locale=None) -> CompiledTemplate:
+    return COMPILED.get((name, locale or SMS_DEFAULT_LOCALE)) or COMPILED[(name, SMS_DEFAULT_LOCALE)]
+
+def render(name: str, locale=None, **values) -> RenderedMessage:
+    return template(name, locale).render(values)
+
+def render_batch(name: str, rows, locale=None):
+    """Render many messages of one template; ``rows`` are dicts of field values"""
+    compiled = template(name, locale)
+    return [compiled.render(values) for values in rows]
+
+def cost_report(messages) -> dict:
+    """Segments and cost of a set of rendered or measured messages"""
+    report = {"messages": 0, "segments": 0, "gsm7": 0, "ucs2": 0, "multiSegment": 0, "transliterated": 0, "truncated": 0}
+    for message in messages:
+        report["messages"] += 1
+        report["segments"] += message.segments
+        report[message.encoding] += 1
+        report["multiSegment"] += message.segments > 1
+        report["transliterated"] += message.transliterated
+        report["truncated"] += message.truncated
+    report["cost"] = round(report["segments"] * SMS_SEGMENT_COST, 2)
+    report["currency"] = SMS_COST_CURRENCY
+    return report
+
+def synthetic_workload(count: int, seed: int = 7):
+    """Reminder field values resembling real ones: accented and long drug names, both locales"""
+    medications = [
+        "Paracétamol 500mg", "Amoxicilline 1g", "Artéméther/Luméfantrine 20/120mg",
+        "Métformine", "Ibuprofène 400 mg", "Oméprazole", "Hydroxychloroquine sulfate 200mg",
+        "Co-trimoxazole (Sulfaméthoxazole + Triméthoprime) 800/160mg", "Fer + acide folique",
+        "Quinine", "Salbutamol inhaler", "Efavirenz/Lamivudine/Ténofovir 600/300/300mg", "Nifédipine LP 20mg",
+    ]
+    frequencies = ["daily", "twice daily", "every 8 hours", "matin et soir", "après le repas", "bɛ̀ɛ́ fɔ̀"]
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield rng.choice(("en", "fr")), {
+            "medication": rng.choice(medications),
+            "time": f"{rng.randint(6, 22):02d}:{rng.choice(('00', '30'))}",
+            "frequency": rng.choice(frequencies),
+        }
+
+def benchmark(count: int = 100000) -> dict:
+    """Render a synthetic workload; compare against naive f-string messages"""
+    workload = list(synthetic_workload(count))
+    by_locale = {}
+    for locale, values in workload:
+        by_locale.setdefault(locale, []).append(values)
+
+    started = time.perf_counter()
+    rendered = []
+    for locale, rows in by_locale.items():
+        rendered.extend(render_batch("reminder", rows, locale))
+    elapsed = time.perf_counter() - started
+
+    naive = [
+        measure(f"Reminder: Take your {values['medication']} at {values['time']} ({values['frequency']}). - Douala General Hospital")
+        if locale == "en" else
+        measure(f"Rappel : prenez votre {values['medication']} à {values['time']} ({values['frequency']}). - Hôpital Général de Douala")
+        for locale, values in workload
+    ]
+    return {
+        "messages": count,
+        "renderSeconds": round(elapsed, 3),
+        "messagesPerSecond": round(count / elapsed),
+        "optimized": cost_report(rendered),
+        "naive": cost_report(naive),
+    }
+
+if __name__ == "__main__":
+    # python -m app.sms [count]
+    print(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
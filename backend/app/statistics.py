@@ -1,10 +1,17 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from db.database import get_db
-from db.models import Doctor, Patient, Appointment, Feedback
-from typing import List, Dict
+from db.database import get_db, get_read_db
+from db.models import Doctor, Patient, Appointment, Feedback, Specialty
+from typing import List, Dict, Optional
 from pydantic import BaseModel
 from sqlalchemy import func
+from app.events import event_stream
+from app.auth import require_admin
+from app.ratings import RANKING_SORTS, leaderboard, refresh_decay, rebuild_rating_stats
+from app.kpis import PERIOD_DAYS, period_kpis
+from app.forecast import FORECAST_HORIZON_DAYS, stored_forecast
+from app.singleflight import singleflight
 
 router = APIRouter(prefix="/statistics", tags=["Statistics"])
 
@@ -36,97 +43,95 @@ class PatientAdmissionsData(BaseModel):
     emergency: int
     scheduled: int
 
+# Dashboards open all at once at the start of a shift; identical concurrent
+# requests to the aggregate endpoints share one execution (see app/singleflight.py)
 @router.get("/departments", response_model=List[DepartmentStats])
-def get_department_stats(db: Session = Depends(get_db)):
-    """Get department performance statistics"""
-    # Get all doctors grouped by specialty
-    specialties = db.query(Doctor.specialty, func.count(Doctor.id)).group_by(Doctor.specialty).all()
-    
-    # For now, we'll create mock data based on specialties since we don't have a departments table
-    departments = []
-    for specialty, count in specialties:
-        # Get average rating for doctors in this specialty from feedback
-        avg_rating = db.query(func.avg(Feedback.rating)).join(Doctor).filter(Doctor.specialty == specialty).scalar()
-        if avg_rating is None:
-            avg_rating = 0.0
-        else:
-            avg_rating = float(avg_rating)
-        
-        # Get number of patients who had appointments with doctors in this specialty
-        patient_count = db.query(func.count(Appointment.patient_id.distinct())).join(Doctor).filter(Doctor.specialty == specialty).scalar()
-        
-        departments.append({
-            "name": specialty,
-            "avgRating": round(avg_rating, 1),
-            "patients": patient_count,
-            "doctors": count
-        })
-    
-    return departments
+@singleflight("statistics.departments")
+def get_department_stats(db: Session = Depends(get_read_db)):
+    """Get department performance statistics, one department per specialty.
 
-@router.get("/hospital", response_model=List[HospitalStats])
-def get_hospital_stats(db: Session = Depends(get_db)):
-    """Get overall hospital statistics"""
-    # Get total patients
-    total_patients = db.query(func.count(Patient.id)).scalar()
-    
-    # Get total appointments
-    total_appointments = db.query(func.count(Appointment.id)).scalar()
-    
-    # Get average feedback rating
-    avg_rating = db.query(func.avg(Feedback.rating)).scalar()
-    if avg_rating is None:
-        avg_rating = 0.0
-    else:
-        avg_rating = float(avg_rating)
-    
-    stats = [
+    Three grouped queries over integer specialty ids, whatever the number
+    of specialties.
+    """
+    specialties = (
+        db.query(Specialty.id, Specialty.name, func.count(Doctor.id))
+        .join(Doctor, Doctor.specialty_id == Specialty.id)
+        .group_by(Specialty.id, Specialty.name)
+        .order_by(Specialty.name)
+        .all()
+    )
+    ratings = dict(
+        db.query(Doctor.specialty_id, func.avg(Feedback.rating))
+        .join(Doctor, Doctor.id == Feedback.doctor_id)
+        .group_by(Doctor.specialty_id)
+        .all()
+    )
+    patients = dict(
+        db.query(Doctor.specialty_id, func.count(Appointment.patient_id.distinct()))
+        .join(Doctor, Doctor.id == Appointment.doctor_id)
+        .group_by(Doctor.specialty_id)
+        .all()
+    )
+    return [
         {
-            "title": "Total Patients",
-            "value": f"{total_patients:,}",
-            "change": "+0%",
-            "trend": "up",
-            "icon": {
-                "path": "M16 7a4 4 0 11-8 0 4 4 0 018 0zM12 14a7 7 0 00-7 7h14a7 7 0 00-7-7z",
-                "bgColor": "bg-blue-500"
-            }
-        },
-        {
-            "title": "Appointments",
-            "value": f"{total_appointments:,}",
-            "change": "+0%",
-            "trend": "up",
-            "icon": {
-                "path": "M8 7V3m8 4V3m-9 8h10M5 21h14a2 2 0 002-2V7a2 2 0 00-2-2H5a2 2 0 00-2 2v12a2 2 0 002 2z",
-                "bgColor": "bg-green-500"
-            }
-        },
-        {
-            "title": "Average Stay",
-            "value": "3.2 days",
-            "change": "-0.5 days",
-            "trend": "up",
-            "icon": {
-                "path": "M12 8v4l3 3m6-3a9 9 0 11-18 0 9 9 0 0118 0z",
-                "bgColor": "bg-purple-500"
-            }
-        },
-        {
-            "title": "Patient Satisfaction",
-            "value": f"{round(avg_rating * 20, 1)}%",  # Convert 5-point scale to percentage
-            "change": "+0%",
-            "trend": "up",
-            "icon": {
-                "path": "M14.828 14.828a4 4 0 01-5.656 0M9 10h.01M15 10h.01M21 12a9 9 0 11-18 0 9 9 0 0118 0z",
-                "bgColor": "bg-indigo-500"
-            }
+            "name": name,
+            "avgRating": round(float(ratings.get(specialty_id) or 0.0), 1),
+            "patients": patients.get(specialty_id, 0),
+            "doctors": count
         }
+        for specialty_id, name, count in specialties
     ]
-    
+
+def format_change(change: Optional[float]):
+    """Signed percentage and trend in the form the dashboard cards parse"""
+    if change is None:
+        # No snapshot to compare against yet
+        return "n/a", "flat"
+    return f"{change:+.1f}%", "up" if change >= 0 else "down"
+
+@router.get("/hospital", response_model=List[HospitalStats])
+@singleflight("statistics.hospital")
+def get_hospital_stats(
+    period: str = Query("week", pattern=f"^({'|'.join(PERIOD_DAYS)})$"),
+    db: Session = Depends(get_read_db)
+):
+    """Get overall hospital statistics.
+
+    Values are current totals. Changes compare the last complete ``period``
+    (day, week or month) with the one before it, from daily snapshots;
+    they read "n/a" until the first snapshot has been rolled up.
+    """
+    kpis = period_kpis(db, period)
+    totals, changes = kpis["totals"], kpis["changes"]
+
+    cards = [
+        ("Total Patients", f"{totals['patients']:,}", changes["patients"], {
+            "path": "M16 7a4 4 0 11-8 0 4 4 0 018 0zM12 14a7 7 0 00-7 7h14a7 7 0 00-7-7z",
+            "bgColor": "bg-blue-500"
+        }),
+        ("Appointments", f"{totals['appointments']:,}", changes["appointments"], {
+            "path": "M8 7V3m8 4V3m-9 8h10M5 21h14a2 2 0 002-2V7a2 2 0 00-2-2H5a2 2 0 00-2 2v12a2 2 0 002 2z",
+            "bgColor": "bg-green-500"
+        }),
+        ("Feedback Received", f"{totals['feedback']:,}", changes["feedback"], {
+            "path": "M8 10h.01M12 10h.01M16 10h.01M9 16H5a2 2 0 01-2-2V6a2 2 0 012-2h14a2 2 0 012 2v8a2 2 0 01-2 2h-5l-5 5v-5z",
+            "bgColor": "bg-purple-500"
+        }),
+        ("Patient Satisfaction", f"{round(kpis['satisfaction'], 1)}%", changes["satisfaction"], {
+            "path": "M14.828 14.828a4 4 0 01-5.656 0M9 10h.01M15 10h.01M21 12a9 9 0 11-18 0 9 9 0 0118 0z",
+            "bgColor": "bg-indigo-500"
+        }),
+    ]
+
+    stats = []
+    for title, value, change, icon in cards:
+        change, trend = format_change(change)
+        stats.append({"title": title, "value": value, "change": change, "trend": trend, "icon": icon})
     return stats
 
 @router.get("/doctors", response_model=DoctorStats)
-def get_doctor_stats(db: Session = Depends(get_db)):
+@singleflight("statistics.doctors")
+def get_doctor_stats(db: Session = Depends(get_read_db)):
     """Get doctor statistics"""
     # Get total doctors
     total_doctors = db.query(func.count(Doctor.id)).scalar()
@@ -138,23 +143,24 @@ def get_doctor_stats(db: Session = Depends(get_db)):
     else:
         avg_rating = float(avg_rating)
     
-    # Get top performers (doctors with highest average ratings)
-    top_performers_query = db.query(
-        Doctor.name,
-        Doctor.specialty,
-        func.avg(Feedback.rating).label('avg_rating')
-    ).join(Feedback, Feedback.doctor_id == Doctor.id).group_by(Doctor.id).order_by(func.avg(Feedback.rating).desc()).limit(3)
-    
+    # Top performers by confidence-adjusted rating, read from the maintained stats
     top_performers = []
-    for doctor in top_performers_query:
+    for doctor in leaderboard(db, limit=3):
         top_performers.append({
-            "name": doctor.name,
-            "specialty": doctor.specialty,
-            "rating": round(float(doctor.avg_rating), 1)
+            "name": doctor["name"],
+            "specialty": doctor["specialty"],
+            "rating": round(doctor["averageRating"], 1),
+            "score": doctor["score"],
+            "ratings": doctor["ratings"]
         })
     
     # Get specialties count
-    specialties_query = db.query(Doctor.specialty, func.count(Doctor.id)).group_by(Doctor.specialty).all()
+    specialties_query = (
+        db.query(Specialty.name, func.count(Doctor.id))
+        .join(Doctor, Doctor.specialty_id == Specialty.id)
+        .group_by(Specialty.id, Specialty.name)
+        .all()
+    )
     specialties = [{"name": specialty, "count": count} for specialty, count in specialties_query]
     
     return {
@@ -164,8 +170,38 @@ def get_doctor_stats(db: Session = Depends(get_db)):
         "specialties": specialties
     }
 
+@router.get("/doctor-rankings")
+@singleflight("statistics.doctor-rankings")
+def get_doctor_rankings(
+    sort: str = Query("bayesian", pattern=f"^({'|'.join(RANKING_SORTS)})$"),
+    specialty: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    """Doctor leaderboard, hospital-wide or for one specialty.
+
+    ``bayesian`` shrinks each mean toward a prior by the number of ratings,
+    ``wilson`` is the lower confidence bound of the share of 4-5 star
+    ratings, and ``recent`` is the Bayesian mean with older ratings decayed.
+    """
+    return leaderboard(db, sort=sort, specialty=specialty, limit=limit)
+
+@router.post("/doctor-rankings/refresh")
+def refresh_doctor_rankings(
+    rebuild: bool = False,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Age the recent scores to now, or rebuild all stats from the feedback table"""
+    if rebuild:
+        rebuild_rating_stats(db)
+    else:
+        refresh_decay(db)
+    db.commit()
+    return {"status": "ok", "rebuilt": rebuild}
+
 @router.get("/treatment-outcomes", response_model=List[TreatmentOutcomes])
-def get_treatment_outcomes(db: Session = Depends(get_db)):
+def get_treatment_outcomes(db: Session = Depends(get_read_db)):
     """Get treatment outcomes statistics"""
     # For now, we'll create mock data since we don't have treatment outcome tracking
     outcomes = [
@@ -178,7 +214,7 @@ def get_treatment_outcomes(db: Session = Depends(get_db)):
     return outcomes
 
 @router.get("/patient-admissions", response_model=List[PatientAdmissionsData])
-def get_patient_admissions(db: Session = Depends(get_db)):
+def get_patient_admissions(db: Session = Depends(get_read_db)):
     """Get patient admissions data"""
     # For now, we'll create mock data since we don't have monthly admission tracking
     admissions_data = [
@@ -191,4 +227,31 @@ def get_patient_admissions(db: Session = Depends(get_db)):
         {"name": "Jul", "emergency": 138, "scheduled": 204}
     ]
     
-    return admissions_data
\ No newline at end of file
+    return admissions_data
+
+@router.get("/forecast")
+@singleflight("statistics.forecast")
+def get_forecast(
+    days: int = Query(14, ge=1, le=FORECAST_HORIZON_DAYS),
+    specialty: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Expected appointments per specialty and day, with a ~95% band.
+
+    Served from the rows the nightly forecast.refresh job stores; nothing
+    is fitted per request.
+    """
+    return stored_forecast(db, days, specialty)
+
+@router.get("/stream")
+async def stream_statistics():
+    """Server-Sent Events stream of live dashboard counters.
+
+    Sends a snapshot on connect, then a delta event whenever feedback,
+    appointments, registrations or status toggles are committed.
+    """
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
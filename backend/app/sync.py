@@ -0,0 +1,141 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import event, text, tuple_
+from sqlalchemy.orm import Session
+from datetime import datetime, date, timedelta
+from typing import Optional
+import base64
+import json
+from db.database import get_db
+from db.models import Patient, Doctor, Appointment, Medication, MedicationReminder, Feedback, Tombstone
+from app.auth import get_current_user
+
+router = APIRouter(prefix="/sync", tags=["Sync"])
+
+# Collection name -> (model, columns sent to clients). Passwords never leave.
+SYNC_COLLECTIONS = {
+    "patients": (Patient, ("id", "email", "first_name", "last_name", "phone_number", "is_active", "created_at", "updated_at")),
+    "doctors": (Doctor, ("id", "email", "name", "specialty", "is_active", "created_at", "updated_at")),
+    "appointments": (Appointment, ("id", "patient_id", "doctor_id", "date", "time", "category", "description", "status", "version", "created_at", "updated_at")),
+    "medications": (Medication, ("id", "patient_id", "doctor_id", "medication", "dosage", "frequency", "instructions", "start_date", "end_date", "version", "created_at", "updated_at")),
+    "reminders": (MedicationReminder, ("id", "patient_id", "medication", "time", "frequency", "is_active", "created_at", "updated_at")),
+    "feedback": (Feedback, ("id", "patient_id", "doctor_id", "category_id", "rating", "comment", "created_at", "updated_at")),
+}
+COLLECTION_BY_MODEL = {model: name for name, (model, _) in SYNC_COLLECTIONS.items()}
+
+# Rows newer than this are held back for the next sync, and the same margin
+# is taken off the start of the oldest open transaction (see sync_horizon)
+# to absorb skew between the API's clock and the database's.
+SYNC_SAFETY_SECONDS = 2
+MAX_SYNC_PAGE = 1000
+
+@event.listens_for(Session, "before_flush")
+def record_tombstones(session, flush_context, instances):
+    """Write a tombstone in the same transaction as every hard delete"""
+    for obj in list(session.deleted):
+        collection = COLLECTION_BY_MODEL.get(type(obj))
+        if collection is not None:
+            session.add(Tombstone(collection=collection, record_id=obj.id))
+
+def sync_horizon(db: Session) -> datetime:
+    """Newest updated_at/deleted_at a sync may hand out.
+
+    Rows are stamped when they are flushed but only become visible when
+    their transaction commits, which can be much later. Anything stamped
+    since the oldest still-open transaction began could yet commit behind a
+    client's cursor, so the horizon stops short of that transaction's start.
+    A long-open transaction therefore delays sync but never loses a row.
+    """
+    horizon = datetime.utcnow() - timedelta(seconds=SYNC_SAFETY_SECONDS)
+    if db.get_bind().dialect.name == "postgresql":
+        oldest = db.execute(text(
+            "SELECT min(xact_start) AT TIME ZONE 'utc' FROM pg_stat_activity "
+            "WHERE datname = current_database() AND backend_type = 'client backend' "
+            "AND xact_start IS NOT NULL AND pid <> pg_backend_pid()"
+        )).scalar()
+        if oldest is not None:
+            horizon = min(horizon, oldest - timedelta(seconds=SYNC_SAFETY_SECONDS))
+    return horizon
+
+def encode_token(cursors: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursors).encode()).decode()
+
+def decode_token(token: Optional[str]) -> dict:
+    if not token:
+        return {}
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+def after(cursor, updated_column, id_column):
+    """Rows strictly after a (timestamp, id) cursor, tie-broken on id"""
+    if not cursor:
+        return None
+    return tuple_(updated_column, id_column) > tuple_(datetime.fromisoformat(cursor[0]), cursor[1])
+
+def serialize(row, columns):
+    data = {}
+    for name in columns:
+        value = getattr(row, name)
+        data[name] = value.isoformat() if isinstance(value, (datetime, date)) else value
+    return data
+
+@router.get("")
+def sync(
+    since: Optional[str] = None,
+    collections: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=MAX_SYNC_PAGE),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Return rows changed and deleted since a sync token.
+
+    Omit ``since`` for the initial load. Each response carries ``next``,
+    which the client stores and sends back as ``since``. When ``has_more``
+    is true the client should call again straight away. After the first
+    load the payload is proportional to what changed, not to table size.
+    Rows moved to the archive are reported as deleted.
+    Reads the primary: replica lag could let a row slip behind the cursor.
+    """
+    names = collections.split(",") if collections else list(SYNC_COLLECTIONS)
+    unknown = [name for name in names if name not in SYNC_COLLECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collections: {', '.join(unknown)}")
+
+    cursors = decode_token(since)
+    horizon = sync_horizon(db)
+    result = {}
+    has_more = False
+
+    for name in names:
+        model, columns = SYNC_COLLECTIONS[name]
+
+        query = db.query(model).filter(model.updated_at <= horizon)
+        condition = after(cursors.get(name), model.updated_at, model.id)
+        if condition is not None:
+            query = query.filter(condition)
+        rows = query.order_by(model.updated_at, model.id).limit(limit + 1).all()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if rows:
+            cursors[name] = [rows[-1].updated_at.isoformat(), rows[-1].id]
+
+        deleted_key = f"{name}:deleted"
+        tombstones = db.query(Tombstone).filter(Tombstone.collection == name, Tombstone.deleted_at <= horizon)
+        condition = after(cursors.get(deleted_key), Tombstone.deleted_at, Tombstone.id)
+        if condition is not None:
+            tombstones = tombstones.filter(condition)
+        tombstones = tombstones.order_by(Tombstone.deleted_at, Tombstone.id).limit(limit + 1).all()
+        more = more or len(tombstones) > limit
+        tombstones = tombstones[:limit]
+        if tombstones:
+            cursors[deleted_key] = [tombstones[-1].deleted_at.isoformat(), tombstones[-1].id]
+
+        has_more = has_more or more
+        result[name] = {
+            "changed": [serialize(row, columns) for row in rows],
+            "deleted": [tombstone.record_id for tombstone in tombstones],
+            "has_more": more,
+        }
+
+    return {"collections": result, "next": encode_token(cursors), "has_more": has_more}
@@ -0,0 +1,448 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, insert, case, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+import os
+import re
+import threading
+import time
+import traceback
+import unicodedata
+from db.database import SessionLocal, get_read_db
+from db.models import (
+    Feedback, Doctor, FeedbackCategory,
+    FeedbackTerm, FeedbackTermStat, FeedbackSentiment, ProcessingWatermark,
+)
+from app.auth import get_current_user, require_admin
+
+router = APIRouter(prefix="/analytics/feedback", tags=["Analytics"])
+
+WATERMARK = "feedback_text"
+INDEX_BATCH_SIZE = 500
+INDEX_INTERVAL_SECONDS = float(os.environ.get("TEXT_INDEX_INTERVAL", "60"))
+# Feedback younger than this is left for the next run, so a transaction that
+# took a lower id but commits late is not skipped by the id watermark.
+INDEX_SAFETY_SECONDS = 5
+# Words after a negator whose polarity is flipped ("not very helpful")
+NEGATION_WINDOW = 3
+
+# Lexicons are stored without accents; text is folded the same way before
+# lookup. Only English and French have word lists. Comments in Duala, Bassa
+# or Ewondo are still tokenized and searchable, but are tagged "other" and
+# score neutral unless they contain English or French sentiment words.
+STOPWORDS = {
+    "en": {
+        "the", "and", "was", "were", "is", "are", "be", "been", "to", "of", "in", "on", "at", "for",
+        "with", "it", "this", "that", "my", "me", "we", "our", "you", "your", "he", "she", "they",
+        "his", "her", "them", "a", "an", "as", "by", "from", "or", "but", "so", "very", "too",
+        "had", "have", "has", "did", "do", "does", "i", "am", "all", "there", "here", "when",
+        "what", "who", "which", "would", "could", "should", "will", "can", "just", "also", "about",
+    },
+    "fr": {
+        "le", "la", "les", "de", "des", "du", "un", "une", "et", "est", "etait", "sont", "au", "aux",
+        "en", "dans", "pour", "par", "sur", "avec", "ce", "cet", "cette", "ces", "il", "elle", "ils",
+        "elles", "je", "nous", "vous", "mon", "ma", "mes", "son", "sa", "ses", "notre", "votre",
+        "qui", "que", "qu", "mais", "ou", "donc", "tres", "trop", "ai", "as", "avons", "avez", "ont",
+        "suis", "etre", "avoir", "fait", "cest", "tout", "tous", "aussi", "bien", "lui", "leur",
+    },
+}
+NEGATORS = {"not", "no", "never", "nothing", "hardly", "without", "pas", "jamais", "aucun", "aucune", "sans", "ni", "rien"}
+POSITIVE = {
+    "good", "great", "excellent", "kind", "friendly", "helpful", "clean", "fast", "quick", "caring",
+    "professional", "satisfied", "thank", "thanks", "best", "nice", "polite", "efficient", "recommend",
+    "amazing", "attentive", "respectful", "happy", "comfortable", "competent", "wonderful",
+    "bien", "bon", "bonne", "excellente", "gentil", "gentille", "aimable", "accueillant", "accueillante",
+    "propre", "rapide", "merci", "satisfait", "satisfaite", "professionnel", "professionnelle",
+    "efficace", "attentif", "attentive", "respectueux", "respectueuse", "super", "parfait",
+    "parfaite", "recommande", "content", "contente", "competente",
+}
+NEGATIVE = {
+    "bad", "poor", "rude", "slow", "dirty", "terrible", "awful", "worst", "expensive", "unprofessional",
+    "careless", "disappointed", "disappointing", "horrible", "crowded", "late", "delay", "delayed",
+    "ignored", "noisy", "unhelpful", "painful", "angry", "unhappy", "dangerous", "unclean",
+    "mauvais", "mauvaise", "mal", "impoli", "impolie", "lent", "lente", "sale", "cher", "chere",
+    "decu", "decue", "decevant", "decevante", "retard", "bruyant", "bruyante", "negligent",
+    "negligente", "desagreable", "pire", "ignore", "ignoree", "dangereux", "mecontent", "mecontente",
+}
+
+# Words that never become index terms
+INDEX_STOPWORDS = set().union(*STOPWORDS.values()) | NEGATORS
+
+TOKEN_PATTERN = re.compile(r"[^\W\d_]{2,}")
+# Negation does not carry across punctuation ("didn't wait, rude staff")
+CLAUSE_PATTERN = re.compile(r"[.,;:!?()\n]+")
+
+def normalize(text: str) -> str:
+    """Casefold and strip accents so "Très" and "tres" index the same"""
+    text = text.replace("n't", " not").replace("n’t", " not")
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+def tokenize(text: str) -> list:
+    """Words of two or more letters. Apostrophes split French elisions (l'accueil)."""
+    return TOKEN_PATTERN.findall(normalize(text))
+
+def detect_language(tokens) -> str:
+    hits = {lang: sum(1 for token in tokens if token in words) for lang, words in STOPWORDS.items()}
+    language, count = max(hits.items(), key=lambda item: item[1])
+    return language if count else "other"
+
+def analyze(text: str) -> dict:
+    """Tokenize one comment into index terms and a sentiment score"""
+    tokens = []
+    positive = negative = 0
+    for clause in CLAUSE_PATTERN.split(normalize(text)):
+        negated_until = -1
+        clause_tokens = TOKEN_PATTERN.findall(clause)
+        for position, token in enumerate(clause_tokens):
+            if token in NEGATORS:
+                negated_until = position + NEGATION_WINDOW
+                continue
+            polarity = 1 if token in POSITIVE else -1 if token in NEGATIVE else 0
+            if polarity and position <= negated_until:
+                polarity = -polarity
+            if polarity > 0:
+                positive += 1
+            elif polarity < 0:
+                negative += 1
+        tokens += clause_tokens
+
+    terms = Counter(token for token in tokens if token not in INDEX_STOPWORDS)
+    return {
+        "language": detect_language(tokens),
+        "terms": terms,
+        "tokens": len(tokens),
+        "positive": positive,
+        "negative": negative,
+        "score": (positive - negative) / (positive + negative) if positive + negative else 0.0,
+    }
+
+def index_batch(db: Session, batch_size=INDEX_BATCH_SIZE) -> int:
+    """Index the next batch of feedback after the watermark; returns rows consumed.
+
+    The watermark row is locked for the transaction, so concurrent workers
+    take turns instead of indexing the same feedback twice.
+    """
+    mark = db.query(ProcessingWatermark).filter_by(name=WATERMARK).with_for_update().first()
+    if mark is None:
+        mark = ProcessingWatermark(name=WATERMARK, last_id=0)
+        db.add(mark)
+        db.flush()
+
+    rows = (
+        db.query(Feedback.id, Feedback.doctor_id, Feedback.category_id, Feedback.comment, Feedback.created_at)
+        .filter(Feedback.id > mark.last_id)
+        .order_by(Feedback.id)
+        .limit(batch_size)
+        .all()
+    )
+    horizon = datetime.utcnow() - timedelta(seconds=INDEX_SAFETY_SECONDS)
+    for position, row in enumerate(rows):
+        if row.created_at is not None and row.created_at > horizon:
+            rows = rows[:position]
+            break
+    if not rows:
+        db.commit()
+        return 0
+
+    term_rows, sentiment_rows = [], []
+    documents, occurrences = Counter(), Counter()
+    for row in rows:
+        if not row.comment or not row.comment.strip():
+            continue
+        result = analyze(row.comment)
+        for term, count in result["terms"].items():
+            term_rows.append({
+                "feedback_id": row.id,
+                "term": term,
+                "occurrences": count,
+                "doctor_id": row.doctor_id,
+                "category_id": row.category_id,
+            })
+            documents[term] += 1
+            occurrences[term] += count
+        sentiment_rows.append({
+            "feedback_id": row.id,
+            "doctor_id": row.doctor_id,
+            "category_id": row.category_id,
+            "language": result["language"],
+            "tokens": result["tokens"],
+            "positive": result["positive"],
+            "negative": result["negative"],
+            "score": result["score"],
+        })
+
+    if term_rows:
+        db.execute(insert(FeedbackTerm), term_rows)
+        stats = pg_insert(FeedbackTermStat)
+        db.execute(
+            stats.on_conflict_do_update(
+                index_elements=[FeedbackTermStat.term],
+                set_={
+                    "documents": FeedbackTermStat.documents + stats.excluded.documents,
+                    "occurrences": FeedbackTermStat.occurrences + stats.excluded.occurrences,
+                },
+            ),
+            [{"term": term, "documents": documents[term], "occurrences": occurrences[term]} for term in sorted(documents)],
+        )
+    if sentiment_rows:
+        db.execute(insert(FeedbackSentiment), sentiment_rows)
+
+    mark.last_id = rows[-1].id
+    db.commit()
+    return len(rows)
+
+def index_new_feedback(rebuild=False, batch_size=INDEX_BATCH_SIZE) -> dict:
+    """Bring the index up to date, optionally wiping it first"""
+    db = SessionLocal()
+    try:
+        if rebuild:
+            db.query(ProcessingWatermark).filter_by(name=WATERMARK).with_for_update().first()
+            db.query(FeedbackTerm).delete(synchronize_session=False)
+            db.query(FeedbackTermStat).delete(synchronize_session=False)
+            db.query(FeedbackSentiment).delete(synchronize_session=False)
+            db.query(ProcessingWatermark).filter_by(name=WATERMARK).delete(synchronize_session=False)
+            db.commit()
+
+        total = 0
+        while True:
+            consumed = index_batch(db, batch_size)
+            total += consumed
+            if consumed < batch_size:
+                break
+        mark = db.get(ProcessingWatermark, WATERMARK)
+        return {"indexed": total, "watermark": mark.last_id if mark else 0}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+class TextIndexer:
+    """Background thread that indexes new feedback every INDEX_INTERVAL_SECONDS"""
+
+    def __init__(self, interval=INDEX_INTERVAL_SECONDS):
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {"runs": 0, "indexed": 0, "failed": 0, "watermark": 0, "lastRunAt": None, "lastRunSeconds": 0.0}
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name="feedback-text-indexer", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=10):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                pass  # Already logged; try again next interval
+
+    def run_once(self, rebuild=False):
+        started = time.monotonic()
+        try:
+            result = index_new_feedback(rebuild=rebuild)
+        except Exception:
+            print("Feedback text indexing failed:", traceback.format_exc())
+            with self.lock:
+                self.stats["failed"] += 1
+            raise
+        with self.lock:
+            self.stats["runs"] += 1
+            self.stats["indexed"] += result["indexed"]
+            self.stats["watermark"] = result["watermark"]
+            self.stats["lastRunAt"] = datetime.utcnow().isoformat()
+            self.stats["lastRunSeconds"] = round(time.monotonic() - started, 3)
+        return result
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+text_indexer = TextIndexer()
+
+def group_filter(query, model, doctor_id, category_id):
+    if doctor_id is not None:
+        query = query.filter(model.doctor_id == doctor_id)
+    if category_id is not None:
+        query = query.filter(model.category_id == category_id)
+    return query
+
+@router.get("/keywords")
+def get_keywords(
+    doctor_id: Optional[int] = None,
+    category_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=200),
+    min_documents: int = Query(2, ge=1),
+    db: Session = Depends(get_read_db)
+):
+    """Top terms in feedback, optionally for one doctor or category.
+
+    Without a filter terms are ranked by how many comments use them. With a
+    filter they are ranked by TF-IDF against the whole corpus, so words that
+    are typical for this doctor or category rise above words everyone uses.
+    Each term carries the mean sentiment of the comments containing it.
+    """
+    corpus = db.query(func.count(FeedbackSentiment.feedback_id)).scalar() or 0
+    if doctor_id is None and category_id is None:
+        group = corpus
+        ranked = (
+            db.query(
+                FeedbackTermStat.term,
+                FeedbackTermStat.documents,
+                FeedbackTermStat.occurrences,
+                literal(None).label("score"),
+            )
+            .filter(FeedbackTermStat.documents >= min_documents)
+            .order_by(FeedbackTermStat.documents.desc(), FeedbackTermStat.term)
+            .limit(limit)
+            .all()
+        )
+    else:
+        group = group_filter(db.query(func.count(FeedbackSentiment.feedback_id)), FeedbackSentiment, doctor_id, category_id).scalar() or 0
+        if not group:
+            return {"documents": 0, "keywords": []}
+        documents = func.count(FeedbackTerm.feedback_id)
+        score = (documents * 1.0 / group) * (func.ln((corpus + 1.0) / (FeedbackTermStat.documents + 1)) + 1)
+        ranked = (
+            group_filter(db.query(
+                FeedbackTerm.term,
+                documents.label("documents"),
+                func.sum(FeedbackTerm.occurrences).label("occurrences"),
+                score.label("score"),
+            ), FeedbackTerm, doctor_id, category_id)
+            .join(FeedbackTermStat, FeedbackTermStat.term == FeedbackTerm.term)
+            .group_by(FeedbackTerm.term, FeedbackTermStat.documents)
+            .having(documents >= min_documents)
+            .order_by(score.desc(), FeedbackTerm.term)
+            .limit(limit)
+            .all()
+        )
+
+    terms = [row.term for row in ranked]
+    sentiment = {}
+    if terms:
+        sentiment = dict(
+            group_filter(db.query(FeedbackTerm.term, func.avg(FeedbackSentiment.score)), FeedbackTerm, doctor_id, category_id)
+            .join(FeedbackSentiment, FeedbackSentiment.feedback_id == FeedbackTerm.feedback_id)
+            .filter(FeedbackTerm.term.in_(terms))
+            .group_by(FeedbackTerm.term)
+            .all()
+        )
+
+    return {
+        "documents": group,
+        "keywords": [
+            {
+                "term": row.term,
+                "documents": row.documents,
+                "occurrences": int(row.occurrences or 0),
+                "score": round(float(row.score), 4) if row.score is not None else None,
+                "sentiment": round(float(sentiment.get(row.term) or 0.0), 3),
+            }
+            for row in ranked
+        ],
+    }
+
+@router.get("/sentiment")
+def get_sentiment(
+    group_by: str = Query("doctor", pattern="^(doctor|category|language)$"),
+    doctor_id: Optional[int] = None,
+    category_id: Optional[int] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Mean comment sentiment (-1 to 1) and polarity counts per doctor, category or language"""
+    key = {
+        "doctor": FeedbackSentiment.doctor_id,
+        "category": FeedbackSentiment.category_id,
+        "language": FeedbackSentiment.language,
+    }[group_by]
+    query = group_filter(db.query(
+        key.label("key"),
+        func.count(FeedbackSentiment.feedback_id).label("documents"),
+        func.avg(FeedbackSentiment.score).label("score"),
+        func.sum(case((FeedbackSentiment.score > 0, 1), else_=0)).label("positive"),
+        func.sum(case((FeedbackSentiment.score < 0, 1), else_=0)).label("negative"),
+    ), FeedbackSentiment, doctor_id, category_id).group_by(key)
+    rows = query.all()
+
+    names = {}
+    if group_by == "doctor":
+        names = dict(db.query(Doctor.id, Doctor.name).filter(Doctor.id.in_([row.key for row in rows])))
+    elif group_by == "category":
+        names = dict(db.query(FeedbackCategory.id, FeedbackCategory.name).filter(FeedbackCategory.id.in_([row.key for row in rows])))
+
+    groups = [
+        {
+            group_by: row.key,
+            "name": names.get(row.key, row.key if group_by == "language" else None),
+            "documents": row.documents,
+            "score": round(float(row.score or 0.0), 3),
+            "positive": int(row.positive or 0),
+            "negative": int(row.negative or 0),
+            "neutral": row.documents - int(row.positive or 0) - int(row.negative or 0),
+        }
+        for row in rows
+    ]
+    groups.sort(key=lambda group: (-group["documents"], str(group[group_by])))
+    return {"groupBy": group_by, "groups": groups}
+
+@router.get("/search")
+def search_feedback(
+    q: str,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_read_db)
+):
+    """Newest feedback whose comment contains every word of ``q``, via the term index"""
+    terms = sorted(set(tokenize(q)))
+    if not terms:
+        raise HTTPException(status_code=400, detail="Query has no searchable words")
+
+    matches = (
+        db.query(FeedbackTerm.feedback_id)
+        .filter(FeedbackTerm.term.in_(terms))
+        .group_by(FeedbackTerm.feedback_id)
+        .having(func.count(FeedbackTerm.term) == len(terms))
+        .order_by(FeedbackTerm.feedback_id.desc())
+        .limit(limit)
+        .subquery()
+    )
+    rows = (
+        db.query(Feedback)
+        .join(matches, matches.c.feedback_id == Feedback.id)
+        .order_by(Feedback.id.desc())
+        .all()
+    )
+    return {
+        "terms": terms,
+        "items": [
+            {
+                "id": row.id,
+                "doctor_id": row.doctor_id,
+                "category_id": row.category_id,
+                "rating": row.rating,
+                "comment": row.comment,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+            }
+            for row in rows
+        ],
+    }
+
+@router.post("/index")
+def run_indexer(
+    rebuild: bool = False,
+    current_user: dict = Depends(require_admin)
+):
+    """Index feedback received since the last run now, or rebuild the index from scratch"""
+    return text_indexer.run_once(rebuild=rebuild)
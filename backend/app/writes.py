@@ -0,0 +1,41 @@
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from typing import Optional
+
+def constraint_name(exc: IntegrityError):
+    """Name of the violated constraint as reported by psycopg2, if any"""
+    diag = getattr(exc.orig, "diag", None)
+    return getattr(diag, "constraint_name", None)
+
+def raise_for_constraint(exc: IntegrityError, errors: dict, default_detail: str):
+    """Translate a constraint violation into the HTTP error the API already uses.
+
+    ``errors`` maps constraint names (e.g. ``feedback_doctor_id_fkey``) to
+    ``(status_code, detail)``. Create paths let the database enforce
+    references instead of SELECTing each one first, and call this on failure.
+    """
+    status_code, detail = errors.get(constraint_name(exc), (500, default_detail))
+    raise HTTPException(status_code=status_code, detail=detail)
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+def parse_if_match(header: Optional[str]) -> Optional[int]:
+    """Version expected by an If-Match header; None when absent or ``*``"""
+    if not header or header.strip() == "*":
+        return None
+    value = header.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a version ETag such as \"3\"")
+
+def check_version(current: int, expected: Optional[int], label: str):
+    """409 when the client edited a version that is no longer current"""
+    if expected is not None and current != expected:
+        raise HTTPException(
+            status_code=409,
+            detail=f"{label} was modified by someone else (version {current}, expected {expected}); reload and retry",
+        )
@@ -0,0 +1,119 @@
+from sqlalchemy import text
+
+# create_all() only creates missing tables; it never alters tables that
+# already exist. Columns and indexes added to existing models are listed
+# here as idempotent statements so deployed databases pick them up on start.
+MIGRATIONS = [
+    # Per-doctor patient counts and ratings
+    "CREATE INDEX IF NOT EXISTS ix_appointments_doctor_id ON appointments (doctor_id)",
+    "CREATE INDEX IF NOT EXISTS ix_appointments_patient_id ON appointments (patient_id)",
+    "CREATE INDEX IF NOT EXISTS ix_feedback_doctor_id ON feedback (doctor_id)",
+    "CREATE INDEX IF NOT EXISTS ix_feedback_patient_id ON feedback (patient_id)",
+    # Typed medication dates. ISO dates convert as they are, and day-first
+    # DD/MM/YYYY (also with - or .) and YYYY/MM/DD are converted too. Anything
+    # else, including impossible dates like 2024-02-30, becomes NULL
+    # (open-ended) rather than aborting the conversion; the original text of
+    # those rows is kept in medication_date_rejects for review. daterange()
+    # rejects end < start, so inverted legacy rows are clamped to a single day.
+    r"""
+    DO $$
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'medications' AND column_name = 'start_date') <> 'date' THEN
+            CREATE FUNCTION pg_temp.legacy_date(value text) RETURNS date AS $f$
+            BEGIN
+                value := btrim(value);
+                IF value ~ '^\d{4}[-/]\d{1,2}[-/]\d{1,2}$' THEN
+                    RETURN to_date(translate(value, '/', '-'), 'YYYY-MM-DD');
+                ELSIF value ~ '^\d{1,2}[-/.]\d{1,2}[-/.]\d{4}$' THEN
+                    RETURN to_date(translate(value, '/.', '--'), 'DD-MM-YYYY');
+                END IF;
+                RETURN NULL;
+            EXCEPTION WHEN others THEN  -- Out-of-range day or month
+                RETURN NULL;
+            END
+            $f$ LANGUAGE plpgsql IMMUTABLE;
+
+            CREATE TABLE IF NOT EXISTS medication_date_rejects (
+                medication_id INTEGER PRIMARY KEY,
+                start_date TEXT,
+                end_date TEXT,
+                rejected_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now()
+            );
+            INSERT INTO medication_date_rejects (medication_id, start_date, end_date)
+                SELECT id, start_date, end_date FROM medications
+                WHERE (btrim(start_date) <> '' AND pg_temp.legacy_date(start_date) IS NULL)
+                   OR (btrim(end_date) <> '' AND pg_temp.legacy_date(end_date) IS NULL)
+                ON CONFLICT (medication_id) DO NOTHING;
+
+            ALTER TABLE medications
+                ALTER COLUMN start_date TYPE date USING pg_temp.legacy_date(start_date),
+                ALTER COLUMN end_date TYPE date USING pg_temp.legacy_date(end_date);
+            UPDATE medications SET end_date = start_date WHERE end_date < start_date;
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_medications_patient_dates ON medications (patient_id, start_date, end_date)",
+    "CREATE INDEX IF NOT EXISTS ix_medications_active_range ON medications USING gist (daterange(start_date, end_date, '[]'))",
+    # Patient timeline
+    "CREATE INDEX IF NOT EXISTS ix_medication_reminders_patient_id ON medication_reminders (patient_id)",
+]
+
+# Delta sync: every synced table gets an indexed updated_at, backfilled from
+# created_at so existing rows are part of the first full sync.
+for table in ("patients", "feedback", "medication_reminders", "appointments", "medications"):
+    MIGRATIONS += [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITHOUT TIME ZONE",
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_updated_at ON {table} (updated_at)",
+        f"UPDATE {table} SET updated_at = COALESCE(created_at, now()) WHERE updated_at IS NULL",
+    ]
+MIGRATIONS += [
+    "CREATE INDEX IF NOT EXISTS ix_doctors_updated_at ON doctors (updated_at)",
+    # Hospital KPI periods
+    "CREATE INDEX IF NOT EXISTS ix_patients_created_at ON patients (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_appointments_created_at ON appointments (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_feedback_created_at ON feedback (created_at)",
+    # Partial indexes over the rows hot queries actually read
+    "CREATE INDEX IF NOT EXISTS ix_medication_reminders_active_patient ON medication_reminders (patient_id) WHERE is_active",
+    "CREATE INDEX IF NOT EXISTS ix_appointments_scheduled_doctor_date ON appointments (doctor_id, date) WHERE status = 'scheduled'",
+    # Duplicate-patient merges
+    "ALTER TABLE patients ADD COLUMN IF NOT EXISTS merged_into_id INTEGER REFERENCES patients (id)",
+    # Optimistic concurrency
+    "ALTER TABLE appointments ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+    "ALTER TABLE appointments_archive ADD COLUMN IF NOT EXISTS version INTEGER",
+    "ALTER TABLE medications ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+    # Specialty and category lookup tables; existing strings are mapped to
+    # ids on start, by ensure_lookups() in the API's lifespan
+    "ALTER TABLE doctors ADD COLUMN IF NOT EXISTS specialty_id INTEGER REFERENCES specialties (id)",
+    "CREATE INDEX IF NOT EXISTS ix_doctors_specialty_id ON doctors (specialty_id)",
+    "ALTER TABLE appointments ADD COLUMN IF NOT EXISTS category_id INTEGER REFERENCES appointment_categories (id)",
+    "CREATE INDEX IF NOT EXISTS ix_appointments_category_id ON appointments (category_id)",
+    "ALTER TABLE appointments_archive ADD COLUMN IF NOT EXISTS category_id INTEGER",
+    "ALTER TABLE doctor_rating_stats ADD COLUMN IF NOT EXISTS specialty_id INTEGER REFERENCES specialties (id)",
+    "DROP INDEX IF EXISTS ix_doctor_rating_stats_specialty_bayesian",
+    "DROP INDEX IF EXISTS ix_doctor_rating_stats_specialty_wilson",
+    "DROP INDEX IF EXISTS ix_doctor_rating_stats_specialty_recent",
+    "CREATE INDEX IF NOT EXISTS ix_doctor_rating_stats_specialty_id_bayesian ON doctor_rating_stats (specialty_id, bayesian)",
+    "CREATE INDEX IF NOT EXISTS ix_doctor_rating_stats_specialty_id_wilson ON doctor_rating_stats (specialty_id, wilson)",
+    "CREATE INDEX IF NOT EXISTS ix_doctor_rating_stats_specialty_id_recent ON doctor_rating_stats (specialty_id, recent)",
+]
+
+# Listing validators: one table_versions row per table that conditional_get()
+# validates, bumped by app/caching.py after each transaction writing it
+# commits. An earlier revision bumped them from triggers inside the writing
+# transaction, which serialized writers on the row; drop those.
+for table in ("patients", "doctors", "appointments", "feedback"):
+    MIGRATIONS += [
+        f"DROP TRIGGER IF EXISTS bump_{table}_version ON {table}",
+        f"INSERT INTO table_versions (table_name, version, changed_at) "
+        f"VALUES ('{table}', 1, now() AT TIME ZONE 'utc') ON CONFLICT (table_name) DO NOTHING",
+    ]
+MIGRATIONS.append("DROP FUNCTION IF EXISTS bump_table_version()")
+
+def apply_migrations(engine):
+    """Run every migration statement in order, each in its own transaction"""
+    if engine.dialect.name != "postgresql":
+        return
+    for statement in MIGRATIONS:
+        with engine.begin() as conn:
+            conn.execute(text(statement))
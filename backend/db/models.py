@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, DateTime, Time
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, ForeignKey, Text, DateTime, Time, Date, Index, Float, Table, JSON, text
 from datetime import datetime
 from sqlalchemy.orm import relationship
 from db.database import Base
@@ -10,15 +10,31 @@ class Admin(Base):
     password = Column(String, nullable=False)
     name = Column(String)
 
+# Canonical specialties and appointment categories (app/lookups.py). key is
+# the name folded to lowercase ASCII words, so spellings that differ only in
+# case, accents or punctuation map to one row.
+class Specialty(Base):
+    __tablename__ = "specialties"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    key = Column(String, unique=True, nullable=False)
+
+class AppointmentCategory(Base):
+    __tablename__ = "appointment_categories"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    key = Column(String, unique=True, nullable=False)
+
 class Doctor(Base):
     __tablename__ = "doctors"
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
     password = Column(String, nullable=False)
     name = Column(String)
-    specialty = Column(String)
+    specialty = Column(String)  # Canonical name of specialty_id, kept for display
+    specialty_id = Column(Integer, ForeignKey("specialties.id"), index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     is_active = Column(Boolean, default=True)
 
 class Patient(Base):
@@ -30,7 +46,9 @@ class Patient(Base):
     last_name = Column(String)
     phone_number = Column(String)
     is_active = Column(Boolean, default=True, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    merged_into_id = Column(Integer, ForeignKey("patients.id"))  # Set when merged as a duplicate
 
 class FeedbackCategory(Base):
     __tablename__ = "feedback_categories"
@@ -40,12 +58,13 @@ class FeedbackCategory(Base):
 class Feedback(Base):
     __tablename__ = "feedback"
     id = Column(Integer, primary_key=True, index=True)
-    patient_id = Column(Integer, ForeignKey("patients.id"))
-    doctor_id = Column(Integer, ForeignKey("doctors.id"))
+    patient_id = Column(Integer, ForeignKey("patients.id"), index=True)
+    doctor_id = Column(Integer, ForeignKey("doctors.id"), index=True)
     category_id = Column(Integer, ForeignKey("feedback_categories.id"))
     rating = Column(Integer)
     comment = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     patient = relationship("Patient")
     doctor = relationship("Doctor")
     category = relationship("FeedbackCategory")
@@ -53,29 +72,46 @@ class Feedback(Base):
 class MedicationReminder(Base):
     __tablename__ = "medication_reminders"
     id = Column(Integer, primary_key=True, index=True)
-    patient_id = Column(Integer, ForeignKey("patients.id"))
+    patient_id = Column(Integer, ForeignKey("patients.id"), index=True)
     medication = Column(String, nullable=False)
     time = Column(String, nullable=False)  # Store as string in HH:MM format
     frequency = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     patient = relationship("Patient")
 
+    # Reminder lists only ever read active rows
+    __table_args__ = (
+        Index("ix_medication_reminders_active_patient", "patient_id", postgresql_where=text("is_active")),
+    )
+
 # Add new models for appointments and medications
 class Appointment(Base):
     __tablename__ = "appointments"
     id = Column(Integer, primary_key=True, index=True)
-    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=False)
-    doctor_id = Column(Integer, ForeignKey("doctors.id"), nullable=False)
+    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=False, index=True)
+    doctor_id = Column(Integer, ForeignKey("doctors.id"), nullable=False, index=True)
     date = Column(String, nullable=False)  # Store as string in YYYY-MM-DD format
     time = Column(String, nullable=False)  # Store as string in HH:MM format
-    category = Column(String)  # Appointment category/type
+    category = Column(String)  # Appointment category/type; canonical name of category_id
+    category_id = Column(Integer, ForeignKey("appointment_categories.id"), index=True)
     description = Column(Text)  # Description or notes
     status = Column(String, default="scheduled")  # scheduled, completed, cancelled
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    version = Column(Integer, nullable=False, default=1)  # Bumped on every update; sent as the ETag
     patient = relationship("Patient")
     doctor = relationship("Doctor")
 
+    # ORM updates add "AND version = <loaded version>" and fail if another write got there first
+    __mapper_args__ = {"version_id_col": version}
+
+    # Upcoming schedules per doctor; completed and cancelled rows stay out
+    __table_args__ = (
+        Index("ix_appointments_scheduled_doctor_date", "doctor_id", "date", postgresql_where=text("status = 'scheduled'")),
+    )
+
 class Medication(Base):
     __tablename__ = "medications"
     id = Column(Integer, primary_key=True, index=True)
@@ -85,8 +121,242 @@ class Medication(Base):
     dosage = Column(String, nullable=False)  # Dosage amount
     frequency = Column(String, nullable=False)  # How often to take
     instructions = Column(Text)  # Additional instructions
-    start_date = Column(String)  # YYYY-MM-DD format
-    end_date = Column(String)  # YYYY-MM-DD format
+    start_date = Column(Date)  # NULL means open-ended
+    end_date = Column(Date)  # Inclusive; NULL means open-ended
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    version = Column(Integer, nullable=False, default=1)  # Bumped on every update; sent as the ETag
     patient = relationship("Patient")
-    doctor = relationship("Doctor")
\ No newline at end of file
+    doctor = relationship("Doctor")
+
+    __mapper_args__ = {"version_id_col": version}
+
+    # Per-patient "what is this patient on" lookups. The pharmacy-wide GiST
+    # index on daterange(start_date, end_date) is created in db/migrations.py.
+    __table_args__ = (
+        Index("ix_medications_patient_dates", "patient_id", "start_date", "end_date"),
+    )
+
+# Records of hard deletes, so sync clients can drop rows they still hold
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+    id = Column(Integer, primary_key=True, index=True)
+    collection = Column(String, nullable=False)
+    record_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_tombstones_collection_deleted_at", "collection", "deleted_at", "id"),
+    )
+
+# Feedback text analytics, built incrementally by app/text_analytics.py.
+# feedback_id is deliberately not a foreign key: analytics outlive the
+# feedback row. doctor_id and category_id are copied so per-doctor and
+# per-category aggregates never have to join back to feedback.
+class FeedbackTerm(Base):
+    __tablename__ = "feedback_terms"
+    feedback_id = Column(Integer, primary_key=True)
+    term = Column(String, primary_key=True)
+    occurrences = Column(Integer, nullable=False, default=1)
+    doctor_id = Column(Integer)
+    category_id = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_feedback_terms_term", "term", "feedback_id"),
+        Index("ix_feedback_terms_doctor_term", "doctor_id", "term"),
+        Index("ix_feedback_terms_category_term", "category_id", "term"),
+    )
+
+# Corpus-wide term frequencies: documents containing the term and total uses
+class FeedbackTermStat(Base):
+    __tablename__ = "feedback_term_stats"
+    term = Column(String, primary_key=True)
+    documents = Column(Integer, nullable=False, default=0)
+    occurrences = Column(Integer, nullable=False, default=0)
+
+class FeedbackSentiment(Base):
+    __tablename__ = "feedback_sentiment"
+    feedback_id = Column(Integer, primary_key=True)
+    doctor_id = Column(Integer, index=True)
+    category_id = Column(Integer, index=True)
+    language = Column(String, nullable=False)
+    tokens = Column(Integer, nullable=False)
+    positive = Column(Integer, nullable=False)
+    negative = Column(Integer, nullable=False)
+    score = Column(Float, nullable=False)  # -1 (negative) .. 1 (positive)
+
+# Outcome of each /feedback/ingest submission, written with the flush that
+# decided it, so a status poll can be answered by any worker
+class FeedbackTicket(Base):
+    __tablename__ = "feedback_tickets"
+    ticket = Column(String, primary_key=True)
+    status = Column(String, nullable=False)  # stored, rejected or failed
+    feedback_id = Column(Integer, nullable=True)
+    detail = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+# Named high-water marks for incremental background processing
+class ProcessingWatermark(Base):
+    __tablename__ = "processing_watermarks"
+    name = Column(String, primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Per-table change counters, bumped after each committed write to the table
+# (app/caching.py). Listing validators read one row here instead of
+# aggregating the table.
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+    table_name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    changed_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+# Running per-doctor rating sums and the scores derived from them, kept up to
+# date by app/ratings.py as feedback is written. specialty_id is copied from
+# the doctor so per-specialty leaderboards read straight off an index.
+class DoctorRatingStat(Base):
+    __tablename__ = "doctor_rating_stats"
+    doctor_id = Column(Integer, ForeignKey("doctors.id"), primary_key=True)
+    specialty_id = Column(Integer, ForeignKey("specialties.id"))
+    ratings = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    positive = Column(Integer, nullable=False, default=0)  # Ratings of 4 or 5
+    decayed_sum = Column(Float, nullable=False, default=0.0)
+    decayed_weight = Column(Float, nullable=False, default=0.0)
+    decayed_at = Column(DateTime, nullable=False)  # Time the decayed sums are relative to
+    bayesian = Column(Float, nullable=False, default=0.0)
+    wilson = Column(Float, nullable=False, default=0.0)
+    recent = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_doctor_rating_stats_bayesian", "bayesian"),
+        Index("ix_doctor_rating_stats_wilson", "wilson"),
+        Index("ix_doctor_rating_stats_recent", "recent"),
+        Index("ix_doctor_rating_stats_specialty_id_bayesian", "specialty_id", "bayesian"),
+        Index("ix_doctor_rating_stats_specialty_id_wilson", "specialty_id", "wilson"),
+        Index("ix_doctor_rating_stats_specialty_id_recent", "specialty_id", "recent"),
+    )
+
+# One row per closed day with running totals as of the end of that day, so a
+# period's figures are the difference of two rows. Filled by app/kpis.py.
+class DailyKpi(Base):
+    __tablename__ = "daily_kpis"
+    day = Column(Date, primary_key=True)
+    patients = Column(Integer, nullable=False, default=0)
+    appointments = Column(Integer, nullable=False, default=0)
+    feedback = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Expected appointments per specialty and day, replaced by each nightly
+# forecast run (app/forecast.py); the API only ever reads these rows.
+class AppointmentForecast(Base):
+    __tablename__ = "appointment_forecasts"
+    specialty = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    expected = Column(Float, nullable=False)
+    lower = Column(Float, nullable=False)
+    upper = Column(Float, nullable=False)
+    generated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+# Duplicate-patient detection (app/dedupe.py). Patients sharing a blocking
+# key (normalized phone, phonetic name, email local part) are the only
+# pairs ever compared.
+class PatientBlockingKey(Base):
+    __tablename__ = "patient_blocking_keys"
+    patient_id = Column(Integer, ForeignKey("patients.id"), primary_key=True)
+    key = Column(String, primary_key=True)
+
+    __table_args__ = (
+        Index("ix_patient_blocking_keys_key", "key", "patient_id"),
+    )
+
+class DuplicateCandidate(Base):
+    __tablename__ = "patient_duplicate_candidates"
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=False)  # Lower id of the pair
+    duplicate_id = Column(Integer, ForeignKey("patients.id"), nullable=False)
+    score = Column(Float, nullable=False)
+    reasons = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="open")  # open, merged, dismissed
+    created_at = Column(DateTime, default=datetime.utcnow)
+    resolved_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_patient_duplicate_candidates_pair", "patient_id", "duplicate_id", unique=True),
+        Index("ix_patient_duplicate_candidates_status_score", "status", "score"),
+    )
+
+# Append-only change history, written in batches by app/audit.py.
+# changes maps column -> [old, new]; passwords are never recorded.
+class AuditLog(Base):
+    __tablename__ = "audit_log"
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    record_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)  # insert, update, delete
+    changes = Column(JSON, nullable=False)
+    actor = Column(String)  # "role:id" of the caller, when authenticated
+    changed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_audit_log_record", "table_name", "record_id", "id"),
+    )
+
+# Persistent background jobs, claimed with SKIP LOCKED by the app/jobs.py
+# worker. progress is a 0-1 fraction reported by the running handler.
+class Job(Base):
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="queued")  # queued, running, cancelling, succeeded, failed, cancelled
+    priority = Column(Integer, nullable=False, default=0)  # Higher runs first
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    progress = Column(Float, nullable=False, default=0.0)
+    message = Column(String)
+    result = Column(JSON)
+    error = Column(Text)
+    worker = Column(String)
+    created_by = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        # The claim query reads only queued jobs, in this order
+        Index("ix_jobs_queued", text("priority DESC"), "run_after", "id", postgresql_where=text("status = 'queued'")),
+        Index("ix_jobs_status_heartbeat", "status", "heartbeat_at"),
+    )
+
+def archive_table(model):
+    """Cold copy of a model's table: same columns, no foreign keys, plus archived_at.
+
+    Rows are moved here by app/archive.py and keep their ids, so the hot and
+    archive tables can be queried together with UNION ALL.
+    """
+    source = model.__table__
+    name = f"{source.name}_archive"
+    columns = [
+        Column(column.name, column.type, primary_key=column.primary_key, autoincrement=False)
+        for column in source.columns
+    ]
+    indexes = [
+        Index(f"ix_{name}_{column}", column)
+        for column in ("created_at", "patient_id", "doctor_id")
+        if column in source.columns
+    ]
+    return Table(name, Base.metadata, *columns, Column("archived_at", DateTime, default=datetime.utcnow), *indexes)
+
+feedback_archive = archive_table(Feedback)
+appointments_archive = archive_table(Appointment)
+medication_reminders_archive = archive_table(MedicationReminder)
+ARCHIVE_TABLES = {
+    Feedback: feedback_archive,
+    Appointment: appointments_archive,
+    MedicationReminder: medication_reminders_archive,
+}
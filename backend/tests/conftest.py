@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine, event
+import db.database as database
+
+# Tests run against a throwaway SQLite file bound before the app is imported;
+# PostgreSQL-only statements are exercised by tests that skip here. A file
+# rather than :memory: gives the app's background writers their own
+# connections instead of sharing the test's mid-transaction.
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="dgh-tests-"), "test.db")
+engine = create_engine(f"sqlite:///{DATABASE_PATH}", connect_args={"check_same_thread": False})
+database.engine = engine
+
+@event.listens_for(engine, "connect")
+def add_postgres_functions(connection, record):
+    connection.create_function("greatest", -1, max)
+    connection.create_function("least", -1, min)
+    connection.execute("PRAGMA foreign_keys = ON")  # Enforced, as on PostgreSQL
+
+database.SessionLocal.configure(bind=engine)
+database.ReplicaSessionLocal.configure(bind=engine)
+
+from db.database import Base, SessionLocal  # noqa: E402
+
+@pytest.fixture
+def db():
+    import app.main  # noqa: F401 Registers every model and applies migrations
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def client(db):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def admin_headers(db):
+    from db.models import Admin
+    from app.auth import create_access_token
+    db.add(Admin(id=1, email="admin@dgh.cm", password="x", name="Admin"))
+    db.commit()
+    return {"Authorization": "Bearer " + create_access_token({"sub": "1", "role": "admin"})}
+
+@pytest.fixture
+def doctor(db):
+    from db.models import Doctor
+    record = Doctor(id=1, name="Dr Eyong", email="eyong@dgh.cm", password="x", specialty="Cardiology")
+    db.add(record)
+    db.commit()
+    return record
+
+@pytest.fixture
+def patient_headers(db):
+    from db.models import Patient
+    from app.auth import create_access_token
+    db.add(Patient(id=1, email="patient@dgh.cm", password="x", first_name="Ama", last_name="Ngo"))
+    db.commit()
+    return {"Authorization": "Bearer " + create_access_token({"sub": "1", "role": "patient"})}
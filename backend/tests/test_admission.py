@@ -0,0 +1,83 @@
+import asyncio
+from app.admission import AdmissionController, AdmissionMiddleware, classify
+
+def test_classify():
+    assert classify("GET", "/health") is None
+    assert classify("OPTIONS", "/appointments/") is None
+    assert classify("GET", "/exports/feedback") == "exports"
+    assert classify("GET", "/statistics/hospital") == "analytics"
+    assert classify("POST", "/archive/run") == "analytics"
+    assert classify("GET", "/patients/") == "analytics"
+    assert classify("POST", "/patients/duplicates/1/merge") == "analytics"
+    # Writes to a listing's path are clinical, not analytics
+    assert classify("POST", "/appointments/") == "clinical"
+    assert classify("GET", "/appointments/5") == "standard"
+
+def test_freed_slot_goes_to_the_highest_priority_waiter():
+    controller = AdmissionController(limits={"clinical": 1, "analytics": 1}, max_concurrent=1, max_wait=5)
+
+    async def scenario():
+        assert await controller.acquire("analytics")
+        analytics = asyncio.ensure_future(controller.acquire("analytics"))
+        clinical = asyncio.ensure_future(controller.acquire("clinical"))
+        await asyncio.sleep(0)
+        # The analytics request queued first, but clinical outranks it
+        controller.release("analytics")
+        granted = await asyncio.wait_for(clinical, 1)
+        waiting = not analytics.done()
+        controller.release("clinical")
+        return granted, waiting, await asyncio.wait_for(analytics, 1)
+
+    assert asyncio.run(scenario()) == (True, True, True)
+    assert controller.active == {"clinical": 0, "analytics": 1}
+
+def test_full_queues_and_long_waits_are_shed():
+    controller = AdmissionController(limits={"standard": 1}, max_concurrent=1, queue_size=1, max_wait=0.05)
+
+    async def scenario():
+        assert await controller.acquire("standard")
+        waiting = asyncio.ensure_future(controller.acquire("standard"))
+        await asyncio.sleep(0)
+        overflow = await controller.acquire("standard")
+        return overflow, await waiting
+
+    assert asyncio.run(scenario()) == (False, False)
+    stats = controller.snapshot()["classes"]["standard"]
+    assert (stats["admitted"], stats["queued"], stats["shed"], stats["timedOut"], stats["depth"]) == (1, 1, 2, 1, 0)
+
+def test_shed_requests_get_503_with_retry_after():
+    controller = AdmissionController(limits={"analytics": 1}, max_concurrent=1, queue_size=0)
+    controller.active["analytics"] = 1
+    controller.latency["analytics"] = 2.5
+    sent = []
+
+    async def app(scope, receive, send):
+        raise AssertionError("shed requests must not reach the app")
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/statistics/hospital"}
+    asyncio.run(AdmissionMiddleware(app, controller)(scope, None, send))
+    assert sent[0]["status"] == 503
+    assert (b"retry-after", b"3") in sent[0]["headers"]
+
+def test_contention_never_exceeds_the_limits():
+    controller = AdmissionController(limits={"clinical": 3, "analytics": 2}, max_concurrent=4, queue_size=100, max_wait=5)
+    peak = {"total": 0, "analytics": 0}
+
+    async def request(name):
+        assert await controller.acquire(name)
+        peak["total"] = max(peak["total"], sum(controller.active.values()))
+        peak["analytics"] = max(peak["analytics"], controller.active["analytics"])
+        await asyncio.sleep(0.001)
+        controller.release(name, 0.001)
+
+    async def scenario():
+        await asyncio.gather(*[request("clinical" if i % 2 else "analytics") for i in range(40)])
+
+    asyncio.run(scenario())
+    assert (peak["total"], peak["analytics"]) == (4, 2)
+    assert controller.active == {"clinical": 0, "analytics": 0}
+    stats = controller.snapshot()["classes"]
+    assert stats["clinical"]["admitted"] + stats["analytics"]["admitted"] == 40
@@ -0,0 +1,53 @@
+import pytest
+from db.models import Appointment
+from db.database import engine
+
+@pytest.fixture
+def appointments(db, patient_headers, doctor):
+    db.add_all([
+        Appointment(id=i, patient_id=1, doctor_id=1, date="2030-01-0%d" % i, time="09:00", status=status)
+        for i, status in ((1, "scheduled"), (2, "scheduled"), (3, "completed"))
+    ])
+    db.commit()
+
+def body(**changes):
+    return {"patient_id": 1, "doctor_id": 1, "date": "2030-01-01", "time": "10:00", **changes}
+
+def test_get_sends_the_version_as_etag(client, appointments, patient_headers):
+    response = client.get("/appointments/1", headers=patient_headers)
+    assert response.headers["ETag"] == '"1"'
+
+def test_put_with_current_version_bumps_it(client, appointments, patient_headers):
+    response = client.put("/appointments/1", json=body(), headers={**patient_headers, "If-Match": '"1"'})
+    assert response.status_code == 200
+    assert response.json()["time"] == "10:00"
+    assert response.headers["ETag"] == '"2"'
+
+def test_put_with_stale_version_is_a_conflict(client, appointments, patient_headers):
+    client.put("/appointments/1", json=body(), headers={**patient_headers, "If-Match": '"1"'})
+    response = client.put("/appointments/1", json=body(time="11:00"), headers={**patient_headers, "If-Match": '"1"'})
+    assert response.status_code == 409
+    assert client.get("/appointments/1", headers=patient_headers).json()["time"] == "10:00"
+
+def test_malformed_if_match_is_rejected(client, appointments, patient_headers):
+    response = client.put("/appointments/1", json=body(), headers={**patient_headers, "If-Match": "yesterday"})
+    assert response.status_code == 400
+
+@pytest.mark.skipif(engine.dialect.name == "sqlite", reason="UPDATE ... FROM (VALUES ...) needs PostgreSQL")
+def test_bulk_transition_reports_each_conflict(client, appointments, patient_headers):
+    response = client.post("/appointments/status", headers=patient_headers, json={
+        "status": "completed",
+        "items": [{"id": 1, "version": 1}, {"id": 2, "version": 7}, {"id": 3}, {"id": 99}],
+    })
+    assert response.json() == {
+        "updated": [{"id": 1, "version": 2}],
+        "conflicts": [
+            {"id": 2, "reason": "version_mismatch", "status": "scheduled", "version": 1},
+            {"id": 3, "reason": "invalid_transition", "status": "completed", "version": 1},
+            {"id": 99, "reason": "not_found"},
+        ],
+    }
+
+def test_bulk_transition_rejects_unknown_status(client, appointments, patient_headers):
+    response = client.post("/appointments/status", headers=patient_headers, json={"status": "lost", "items": [{"id": 1}]})
+    assert response.status_code == 400
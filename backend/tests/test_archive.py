@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import insert
+from db.database import engine
+from db.models import Appointment, Feedback, appointments_archive, feedback_archive
+from app.archive import appointment_source, feedback_source
+
+@pytest.fixture
+def archived(db, patient_headers, doctor):
+    db.add(Appointment(id=2, patient_id=1, doctor_id=1, date="2030-01-02", time="09:00"))
+    db.commit()
+    old = datetime(2020, 1, 1)
+    db.execute(insert(appointments_archive).values(
+        id=1, patient_id=1, doctor_id=1, date="2020-01-01", time="09:00", status="completed",
+        version=1, created_at=old, updated_at=old, archived_at=old,
+    ))
+    db.execute(insert(feedback_archive).values(
+        id=1, patient_id=1, doctor_id=1, category_id=1, rating=5, comment="Kind staff", created_at=old, archived_at=old,
+    ))
+    db.commit()
+
+def test_only_recent_typed_lower_bounds_skip_the_archive():
+    assert appointment_source((datetime.utcnow() - timedelta(days=1)).date().isoformat()) is Appointment
+    for earliest in (None, "2020-01-01", "next Tuesday", "9999-99-99"):
+        assert appointment_source(earliest) is not Appointment
+    assert feedback_source(datetime.utcnow() - timedelta(days=1)) is Feedback
+    assert feedback_source(None) is not Feedback
+
+def test_unfiltered_listings_include_archived_rows(client, archived, patient_headers):
+    appointments = client.get("/appointments/", headers=patient_headers).json()
+    assert [item["id"] for item in appointments] == [1, 2]
+    until = client.get("/appointments/public/?date_to=2025-01-01").json()
+    assert [item["id"] for item in until] == [1]
+    feedback = client.get("/feedback/?until=2025-01-01T00:00:00").json()
+    assert [item["id"] for item in feedback] == [1]
+
+def test_archived_appointment_is_found_by_id(client, archived, patient_headers):
+    archived_row = client.get("/appointments/1", headers=patient_headers)
+    assert archived_row.json()["doctor_name"] == "Dr Eyong"
+    # Read-only: no version to send back in If-Match
+    assert "ETag" not in archived_row.headers
+    assert client.get("/appointments/2", headers=patient_headers).headers["ETag"] == '"1"'
+    batch = client.get("/appointments/batch?ids=1,2", headers=patient_headers).json()
+    assert [item["id"] for item in batch["items"]] == [1, 2]
+    assert batch["missing"] == []
+
+def test_patient_count_includes_archived_appointments(client, archived):
+    assert client.get("/doctor/1").json()["patientCount"] == 1
+
+@pytest.mark.skipif(engine.dialect.name == "sqlite", reason="SQLite has no DATETIME cast")
+def test_timeline_includes_archived_rows(client, archived, patient_headers):
+    items = client.get("/patients/1/timeline", headers=patient_headers).json()["items"]
+    assert {(item["kind"], item["id"]) for item in items} == {("appointment", 1), ("appointment", 2), ("feedback", 1)}
+
+@pytest.mark.skipif(engine.dialect.name == "sqlite", reason="SQLite has no data-modifying CTEs")
+def test_new_feedback_counts_patients_with_archived_appointments(client, db, archived):
+    db.query(Appointment).filter(Appointment.id == 2).delete()
+    db.commit()
+    response = client.post("/feedback/", json={"patient_id": 1, "doctor_id": 1, "category_id": 1, "rating": 4})
+    assert response.json()["doctor"]["patientCount"] == 1
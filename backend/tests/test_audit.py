@@ -0,0 +1,52 @@
+import os
+import queue
+from datetime import datetime
+from db.models import AuditLog, Patient
+from app.audit import AuditWriter, audit_writer
+
+def drain(writer):
+    """Write whatever the session hooks handed to the writer, without its thread"""
+    batch = []
+    while True:
+        try:
+            batch.append(writer.queue.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        writer.flush(batch)
+    return batch
+
+def test_only_committed_updates_are_logged(db, patient_headers):
+    drain(audit_writer)
+    patient = db.get(Patient, 1)
+    patient.first_name = "Abena"
+    db.flush()
+    db.rollback()
+    assert drain(audit_writer) == []
+
+    patient = db.get(Patient, 1)
+    patient.first_name = "Adjoa"
+    db.commit()
+    drain(audit_writer)
+    entries = db.query(AuditLog).filter(AuditLog.table_name == "patients", AuditLog.action == "update").all()
+    assert [(entry.record_id, entry.changes) for entry in entries] == [(1, {"first_name": ["Ama", "Adjoa"]})]
+
+def test_failed_batches_are_spilled_and_replayed(db, tmp_path, monkeypatch):
+    writer = AuditWriter(spill_path=str(tmp_path / "spill.jsonl"))
+    entry = {"table_name": "patients", "record_id": 1, "action": "delete", "changes": {}, "actor": None}
+
+    def unavailable(batch):
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr("app.audit.time.sleep", lambda seconds: None)
+    monkeypatch.setattr(writer, "write", unavailable)
+    writer.flush([{**entry, "changed_at": datetime(2030, 1, 1)}])
+    assert os.path.exists(writer.spill_path)
+    assert db.query(AuditLog).count() == 0
+
+    monkeypatch.undo()
+    writer.flush([{**entry, "record_id": 2, "changed_at": datetime(2030, 1, 2)}])
+    assert not os.path.exists(writer.spill_path)
+    assert sorted(row.record_id for row in db.query(AuditLog)) == [1, 2]
+    stats = writer.snapshot()
+    assert (stats["spilled"], stats["replayed"], stats["written"], stats["failed"]) == (1, 1, 1, 0)
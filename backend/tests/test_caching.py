@@ -0,0 +1,24 @@
+from datetime import datetime
+from db.models import Patient, TableVersion
+
+def test_listing_etag_is_weak_and_revalidates(client, db, patient_headers):
+    first = client.get("/patients/")
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+    assert client.get("/patients/", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/patients/", headers={"If-None-Match": etag[2:]}).status_code == 304
+
+def test_committed_writes_bump_the_table_version(client, db, patient_headers):
+    db.add(TableVersion(table_name="patients", version=7, changed_at=datetime(2030, 1, 1)))
+    db.commit()
+    before = client.get("/patients/")
+    assert before.headers["Last-Modified"] == "Tue, 01 Jan 2030 00:00:00 GMT"
+    db.add(Patient(id=2, email="b@dgh.cm", password="x"))
+    db.flush()
+    db.rollback()
+    assert db.get(TableVersion, "patients").version == 7
+    assert client.get("/patients/", headers={"If-None-Match": before.headers["ETag"]}).status_code == 304
+    db.add(Patient(id=2, email="b@dgh.cm", password="x"))
+    db.commit()
+    assert db.get(TableVersion, "patients").version == 8
+    assert client.get("/patients/", headers={"If-None-Match": before.headers["ETag"]}).status_code == 200
@@ -0,0 +1,26 @@
+import re
+from datetime import date
+from app.dates import ISO_DATE_PATTERN, TIME_PATTERN
+
+def is_date(text):
+    try:
+        date.fromisoformat(text)
+        return True
+    except ValueError:
+        return False
+
+def test_date_pattern_accepts_exactly_the_real_calendar_days():
+    pattern = re.compile(ISO_DATE_PATTERN)
+    for year in (1900, 1996, 2000, 2023, 2024, 2100):
+        for month in range(0, 14):
+            for day in range(0, 33):
+                text = f"{year:04d}-{month:02d}-{day:02d}"
+                assert bool(pattern.match(text)) == is_date(text), text
+
+def test_free_text_dates_and_times_are_rejected():
+    assert not re.match(ISO_DATE_PATTERN, "12/03/2024")
+    assert not re.match(ISO_DATE_PATTERN, "2024-3-1")
+    assert re.match(TIME_PATTERN, "09:30")
+    assert re.match(TIME_PATTERN, "23:59:59")
+    assert not re.match(TIME_PATTERN, "9h30")
+    assert not re.match(TIME_PATTERN, "24:00")
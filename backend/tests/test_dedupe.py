@@ -0,0 +1,72 @@
+from itertools import combinations
+from types import SimpleNamespace
+from db.models import Appointment, DuplicateCandidate, Patient
+from app import dedupe
+from app.audit import PENDING_KEY
+from app.dedupe import (
+    DUPLICATE_THRESHOLD, blocking_keys, email_local, features, fold, merge_patients, phone_key, score_pair,
+    score_pairs, soundex,
+)
+
+def person(id, first, last, phone=None, email=None):
+    return features(SimpleNamespace(id=id, first_name=first, last_name=last, phone_number=phone, email=email))
+
+def test_normalization():
+    assert fold("Ndjéyé-Mbarga") == "ndjeyembarga"
+    assert phone_key("+237 6 77 12 34 56") == phone_key("677123456") == "677123456"
+    assert phone_key("12345") == ""
+    assert email_local("Jean.Paul+clinic@example.cm") == "jeanpaul"
+    assert soundex("Robert") == soundex("Rupert") == "r163"
+
+def test_same_person_with_accents_and_swapped_names_scores_high():
+    a = person(1, "Ndjéyé", "Marie", "+237677123456", "marie.ndjeye@mail.cm")
+    b = person(2, "Marie", "Ndjeye", "677123456", "marie.ndjeye+dgh@mail.cm")
+    score, reasons = score_pair(a, b)
+    assert score == 1.0
+    assert set(reasons) == {"phone", "name", "email"}
+    assert blocking_keys(a) == blocking_keys(b)
+
+def test_siblings_sharing_a_phone_and_surname_stay_below_threshold():
+    a = person(1, "Paul", "Biya", "677123456")
+    b = person(2, "Esther", "Biya", "677123456")
+    score, _ = score_pair(a, b)
+    assert score < DUPLICATE_THRESHOLD
+
+def test_vectorized_scoring_matches_pair_by_pair(monkeypatch):
+    people = [
+        person(1, "Ndjéyé", "Marie", "+237677123456", "marie.ndjeye@mail.cm"),
+        person(2, "Marie", "Ndjeye", "677123456", "marie.ndjeye+dgh@mail.cm"),
+        person(3, "Paul", "Biya", "677123456"),
+        person(4, "Esther", "Biya", "677123456"),
+        person(5, "Marie", "Ndjeya", None, "mndjeye@mail.cm"),
+        person(6, "", "Ndjeye", "699000000"),
+    ]
+    by_id = {feature[0]: feature for feature in people}
+    pairs = set(combinations(by_id, 2))
+    vectorized = score_pairs(pairs, by_id)
+    monkeypatch.setattr(dedupe, "numpy", None)
+    one_by_one = score_pairs(pairs, by_id)
+    strip = lambda rows: [(row["patient_id"], row["duplicate_id"], row["score"], row["reasons"]) for row in rows]
+    assert strip(vectorized) == strip(one_by_one)
+    assert (1, 2) in {(row["patient_id"], row["duplicate_id"]) for row in vectorized}
+
+def test_merge_repoints_rows_and_audits_the_moves(db, doctor):
+    db.add_all([
+        Patient(id=1, email="a@dgh.cm", password="x", first_name="Marie", last_name="Ndjeye"),
+        Patient(id=2, email="b@dgh.cm", password="x", first_name="Marie", last_name="Ndjéyé", phone_number="677123456"),
+        Appointment(id=5, patient_id=2, doctor_id=1, date="2030-01-01", time="09:00", status="scheduled"),
+    ])
+    db.commit()
+    candidate = DuplicateCandidate(patient_id=1, duplicate_id=2, score=0.9, reasons={})
+    db.add(candidate)
+    db.commit()
+
+    result = merge_patients(db, candidate, keep_id=1)
+    assert result["moved"]["appointments"] == 1
+    entries = [entry for entry in db.info[PENDING_KEY] if entry["table_name"] == "appointments"]
+    assert [(entry["record_id"], entry["changes"]["patient_id"]) for entry in entries] == [(5, [2, 1])]
+    db.commit()
+    db.expire_all()
+    assert db.get(Appointment, 5).patient_id == 1
+    assert db.get(Patient, 1).phone_number == "677123456"
+    assert db.get(Patient, 2).merged_into_id == 1
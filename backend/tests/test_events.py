@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from datetime import datetime
+from sqlalchemy import insert
+from db.models import Appointment, appointments_archive
+from app import events
+from app.events import StatsBroadcaster, apply_delta
+
+def snapshot():
+    return {
+        "totalPatients": 0, "activePatients": 0, "totalDoctors": 0, "activeDoctors": 0,
+        "totalAppointments": 3, "scheduledAppointments": 2, "completedAppointments": 1, "cancelledAppointments": 0,
+        "totalFeedback": 0, "ratingSum": 0,
+    }
+
+def test_status_moves_and_deletes_adjust_the_counters():
+    stats = snapshot()
+    changes = apply_delta(stats, {"type": "appointment.status", "status": "completed", "previous": {"scheduled": 2}})
+    assert changes == {"scheduledAppointments": -2, "completedAppointments": 2}
+    apply_delta(stats, {"type": "appointment.deleted", "status": "completed"})
+    assert (stats["totalAppointments"], stats["completedAppointments"]) == (2, 2)
+
+class FakeReader:
+    """A snapshot that already includes feedback 1"""
+
+    def __init__(self, started, release):
+        started.set()
+        release.wait(5)
+        self.stats = snapshot()
+        self.closed = False
+
+    def unseen(self, pending):
+        return [event for event in pending if event["id"] != 1]
+
+    def close(self):
+        self.closed = True
+
+def test_events_published_while_seeding_are_applied_once(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    readers = []
+    monkeypatch.setattr(events, "open_snapshot", lambda: readers.append(FakeReader(started, release)) or readers[-1])
+
+    async def scenario():
+        broadcaster = StatsBroadcaster(reseed_seconds=0)
+        broadcaster.attach(asyncio.get_running_loop())
+        subscribing = asyncio.ensure_future(broadcaster.subscribe())
+        await asyncio.to_thread(started.wait, 5)
+        broadcaster.publish("feedback.created", id=1, doctor_id=1, rating=5)
+        broadcaster.publish("feedback.created", id=2, doctor_id=1, rating=4)
+        await asyncio.sleep(0)
+        release.set()
+        await subscribing
+        return broadcaster.current()
+
+    current = asyncio.run(scenario())
+    assert (current["stats"]["totalFeedback"], current["stats"]["ratingSum"]) == (1, 4)
+    assert readers[0].closed
+
+def test_reseed_resyncs_subscribers_when_the_numbers_moved(monkeypatch):
+    stats = [snapshot()]
+
+    class Reader:
+        def __init__(self):
+            self.stats = dict(stats[0])
+
+        def unseen(self, pending):
+            return pending
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(events, "open_snapshot", Reader)
+
+    async def scenario():
+        broadcaster = StatsBroadcaster(reseed_seconds=0)
+        subscriber = await broadcaster.subscribe()
+        await broadcaster.reseed()
+        assert subscriber.queue.empty()
+        # Another worker stored feedback
+        stats[0] = {**stats[0], "totalFeedback": 1, "ratingSum": 3}
+        await broadcaster.reseed()
+        return subscriber.queue.get_nowait(), broadcaster.current()
+
+    message, current = asyncio.run(scenario())
+    assert message == {"type": "resync"}
+    assert (current["stats"]["totalFeedback"], current["version"]) == (1, 1)
+
+def test_reader_drops_events_already_in_its_snapshot(db, patient_headers, doctor):
+    db.add(Appointment(id=1, patient_id=1, doctor_id=1, date="2030-01-02", time="09:00", status="completed"))
+    db.add(Appointment(id=2, patient_id=1, doctor_id=1, date="2030-01-03", time="09:00"))
+    db.commit()
+    reader = events.open_snapshot()
+    try:
+        unseen = reader.unseen([
+            {"type": "appointment.created", "id": 2, "doctor_id": 1, "status": "scheduled"},
+            {"type": "appointment.created", "id": 3, "doctor_id": 1, "status": "scheduled"},
+            {"type": "appointment.status", "status": "completed", "previous": {"scheduled": 2}, "moved": [
+                {"id": 1, "previous": "scheduled", "version": 1},
+                {"id": 3, "previous": "scheduled", "version": 2},
+            ]},
+            {"type": "appointment.deleted", "id": 2, "doctor_id": 1, "status": "scheduled"},
+            {"type": "appointment.deleted", "id": 4, "doctor_id": 1, "status": "scheduled"},
+        ])
+    finally:
+        reader.close()
+    assert [(event["type"], event.get("id")) for event in unseen] == [
+        ("appointment.created", 3), ("appointment.status", None), ("appointment.deleted", 2),
+    ]
+    assert unseen[1]["previous"] == {"scheduled": 1}
+
+def test_snapshot_counts_archived_rows(db, patient_headers, doctor):
+    db.add(Appointment(id=2, patient_id=1, doctor_id=1, date="2030-01-02", time="09:00"))
+    db.execute(insert(appointments_archive).values(
+        id=1, patient_id=1, doctor_id=1, date="2020-01-01", time="09:00", status="completed", archived_at=datetime(2021, 1, 1),
+    ))
+    db.commit()
+    stats = events.compute_snapshot()
+    assert (stats["totalAppointments"], stats["scheduledAppointments"], stats["completedAppointments"]) == (2, 1, 1)
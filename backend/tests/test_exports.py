@@ -0,0 +1,16 @@
+from datetime import datetime, timedelta
+from db.models import Feedback
+
+def test_exports_are_admin_only(client, patient_headers):
+    assert client.get("/exports/feedback", headers=patient_headers).status_code == 403
+
+def test_feedback_csv_export(client, db, admin_headers):
+    created = datetime.utcnow() - timedelta(minutes=5)
+    db.add_all([Feedback(rating=rating, comment=f"visit {rating}", created_at=created) for rating in (3, 5)])
+    db.commit()
+    response = client.get("/exports/feedback?include_archive=false", headers=admin_headers)
+    assert response.status_code == 200
+    lines = response.text.strip().splitlines()
+    assert lines[0].startswith("id,created_at,patient_id")
+    assert len(lines) == 3
+    assert response.headers["X-Export-Until-Id"] == "2"
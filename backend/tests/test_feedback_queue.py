@@ -0,0 +1,58 @@
+import queue
+import pytest
+from db.models import Feedback, FeedbackCategory, Patient
+from app.feedback_queue import FeedbackIngestQueue
+
+@pytest.fixture
+def references(db, doctor):
+    db.add(Patient(id=1, email="a@dgh.cm", password="x", first_name="Ama", last_name="Ngo"))
+    db.add(Patient(id=2, email="b@dgh.cm", password="x", first_name="Bih", last_name="Tabi"))
+    db.add(FeedbackCategory(id=1, name="Wait Time"))
+    db.commit()
+
+def feedback(patient_id=1, doctor_id=1, rating=4):
+    return {"patient_id": patient_id, "doctor_id": doctor_id, "category_id": 1, "rating": rating, "comment": "ok"}
+
+def drain(ingest):
+    batch = []
+    while not ingest.queue.empty():
+        batch.append(ingest.queue.get_nowait())
+    ingest.flush(batch)
+
+def test_ticket_is_queued_before_the_writer_can_see_it():
+    ingest = FeedbackIngestQueue(max_size=1)
+    ticket = ingest.submit(feedback())
+    assert ingest.ticket_status(ticket) == {"status": "queued"}
+    with pytest.raises(queue.Full):
+        ingest.submit(feedback())
+    assert len(ingest.tickets) == 1
+    assert ingest.snapshot()["rejectedFull"] == 1
+
+def test_flush_stores_valid_rows_and_rejects_unknown_references(db, references):
+    ingest = FeedbackIngestQueue()
+    good = [ingest.submit(feedback(rating=rating)) for rating in (3, 5)]
+    bad = ingest.submit(feedback(doctor_id=99))
+    drain(ingest)
+    assert [ingest.ticket_status(ticket)["status"] for ticket in good] == ["stored", "stored"]
+    assert ingest.ticket_status(bad) == {"status": "rejected", "detail": "Unknown doctor_id"}
+    assert db.query(Feedback).count() == 2
+    assert ingest.snapshot()["stored"] == 2
+
+def test_stale_cached_patient_only_rejects_its_own_row(db, references):
+    ingest = FeedbackIngestQueue()
+    ingest.references.patients = {1, 2, 3}  # 3 was merged away after being cached
+    tickets = [ingest.submit(feedback(patient_id=patient_id)) for patient_id in (1, 3, 2)]
+    drain(ingest)
+    statuses = [ingest.ticket_status(ticket)["status"] for ticket in tickets]
+    assert statuses == ["stored", "rejected", "stored"]
+    assert db.query(Feedback).count() == 2
+    assert ingest.references.patients == set()
+
+def test_other_workers_answer_from_the_stored_outcome(db, references):
+    ingest, other_worker = FeedbackIngestQueue(), FeedbackIngestQueue()
+    stored, rejected = ingest.submit(feedback()), ingest.submit(feedback(doctor_id=99))
+    assert other_worker.ticket_status(stored, db) == {"status": "queued"}
+    drain(ingest)
+    assert other_worker.ticket_status(stored, db) == {"status": "stored", "feedback_id": 1}
+    assert other_worker.ticket_status(rejected, db) == {"status": "rejected", "detail": "Unknown doctor_id"}
+    assert other_worker.ticket_status("1-" + "0" * 32, db) is None
@@ -0,0 +1,32 @@
+import pytest
+
+numpy = pytest.importorskip("numpy")
+from app.forecast import SEASON_DAYS, fit, project  # noqa: E402
+
+WEEK = numpy.array([20.0, 24, 22, 26, 30, 8, 4])
+
+def weekly(weeks, trend=0.0, noise=0.0, seed=3):
+    days = numpy.arange(weeks * SEASON_DAYS)
+    rng = numpy.random.default_rng(seed)
+    return numpy.tile(WEEK, weeks) + trend * days + rng.normal(0, noise, days.size) if noise else numpy.tile(WEEK, weeks) + trend * days
+
+def test_fit_reproduces_an_exact_weekly_season():
+    series = numpy.vstack([weekly(12), 2 * weekly(12)])
+    expected, lower, upper = project(fit(series), series.shape[1], 14)
+    assert expected.shape == (2, 14)
+    assert numpy.allclose(expected[0], numpy.tile(WEEK, 2), atol=0.5)
+    assert numpy.allclose(expected[1], 2 * numpy.tile(WEEK, 2), atol=1.0)
+    assert numpy.all(lower <= expected) and numpy.all(expected <= upper)
+
+def test_noisy_series_gets_wider_bands_that_grow_with_the_horizon():
+    series = numpy.vstack([weekly(20), weekly(20, noise=3.0)])
+    expected, lower, upper = project(fit(series), series.shape[1], 28)
+    spread = upper - expected  # lower is clipped at zero
+    assert spread[1].mean() > spread[0].mean()
+    assert spread[1, -1] > spread[1, 0]
+    assert abs(expected[1].mean() - WEEK.mean()) < 3
+
+def test_forecasts_are_never_negative():
+    falling = numpy.vstack([numpy.clip(weekly(8, trend=-0.5), 0, None)])
+    expected, lower, _ = project(fit(falling), falling.shape[1], 28)
+    assert expected.min() >= 0 and lower.min() >= 0
@@ -0,0 +1,17 @@
+from db.models import Job
+from app.jobs import enqueue
+
+def test_archive_run_is_admin_only(client, patient_headers):
+    assert client.post("/archive/run", headers=patient_headers).status_code == 403
+
+def test_jobs_are_visible_to_admins_and_their_creator(client, db, admin_headers, patient_headers):
+    queued = client.post("/archive/run", headers=admin_headers).json()
+    assert db.get(Job, queued["id"]).created_by == "admin:1"
+    own = enqueue(db, "archive.run", {})
+    own.created_by = "patient:1"
+    db.commit()
+
+    assert client.get(f"/jobs/{queued['id']}", headers=patient_headers).status_code == 404
+    assert [job["id"] for job in client.get("/jobs", headers=patient_headers).json()] == [own.id]
+    assert client.get(f"/jobs/{own.id}", headers=patient_headers).status_code == 200
+    assert len(client.get("/jobs", headers=admin_headers).json()) == 2
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+import pytest
+from db.database import engine
+from db.models import Appointment, DailyKpi, Job
+from app.kpis import ensure_kpi_snapshots, roll_up, rollup_target
+
+@pytest.fixture
+def appointments(db, patient_headers, doctor):
+    created = datetime.utcnow() - timedelta(days=3)
+    db.add_all([
+        Appointment(id=i, patient_id=1, doctor_id=1, date="2030-01-01", time="09:00", created_at=created)
+        for i in (1, 2)
+    ])
+    db.commit()
+
+def test_dashboard_reads_do_not_write_snapshots(client, db, appointments):
+    response = client.get("/statistics/hospital")
+    assert response.status_code == 200
+    assert db.query(DailyKpi).count() == 0
+    # No baseline yet: totals, but no made-up changes
+    cards = {card["title"]: card for card in response.json()}
+    assert (cards["Appointments"]["value"], cards["Appointments"]["change"]) == ("2", "n/a")
+
+def test_start_queues_the_first_roll_up_once(db, appointments, client):
+    ensure_kpi_snapshots(db)
+    assert [job.kind for job in db.query(Job).all()] == ["kpis.roll_up"]
+
+@pytest.mark.skipif(engine.dialect.name == "sqlite", reason="SQLite has no DATE cast")
+def test_roll_up_recomputes_totals_after_deletes(db, appointments):
+    through = rollup_target()
+    roll_up(db, through)
+    db.commit()
+    assert db.get(DailyKpi, through).appointments == 2
+    db.query(Appointment).filter(Appointment.id == 2).delete()
+    roll_up(db, through)
+    db.commit()
+    db.expire_all()
+    assert db.get(DailyKpi, through).appointments == 1
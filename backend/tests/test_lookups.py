@@ -0,0 +1,29 @@
+from db.models import Specialty
+from app.lookups import find, lookup_key, near_misses
+
+def add_specialties(db, *names):
+    for name in names:
+        db.add(Specialty(name=name, key=lookup_key(name)))
+    db.commit()
+
+def test_lookup_key_folds_case_accents_and_punctuation():
+    assert lookup_key("  Obstétrique & Gynéco ") == "obstetrique gyneco"
+    assert lookup_key(None) == ""
+
+def test_find_matches_the_folded_key_only(db):
+    add_specialties(db, "Hematology", "Interventional Cardiology")
+    assert find(db, Specialty, "HEMATOLOGY").name == "Hematology"
+    assert find(db, Specialty, "Hepatology") is None
+    assert find(db, Specialty, "Interventional Radiology") is None
+    assert find(db, Specialty, "  ") is None
+
+def test_similar_names_are_reported_not_merged(db):
+    add_specialties(db, "Hematology", "Hepatology", "Cardiology", "Cardiolgy", "Dermatology")
+    pairs = [sorted(entry["name"] for entry in pair["entries"]) for pair in near_misses(db, Specialty)]
+    assert ["Cardiolgy", "Cardiology"] in pairs
+    assert ["Hematology", "Hepatology"] in pairs
+    assert all("Dermatology" not in pair for pair in pairs)
+
+def test_review_is_admin_only(client, admin_headers, patient_headers):
+    assert client.get("/lookups/review", headers=patient_headers).status_code == 403
+    assert client.get("/lookups/review", headers=admin_headers).json() == {"specialties": [], "categories": []}
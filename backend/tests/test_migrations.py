@@ -0,0 +1,13 @@
+import warnings
+from pathlib import Path
+import db.migrations
+
+def test_migrations_compile_without_invalid_escape_warnings():
+    source = Path(db.migrations.__file__).read_text()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        compile(source, db.migrations.__file__, "exec")
+
+def test_medication_date_patterns_reach_postgres_unescaped():
+    statement = next(statement for statement in db.migrations.MIGRATIONS if "legacy_date" in statement)
+    assert r"'^\d{4}[-/]\d{1,2}[-/]\d{1,2}$'" in statement
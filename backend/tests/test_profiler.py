@@ -0,0 +1,70 @@
+import time
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from app.profiler import Profiler, ProfilerMiddleware, instrument_routes, profiler, route_labels
+
+def busy(seconds):
+    started = time.monotonic()
+    while time.monotonic() - started < seconds:
+        pass
+
+def profiled_app():
+    app = FastAPI()
+    router = APIRouter()
+
+    @router.get("/slow")
+    def slow():
+        busy(0.2)
+        return {}
+
+    @router.get("/slow-async")
+    async def slow_async():
+        busy(0.2)
+        return {}
+
+    app.include_router(router, prefix="/included")
+    app.add_middleware(ProfilerMiddleware)
+    instrument_routes(app)
+    return app
+
+def test_tagged_request_on_included_router_is_sampled():
+    client = TestClient(profiled_app())
+    for path in ("/included/slow", "/included/slow-async"):
+        tag = profiler.create_tag(interval_ms=2)
+        assert client.get(path, headers={"X-Profile-Tag": tag}).status_code == 200
+        entry = profiler.tagged(tag)
+        assert entry["status"] == "finished"
+        assert entry["request"] == f"GET {path}"
+        summary = entry["sampler"].profile.summary()
+        assert summary["samples"] > 0
+        assert summary["routes"][0]["route"] == f"GET {path}"
+
+def test_routes_map_to_their_full_path():
+    profiled_app()
+    assert "GET /included/slow" in route_labels.values()
+
+def test_untagged_and_reused_tags_are_not_profiled():
+    client = TestClient(profiled_app())
+    tag = profiler.create_tag()
+    client.get("/included/slow", headers={"X-Profile-Tag": tag})
+    first = profiler.tagged(tag)["sampler"]
+    client.get("/included/slow", headers={"X-Profile-Tag": tag})
+    assert profiler.tagged(tag)["sampler"] is first
+    assert not profiler.begin_tagged("unknown")
+
+def test_eviction_keeps_running_tags():
+    tags = Profiler()
+    running = tags.create_tag()
+    assert tags.begin_tagged(running)
+    for _ in range(60):
+        tags.create_tag()
+    assert tags.tagged(running)["status"] == "running"
+    tags.end_tagged(running, "GET", "/", 200)
+    assert tags.tagged(running)["status"] == "finished"
+    tags.end_tagged("evicted", "GET", "/", 200)
+
+def test_profile_endpoint_is_admin_only(client, patient_headers, admin_headers):
+    assert client.post("/admin/profile?seconds=0.05", headers=patient_headers).status_code == 403
+    response = client.post("/admin/profile?seconds=0.05&format=collapsed", headers=admin_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
@@ -0,0 +1,19 @@
+import pytest
+from db.database import engine
+from db.models import DoctorRatingStat, Feedback, Specialty
+from app.ratings import leaderboard, rebuild_rating_stats
+
+def test_refresh_is_admin_only(client, db, patient_headers):
+    assert client.post("/statistics/doctor-rankings/refresh", headers=patient_headers).status_code == 403
+
+@pytest.mark.skipif(engine.dialect.name == "sqlite", reason="SQLite has no power() or extract(epoch)")
+def test_rebuild_keeps_specialty_leaderboards(db, patient_headers, doctor):
+    db.add(Specialty(id=1, name="Cardiology"))
+    doctor.specialty_id = 1
+    db.add_all([Feedback(patient_id=1, doctor_id=1, category_id=1, rating=rating) for rating in (5, 4, 2)])
+    db.commit()
+    rebuild_rating_stats(db)
+    db.commit()
+    stat = db.get(DoctorRatingStat, 1)
+    assert (stat.specialty_id, stat.ratings, stat.rating_sum, stat.positive) == (1, 3, 11, 2)
+    assert [row["doctorId"] for row in leaderboard(db, specialty="cardiology")] == [1]
@@ -0,0 +1,35 @@
+import threading
+import time
+from db.database import REPLICA_LAG_STALE_SECONDS, ReplicaLagMonitor
+
+class SlowMonitor(ReplicaLagMonitor):
+    def __init__(self):
+        super().__init__(interval=0)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def measure(self):
+        self.started.set()
+        self.release.wait(5)
+        return 0.5
+
+def test_callers_get_the_previous_lag_while_a_check_is_in_flight():
+    monitor = SlowMonitor()
+    monitor.lag, monitor.measured_at = 1.0, time.monotonic()
+    measuring = threading.Thread(target=monitor.current_lag)
+    measuring.start()
+    assert monitor.started.wait(5)
+    assert monitor.current_lag() == 1.0
+    monitor.release.set()
+    measuring.join()
+    assert monitor.lag == 0.5
+
+def test_a_stale_lag_is_not_trusted_while_a_check_is_in_flight():
+    monitor = SlowMonitor()
+    monitor.lag, monitor.measured_at = 1.0, time.monotonic() - REPLICA_LAG_STALE_SECONDS - 1
+    measuring = threading.Thread(target=monitor.current_lag)
+    measuring.start()
+    assert monitor.started.wait(5)
+    assert monitor.current_lag() is None
+    monitor.release.set()
+    measuring.join()
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+from app.singleflight import SingleFlight, singleflight
+
+def join_while_running(flight, fn, callers):
+    """Start ``callers`` threads on one key while the leader is blocked in ``fn``"""
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(("stats",), fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+def wait_for_joiners(flight, count):
+    while flight.snapshot()["endpoints"].get("stats", {}).get("coalesced", 0) < count:
+        threading.Event().wait(0.01)
+
+def test_sync_callers_share_one_execution():
+    flight = SingleFlight(timeout=5)
+    started, release = threading.Event(), threading.Event()
+    executions = []
+
+    def compute():
+        executions.append(1)
+        started.set()
+        release.wait(5)
+        return {"total": 3}
+
+    threads, results, errors = join_while_running(flight, compute, 1)
+    started.wait(5)
+    more, more_results, _ = join_while_running(flight, compute, 3)
+    wait_for_joiners(flight, 3)
+    release.set()
+    for thread in threads + more:
+        thread.join(5)
+    assert len(executions) == 1
+    assert results + more_results == [{"total": 3}] * 4
+    assert not errors
+
+    stats = flight.snapshot()
+    endpoint = stats["endpoints"]["stats"]
+    assert endpoint == {"calls": 4, "executions": 1, "coalesced": 3, "errors": 0, "timeouts": 0, "inFlight": 0}
+    assert endpoint["calls"] == endpoint["executions"] + endpoint["coalesced"]
+    assert stats["savedExecutions"] == 3
+
+def test_leader_errors_reach_every_joined_caller():
+    flight = SingleFlight(timeout=5)
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("database unavailable")
+
+    threads, _, errors = join_while_running(flight, fail, 1)
+    started.wait(5)
+    more, _, more_errors = join_while_running(flight, fail, 2)
+    wait_for_joiners(flight, 2)
+    release.set()
+    for thread in threads + more:
+        thread.join(5)
+    assert [str(e) for e in errors + more_errors] == ["database unavailable"] * 3
+    assert flight.snapshot()["endpoints"]["stats"]["errors"] == 1
+    # Nothing is cached: the next call runs again
+    assert flight.do(("stats",), lambda: "fresh") == "fresh"
+
+def test_joined_caller_times_out_with_504():
+    flight = SingleFlight(timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+
+    @singleflight("slow", flight=flight)
+    def slow(period: str = "week"):
+        started.set()
+        release.wait(5)
+        return period
+
+    leader = threading.Thread(target=slow, kwargs={"period": "week"})
+    leader.start()
+    started.wait(5)
+    with pytest.raises(HTTPException) as raised:
+        slow(period="week")
+    release.set()
+    leader.join(5)
+    assert raised.value.status_code == 504
+    assert flight.snapshot()["endpoints"]["slow"]["timeouts"] == 1
+
+def test_async_callers_share_one_task():
+    flight = SingleFlight(timeout=5)
+    executions = []
+
+    async def compute(release):
+        executions.append(1)
+        await release.wait()
+        return "done"
+
+    async def scenario():
+        release = asyncio.Event()
+        callers = [asyncio.ensure_future(flight.do_async(("stats",), compute, release)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*callers)
+
+    assert asyncio.run(scenario()) == ["done"] * 3
+    assert len(executions) == 1
+    endpoint = flight.snapshot()["endpoints"]["stats"]
+    assert (endpoint["calls"], endpoint["executions"], endpoint["coalesced"], endpoint["inFlight"]) == (3, 1, 2, 0)
+
+def test_disconnecting_async_caller_does_not_cancel_the_shared_task():
+    flight = SingleFlight(timeout=5)
+
+    async def compute(release):
+        await release.wait()
+        return "done"
+
+    async def scenario():
+        release = asyncio.Event()
+        leaving = asyncio.ensure_future(flight.do_async(("stats",), compute, release))
+        staying = asyncio.ensure_future(flight.do_async(("stats",), compute, release))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        await asyncio.gather(leaving, return_exceptions=True)
+        release.set()
+        return leaving.cancelled(), await staying
+
+    assert asyncio.run(scenario()) == (True, "done")
+    assert flight.snapshot()["endpoints"]["stats"]["errors"] == 0
@@ -0,0 +1,52 @@
+from app.sms import CompiledTemplate, capacity, cost_report, measure, render, segment_count, septets, to_gsm7
+
+def test_segment_limits():
+    assert segment_count(160, "gsm7") == 1
+    assert segment_count(161, "gsm7") == 2
+    assert segment_count(306, "gsm7") == 2
+    assert segment_count(307, "gsm7") == 3
+    assert segment_count(70, "ucs2") == 1
+    assert segment_count(71, "ucs2") == 2
+    assert capacity(1, "gsm7") == 160
+    assert capacity(2, "ucs2") == 134
+
+def test_extended_characters_take_two_septets():
+    assert septets("a€[") == 5
+    assert measure("€" * 80).segments == 1
+    assert measure("€" * 81).segments == 2
+
+def test_one_character_outside_gsm7_switches_to_ucs2():
+    message = measure("a" * 100 + "ɛ")
+    assert message.encoding == "ucs2"
+    assert message.segments == 2
+
+def test_accents_are_dropped_only_when_gsm7_cannot_carry_them():
+    assert to_gsm7("é") == "é"
+    assert to_gsm7("Hôpital") == "Hopital"
+    assert to_gsm7("l’œuf") == "l'oeuf"
+    assert to_gsm7("bɛ̀ɛ́") is None
+
+def test_french_reminder_is_sent_as_gsm7():
+    message = render("reminder", "fr", medication="Paracétamol", time="08:00", frequency="matin et soir")
+    assert message.encoding == "gsm7"
+    assert message.transliterated
+    assert "Hopital Général de Douala" in message.body
+
+def test_long_field_is_truncated_to_one_segment():
+    template = CompiledTemplate("Take your {medication:trunc} at {time}.")
+    message = template.render({"medication": "x" * 300, "time": "08:00"}, max_segments=1)
+    assert message.truncated
+    assert message.segments == 1
+    assert message.length == septets(message.body) <= 160
+    assert message.body.endswith("x. at 08:00.")
+
+def test_cost_report_counts_segments():
+    report = cost_report([measure("hi"), measure("a" * 200), measure("ɛ")])
+    assert report["messages"] == 3
+    assert report["segments"] == 4
+    assert report["multiSegment"] == 1
+    assert report["ucs2"] == 1
+
+def test_reminder_run_is_admin_only(client, patient_headers, admin_headers):
+    assert client.post("/reminders/run?dry_run=true", headers=patient_headers).status_code == 403
+    assert client.post("/reminders/run?dry_run=true", headers=admin_headers).status_code == 202
@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+import pytest
+from db.database import engine
+from db.models import Appointment, Tombstone
+from app import sync
+from app.archive import archive_batch
+
+@pytest.fixture
+def appointments(db, patient_headers, doctor, monkeypatch):
+    monkeypatch.setattr(sync, "SYNC_SAFETY_SECONDS", -1)
+    db.add_all([
+        Appointment(id=1, patient_id=1, doctor_id=1, date="2020-01-01", time="09:00"),
+        Appointment(id=2, patient_id=1, doctor_id=1, date="2030-01-02", time="09:00"),
+    ])
+    db.commit()
+
+def test_deletes_are_synced_as_tombstones(client, appointments, patient_headers):
+    first = client.get("/sync?collections=appointments", headers=patient_headers).json()
+    assert [row["id"] for row in first["collections"]["appointments"]["changed"]] == [1, 2]
+    client.delete("/appointments/2", headers=patient_headers)
+    later = client.get(f"/sync?collections=appointments&since={first['next']}", headers=patient_headers).json()
+    assert later["collections"]["appointments"] == {"changed": [], "deleted": [2], "has_more": False}
+
+def test_horizon_never_passes_now(db):
+    assert sync.sync_horizon(db) <= datetime.utcnow() - timedelta(seconds=sync.SYNC_SAFETY_SECONDS)
+
+@pytest.mark.skipif(engine.dialect.name == "sqlite", reason="SQLite has no data-modifying CTEs")
+def test_archived_rows_leave_tombstones(db, appointments):
+    assert archive_batch(db, "appointments") == 1
+    db.commit()
+    assert [(t.collection, t.record_id) for t in db.query(Tombstone)] == [("appointments", 1)]
@@ -0,0 +1,3 @@
+def test_indexer_run_is_admin_only(client, patient_headers, admin_headers):
+    assert client.post("/analytics/feedback/index", headers=patient_headers).status_code == 403
+    assert client.post("/analytics/feedback/index", headers=admin_headers).status_code == 200
@@ -0,0 +1,43 @@
+from datetime import datetime
+import pytest
+from db.database import engine
+from db.models import Appointment, Feedback
+
+@pytest.fixture
+def headers(patient_headers, doctor):
+    return patient_headers
+
+def test_timeline_requires_authentication(client, headers):
+    assert client.get("/patients/1/timeline").status_code == 401
+
+def test_patient_batch_requires_authentication(client, headers):
+    assert client.get("/patients/batch?ids=1").status_code == 401
+    assert [item["id"] for item in client.get("/patients/batch?ids=1", headers=headers).json()["items"]] == [1]
+
+def test_rows_without_a_timestamp_are_left_out(client, db, headers):
+    db.add_all([
+        Feedback(id=1, patient_id=1, rating=4, created_at=datetime(2030, 1, 2)),
+        Feedback(id=2, patient_id=1, rating=2),
+        Feedback(id=3, patient_id=1, rating=5, created_at=datetime(2030, 1, 3)),
+    ])
+    db.commit()
+    db.query(Feedback).filter(Feedback.id == 2).update({"created_at": None})
+    db.commit()
+    first = client.get("/patients/1/timeline?limit=1", headers=headers).json()
+    assert [item["id"] for item in first["items"]] == [3]
+    rest = client.get(f"/patients/1/timeline?limit=5&cursor={first['next_cursor']}", headers=headers).json()
+    assert [item["id"] for item in rest["items"]] == [1]
+    assert rest["next_cursor"] is None
+
+@pytest.mark.skipif(engine.dialect.name == "sqlite", reason="SQLite has no DATETIME cast")
+def test_malformed_appointment_date_falls_back_to_creation_time(client, db, headers):
+    db.add_all([
+        Appointment(id=1, patient_id=1, doctor_id=1, date="2030-01-05", time="09:30", created_at=datetime(2029, 1, 1)),
+        Appointment(id=2, patient_id=1, doctor_id=1, date="next Tuesday", time="9h", created_at=datetime(2029, 6, 1)),
+    ])
+    db.commit()
+    items = client.get("/patients/1/timeline", headers=headers).json()["items"]
+    assert [(item["id"], item["occurred_at"]) for item in items] == [
+        (1, "2030-01-05T09:30:00"),
+        (2, "2029-06-01T00:00:00"),
+    ]